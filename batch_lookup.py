@@ -0,0 +1,366 @@
+"""Batch lookup of many student numbers from the command line.
+
+Reads student numbers from a file (or stdin), fetches them through the same
+rate limiter and result cache as the bot, and streams one result per student
+to a JSONL or CSV file as soon as it completes. Re-running the same command
+resumes: numbers already in the output file are skipped, except those whose
+fetch failed (status "error"), which are fetched again.
+
+Examples:
+    python batch_lookup.py roster.txt -o results.jsonl
+    cat roster.txt | python batch_lookup.py - -o results.csv --format csv
+    python batch_lookup.py roster.txt -o year4.jsonl --year 4 --specialization computer
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import re
+import sys
+import time
+
+import telegram_bot
+from telegram_bot import (
+    FetchFailed,
+    calculate_marks_statistics,
+    fetch_student_marks,
+    filter_marks_by_academic_year,
+    get_missing_subjects,
+)
+
+logger = logging.getLogger("batch_lookup")
+
+CSV_FIELDS = [
+    "student_number",
+    "status",
+    "student_name",
+    "subject",
+    "year",
+    "semester",
+    "final_mark",
+    "result",
+]
+
+
+def read_student_numbers(source):
+    """Read unique, valid 10-digit student numbers in input order."""
+    stream = sys.stdin if source == "-" else open(source, encoding="utf-8")
+    try:
+        seen = set()
+        numbers = []
+        for line_number, line in enumerate(stream, start=1):
+            value = line.strip()
+            if not value or value.startswith("#"):
+                continue
+            if not re.match(r"^\d{10}$", value):
+                logger.warning(
+                    f"Skipping invalid student number on line {line_number}: {value}"
+                )
+                continue
+            if value not in seen:
+                seen.add(value)
+                numbers.append(value)
+        return numbers
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def read_completed(output_path, output_format):
+    """Return the student numbers with a result in an existing output file.
+
+    Failed fetches don't count, so a re-run retries them; their rows stay in
+    the file, before the row of the retry.
+    """
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+
+    with open(output_path, encoding="utf-8", newline="") as f:
+        # A last line without its newline was torn by an interrupted run: it
+        # doesn't count (ResultWriter cuts it off) and is fetched again
+        lines = [line for line in f if line.endswith("\n")]
+    if output_format == "csv":
+        records = csv.DictReader(lines)
+    else:
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    for record in records:
+        if record.get("student_number") and record.get("status") != "error":
+            completed.add(record["student_number"])
+    return completed
+
+
+def build_record(
+    student_number, marks_data, academic_year, specialization, department_id
+):
+    """Turn a fetched result into one output record."""
+    if not marks_data or not marks_data["data"]:
+        return {"student_number": student_number, "status": "not_found"}
+
+    student_name = marks_data.get("student_name", "غير محدد")
+    selected = marks_data
+    missing_subjects = None
+    if academic_year:
+        selected = filter_marks_by_academic_year(
+            marks_data, academic_year, specialization, department_id
+        )
+        if not selected or not selected["data"]:
+            return {
+                "student_number": student_number,
+                "status": "no_results",
+                "student_name": student_name,
+            }
+        missing_subjects = get_missing_subjects(
+            selected, academic_year, specialization, department_id
+        )
+
+    successful_subjects, failed_subjects, average = calculate_marks_statistics(selected)
+    record = {
+        "student_number": student_number,
+        "status": "ok",
+        "student_name": student_name,
+        "total_subjects": len(selected["data"]),
+        "successful_subjects": successful_subjects,
+        "failed_subjects": failed_subjects,
+        "average": round(average, 2),
+        "subjects": [
+            {
+                "subject": row[0],
+                "year": row[1],
+                "semester": row[2],
+                "final_mark": row[5],
+                "result": row[6] if len(row) > 6 else "",
+            }
+            for row in selected["data"]
+            if len(row) >= 6
+        ],
+    }
+    if missing_subjects is not None:
+        record["missing_subjects"] = missing_subjects
+    return record
+
+
+def cut_torn_line(path):
+    """Truncate a last line left without its newline by an interrupted run."""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        end = size = f.seek(0, os.SEEK_END)
+        while end > 0:
+            start = max(0, end - 4096)
+            f.seek(start)
+            chunk = f.read(end - start)
+            newline = chunk.rfind(b"\n")
+            if newline >= 0:
+                if start + newline + 1 < size:
+                    f.truncate(start + newline + 1)
+                return
+            end = start
+        f.truncate(0)
+
+
+class ResultWriter:
+    """Append records to the output file, flushing after each student."""
+
+    def __init__(self, output_path, output_format):
+        self.output_format = output_format
+        # Appending after a torn line would glue the next record onto it
+        cut_torn_line(output_path)
+        is_new = not os.path.exists(output_path) or os.path.getsize(output_path) == 0
+        self._file = open(output_path, "a", encoding="utf-8", newline="")
+        self._csv = None
+        if output_format == "csv":
+            self._csv = csv.DictWriter(self._file, fieldnames=CSV_FIELDS)
+            if is_new:
+                self._csv.writeheader()
+
+    def write(self, record):
+        if self._csv is None:
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        else:
+            base = {
+                "student_number": record["student_number"],
+                "status": record["status"],
+                "student_name": record.get("student_name", ""),
+            }
+            subjects = record.get("subjects") or [{}]
+            for subject in subjects:
+                self._csv.writerow({**base, **subject})
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+async def run_batch(
+    numbers, writer, department_id, academic_year, specialization, concurrency
+):
+    """Fetch all numbers with bounded concurrency, writing results as they finish."""
+    queue = asyncio.Queue()
+    for number in numbers:
+        queue.put_nowait(number)
+
+    counts = {"done": 0, "ok": 0, "error": 0}
+    started = time.perf_counter()
+
+    async def worker():
+        while True:
+            try:
+                student_number = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                marks_data = await fetch_student_marks(
+                    student_number,
+                    "all",
+                    department_id,
+                    priority="batch",
+                    raise_errors=True,
+                )
+                # Filtering runs in the parse process pool when enabled
+                record = await telegram_bot.run_cpu_bound(
+                    build_record,
+                    student_number,
+                    marks_data,
+                    academic_year,
+                    specialization,
+                    department_id,
+                )
+            except FetchFailed as e:
+                logger.error(f"Could not fetch {student_number}: {e}")
+                record = {"student_number": student_number, "status": "error"}
+            except Exception as e:
+                logger.error(f"Error fetching {student_number}: {e}")
+                record = {"student_number": student_number, "status": "error"}
+
+            writer.write(record)
+            counts["done"] += 1
+            if record["status"] in ("ok", "error"):
+                counts[record["status"]] += 1
+            print(
+                f"[{counts['done']}/{len(numbers)}] {student_number}: {record['status']}",
+                file=sys.stderr,
+            )
+
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    return counts, time.perf_counter() - started
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Fetch results for many student numbers.",
+    )
+    parser.add_argument(
+        "input", help="file with one student number per line, or - for stdin"
+    )
+    parser.add_argument(
+        "-o", "--output", required=True, help="output file (appended to)"
+    )
+    parser.add_argument(
+        "--format",
+        choices=["jsonl", "csv"],
+        help="output format (default: from extension)",
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=4, help="parallel fetches (default: 4)"
+    )
+    parser.add_argument(
+        "--department",
+        default=telegram_bot.DEFAULT_DEPARTMENT_ID,
+        choices=sorted(telegram_bot.DEPARTMENTS),
+        help=f"department id (default: {telegram_bot.DEFAULT_DEPARTMENT_ID})",
+    )
+    parser.add_argument(
+        "--year", choices=["1", "2", "3", "4", "5"], help="filter by academic year"
+    )
+    parser.add_argument(
+        "--specialization",
+        choices=["computer", "control"],
+        help="specialization for years 4 and 5",
+    )
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="show bot fetch logs"
+    )
+    args = parser.parse_args(argv)
+
+    if args.format is None:
+        args.format = "csv" if args.output.lower().endswith(".csv") else "jsonl"
+    if args.specialization and not args.year:
+        parser.error("--specialization requires --year")
+    if args.year:
+        catalog = telegram_bot.subject_catalogs.get(args.department)
+        if catalog is None:
+            parser.error(f"department {args.department} has no subject catalog")
+        if not catalog.year_keys(args.year, args.specialization):
+            parser.error(
+                f"year {args.year} has no {args.specialization} specialization"
+                if args.specialization
+                else f"department {args.department} has no year {args.year}"
+            )
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO if args.verbose else logging.WARNING,
+        stream=sys.stderr,
+    )
+
+    try:
+        telegram_bot.check_upstream_transport()
+    except ValueError as e:
+        sys.exit(f"❌ {e}")
+    telegram_bot.open_storage()
+    numbers = read_student_numbers(args.input)
+    completed = read_completed(args.output, args.format)
+    pending = [number for number in numbers if number not in completed]
+    print(
+        f"{len(numbers)} student numbers, {len(numbers) - len(pending)} already done, "
+        f"{len(pending)} to fetch",
+        file=sys.stderr,
+    )
+    if not pending:
+        return
+
+    writer = ResultWriter(args.output, args.format)
+    try:
+        counts, elapsed = asyncio.run(
+            run_batch(
+                pending,
+                writer,
+                args.department,
+                args.year,
+                args.specialization,
+                args.concurrency,
+            )
+        )
+    except KeyboardInterrupt:
+        print("Interrupted; re-run the same command to resume.", file=sys.stderr)
+        sys.exit(130)
+    finally:
+        writer.close()
+        telegram_bot.shutdown_parse_pool()
+
+    print(
+        f"Done: {counts['done']} fetched ({counts['ok']} with results) in {elapsed:.1f}s",
+        file=sys.stderr,
+    )
+    if counts["error"]:
+        print(
+            f"{counts['error']} failed; re-run the same command to retry them.",
+            file=sys.stderr,
+        )
+
+
+if __name__ == "__main__":
+    main()
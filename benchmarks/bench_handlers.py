@@ -0,0 +1,133 @@
+"""Handler overhead benchmark: CPU per message without network or Bot API.
+
+Calls the bot's handlers with stub updates whose replies return at once,
+so the numbers are the bot's own per-message work (validation, rate limit
+check, message and keyboard building, tracing hooks), and compares
+building the year keyboard per message with the prebuilt one:
+
+    python benchmarks/bench_handlers.py --runs 20000
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+# No prefetching (it would hit the network) and a throwaway data directory
+os.environ["PREFETCH_ON_NUMBER"] = "0"
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="bench-handlers-"))
+
+import telegram_bot  # noqa: E402
+
+
+class StubMessage:
+    def __init__(self, text):
+        self.text = text
+        self.replies = 0
+
+    async def reply_text(self, text, **kwargs):
+        self.replies += 1
+
+
+class StubQuery:
+    def __init__(self, data):
+        self.data = data
+
+    async def answer(self, *args, **kwargs):
+        pass
+
+    async def edit_message_text(self, text, **kwargs):
+        pass
+
+
+def stub_update(message=None, query=None, user_id=1):
+    return SimpleNamespace(
+        message=message,
+        callback_query=query,
+        effective_user=SimpleNamespace(id=user_id),
+        effective_chat=SimpleNamespace(id=user_id),
+    )
+
+
+def timed(func, runs):
+    """Wall and CPU microseconds per call of a sync function."""
+    started, cpu_started = time.perf_counter(), time.process_time()
+    for _ in range(runs):
+        func()
+    return (
+        (time.perf_counter() - started) / runs * 1e6,
+        (time.process_time() - cpu_started) / runs * 1e6,
+    )
+
+
+async def timed_async(func, runs):
+    started, cpu_started = time.perf_counter(), time.process_time()
+    for _ in range(runs):
+        await func()
+    return (
+        (time.perf_counter() - started) / runs * 1e6,
+        (time.process_time() - cpu_started) / runs * 1e6,
+    )
+
+
+async def bench_handlers(runs, department_id):
+    context = SimpleNamespace(user_data={"department_id": department_id}, args=[])
+    number = stub_update(StubMessage("1234567890"))
+    invalid = stub_update(StubMessage("12345"))
+    department = stub_update(query=StubQuery(f"department_{department_id}"))
+    context.user_data["student_number"] = "1234567890"
+
+    return {
+        "student number": await timed_async(
+            lambda: telegram_bot.handle_student_number(number, context), runs
+        ),
+        "invalid number": await timed_async(
+            lambda: telegram_bot.handle_student_number(invalid, context), runs
+        ),
+        "department choice": await timed_async(
+            lambda: telegram_bot.handle_department_choice(department, context), runs
+        ),
+        "/help": await timed_async(
+            lambda: telegram_bot.help_command(number, context), runs
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20000)
+    parser.add_argument(
+        "--department", default=telegram_bot.DEFAULT_DEPARTMENT_ID, help="department id"
+    )
+    args = parser.parse_args()
+
+    telegram_bot.build_keyboards()
+    results = {
+        "year keyboard, built": timed(
+            lambda: telegram_bot.build_academic_year_keyboard(args.department),
+            args.runs,
+        ),
+        "year keyboard, prebuilt": timed(
+            lambda: telegram_bot.academic_year_keyboard(args.department), args.runs
+        ),
+        "no-results message": timed(
+            lambda: telegram_bot.NO_YEAR_RESULTS_TEMPLATE.format(year="السنة الثالثة"),
+            args.runs,
+        ),
+    }
+    results.update(asyncio.run(bench_handlers(args.runs, args.department)))
+
+    print(f"{args.runs} calls each, department {args.department}")
+    print(f"{'':<26} {'wall us':>9} {'cpu us':>9}")
+    for name, (wall, cpu) in results.items():
+        print(f"{name:<26} {wall:>9.2f} {cpu:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Parse benchmark: full-DOM BeautifulSoup parse vs the streaming marks parser.
+
+Parses a synthetic results page (marks table followed by heavy layout, like
+the real site) and reports time per parse and peak memory. The BeautifulSoup
+side reproduces the previous fetch_student_marks parsing and needs bs4:
+
+    python benchmarks/bench_parse.py --rows 120 --padding 4000
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from fake_university import marks_page  # noqa: E402
+from marks_parser import parse_marks_stream  # noqa: E402
+
+CHUNK_SIZE = 16 * 1024
+
+
+def parse_with_beautifulsoup(content):
+    """The pre-streaming parser: build the whole DOM, then walk the tables."""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(content, "html.parser")
+    marks_table = None
+    student_info_table = None
+    for table in soup.find_all("table"):
+        table_text = table.get_text()
+        if "راسب" in table_text or "ناجح" in table_text:
+            marks_table = table
+        elif "الرقم الجامعي" in table_text and "الأسم" in table_text:
+            student_info_table = table
+    if not marks_table:
+        return None
+
+    student_name = "غير محدد"
+    if student_info_table:
+        info_rows = student_info_table.find_all("tr")
+        if len(info_rows) > 1:
+            cells = info_rows[1].find_all(["td", "th"])
+            if len(cells) >= 4:
+                student_name = cells[3].get_text().strip()
+
+    rows = marks_table.find_all("tr")
+    headers = [c.get_text().strip() for c in rows[0].find_all(["td", "th"])]
+    data_rows = []
+    for row in rows[1:]:
+        cells = row.find_all(["td", "th"])
+        if len(cells) >= 6:
+            data_rows.append([cell.get_text().strip() for cell in cells])
+    return {
+        "headers": headers,
+        "data": data_rows,
+        "total_subjects": len(data_rows),
+        "student_name": student_name,
+    }
+
+
+def parse_streaming(content):
+    chunks = (content[i : i + CHUNK_SIZE] for i in range(0, len(content), CHUNK_SIZE))
+    return parse_marks_stream(chunks)[0]
+
+
+def measure(label, parse, content, runs):
+    started = time.perf_counter()
+    for _ in range(runs):
+        result = parse(content)
+    per_parse = (time.perf_counter() - started) / runs
+
+    tracemalloc.start()
+    parse(content)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    print(f"{label:<14} {per_parse * 1000:8.2f} ms/parse  peak {peak / 1024:8.1f} KiB")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=120, help="mark rows on the page")
+    parser.add_argument(
+        "--padding", type=int, default=4000, help="layout links around the tables"
+    )
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    # Layout both before and after the tables, as on the real site
+    content = marks_page("1234567890", args.rows, args.padding)
+    print(f"page size: {len(content) / 1024:.1f} KiB, {args.rows} mark rows")
+
+    streamed = measure("streaming", parse_streaming, content, args.runs)
+    try:
+        import bs4  # noqa: F401
+    except ImportError:
+        print("beautifulsoup  (skipped: bs4 not installed)")
+        return
+    full = measure("beautifulsoup", parse_with_beautifulsoup, content, args.runs)
+    print(f"results identical: {streamed == full}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Parse throughput benchmark: thread pool vs process pool (PARSE_EXECUTOR).
+
+Parses and filters a batch of synthetic results pages the way the bot does
+at peak: many lookups at once, each needing parse_marks_page followed by
+filter_marks_by_academic_year. Threads share the GIL, so their throughput
+stays flat; the process pool should scale with the number of cores.
+
+    python benchmarks/bench_parse_pool.py --pages 400 --rows 120 --padding 4000
+"""
+
+import argparse
+import marshal
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from fake_university import marks_page  # noqa: E402
+from telegram_bot import (  # noqa: E402
+    call_packed,
+    filter_marks_by_academic_year,
+    parse_marks_page,
+)
+
+
+def parse_and_filter(body):
+    """One lookup's CPU work: parse the page, then filter to year 2."""
+    result = parse_marks_page(body)
+    return filter_marks_by_academic_year(result, "2")
+
+
+def run(executor, pages):
+    started = time.perf_counter()
+    futures = [executor.submit(call_packed, parse_and_filter, page) for page in pages]
+    results = [marshal.loads(future.result()) for future in futures]
+    return len(pages) / (time.perf_counter() - started), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=400, help="pages per run")
+    parser.add_argument("--rows", type=int, default=120, help="mark rows per page")
+    parser.add_argument(
+        "--padding", type=int, default=4000, help="layout links around the tables"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        help="worker counts to try (default: 1, 2, 4, ... up to the core count)",
+    )
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+    workers = args.workers or sorted(
+        {min(2**i, cores) for i in range(cores.bit_length() + 1)}
+    )
+    pages = [
+        marks_page(f"{1234500000 + i:010d}", args.rows, args.padding)
+        for i in range(args.pages)
+    ]
+    print(
+        f"{cores} cores, {args.pages} pages of {len(pages[0]) / 1024:.1f} KiB "
+        f"({args.rows} mark rows)"
+    )
+
+    baseline = [parse_and_filter(page) for page in pages[:5]]
+    context = multiprocessing.get_context("spawn")
+    for count in workers:
+        with ThreadPoolExecutor(count) as executor:
+            thread_rate, _ = run(executor, pages)
+        with ProcessPoolExecutor(count, mp_context=context) as executor:
+            run(executor, pages[:count])  # Start and warm up the workers
+            process_rate, results = run(executor, pages)
+        assert results[:5] == baseline, "process pool results differ"
+        print(
+            f"workers={count:<3} threads {thread_rate:8.1f} pages/s   "
+            f"processes {process_rate:8.1f} pages/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Scheduler benchmark: interactive latency under a batch backlog.
+
+A batch job queues many lookups at once while interactive lookups keep
+arriving. Upstream requests are simulated (fixed latency) behind the same
+rate limiter and in-flight cap as the bot. Compared:
+
+- fifo: every request in one queue, as before the scheduler
+- priority: interactive / batch classes with weighted fair dequeuing
+
+    python benchmarks/bench_scheduler.py --rate 10 --batch 200 --interactive 40
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from fetch_scheduler import FetchScheduler  # noqa: E402
+from telegram_bot import UpstreamRateLimiter  # noqa: E402
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[int(p / 100 * (len(values) - 1))] if values else 0.0
+
+
+async def scenario(args, prioritized):
+    limiter = UpstreamRateLimiter(args.rate, args.burst)
+    scheduler = FetchScheduler(limiter, args.in_flight)
+    latencies = {"interactive": [], "batch": []}
+
+    async def lookup(priority):
+        started = time.perf_counter()
+        async with scheduler.slot(priority if prioritized else "interactive"):
+            await asyncio.sleep(args.latency)
+        latencies[priority].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    batch = [asyncio.create_task(lookup("batch")) for _ in range(args.batch)]
+    interactive = []
+    for _ in range(args.interactive):
+        await asyncio.sleep(args.interval)
+        interactive.append(asyncio.create_task(lookup("interactive")))
+    await asyncio.gather(*interactive)
+    interactive_done = time.perf_counter() - started
+    batch_done = sum(1 for task in batch if task.done())
+    await asyncio.gather(*batch)
+
+    waits = latencies["interactive"]
+    print(
+        f"{'priority' if prioritized else 'fifo':<9} interactive p50 "
+        f"{percentile(waits, 50) * 1000:7.0f} ms  p95 {percentile(waits, 95) * 1000:7.0f} ms"
+        f"   batch done meanwhile: {batch_done}/{args.batch}"
+        f"   total {time.perf_counter() - started:.1f}s"
+    )
+    return interactive_done
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rate", type=float, default=10, help="upstream requests/s")
+    parser.add_argument("--burst", type=int, default=4)
+    parser.add_argument("--in-flight", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds/request")
+    parser.add_argument("--batch", type=int, default=200, help="queued batch lookups")
+    parser.add_argument(
+        "--interactive", type=int, default=40, help="interactive lookups"
+    )
+    parser.add_argument(
+        "--interval", type=float, default=0.25, help="seconds between users"
+    )
+    args = parser.parse_args()
+
+    print(
+        f"{args.batch} batch lookups queued, {args.interactive} users every "
+        f"{args.interval}s, upstream {args.rate}/s, {args.in_flight} in flight"
+    )
+    asyncio.run(scenario(args, prioritized=False))
+    asyncio.run(scenario(args, prioritized=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Serialization benchmark: result snapshots vs pickle, marshal and JSON.
+
+Encodes and decodes a parsed result (as cached by the bot) with each format
+and reports size and time per operation:
+
+    python benchmarks/bench_snapshot.py --rows 60
+"""
+
+import argparse
+import json
+import marshal
+import os
+import pickle
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from fake_university import marks_page  # noqa: E402
+from marks_parser import parse_marks_page  # noqa: E402
+import telegram_bot  # noqa: E402
+
+
+def timed(func, value, runs):
+    started = time.perf_counter()
+    for _ in range(runs):
+        func(value)
+    return (time.perf_counter() - started) / runs * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=60, help="mark rows in the result")
+    parser.add_argument("--runs", type=int, default=5000)
+    args = parser.parse_args()
+
+    telegram_bot.open_storage()
+    snapshot_codec = telegram_bot.snapshot_codec
+    result = parse_marks_page(marks_page("1234567890", args.rows))
+    formats = {
+        "snapshot": (snapshot_codec.encode, snapshot_codec.decode),
+        "pickle": (
+            lambda r: pickle.dumps(r, pickle.HIGHEST_PROTOCOL),
+            pickle.loads,
+        ),
+        "marshal": (marshal.dumps, marshal.loads),
+        "json": (
+            lambda r: json.dumps(r, ensure_ascii=False).encode("utf-8"),
+            json.loads,
+        ),
+    }
+
+    print(f"{args.rows} mark rows")
+    print(f"{'format':<10} {'bytes':>8} {'encode us':>11} {'decode us':>11}")
+    for name, (encode, decode) in formats.items():
+        data = encode(result)
+        assert decode(data) == result, f"{name} did not round-trip"
+        print(
+            f"{name:<10} {len(data):>8} {timed(encode, result, args.runs):>11.1f} "
+            f"{timed(decode, data, args.runs):>11.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
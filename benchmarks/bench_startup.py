@@ -0,0 +1,108 @@
+"""Startup benchmark: module import time and time to first getUpdates.
+
+Runs the bot in fresh subprocesses against a local fake Bot API server and
+reports the median over several runs:
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --runs 10 --script /path/to/old/telegram_bot.py
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_telegram import FakeTelegramServer  # noqa: E402
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def bench_env(base_url, data_dir):
+    env = dict(os.environ)
+    env.update(
+        {
+            "BOT_TOKEN": "123456:BENCHMARK",
+            "TELEGRAM_API_BASE_URL": base_url,
+            "DATA_DIR": data_dir,
+            "PORT": "0",
+        }
+    )
+    return env
+
+
+def measure_import(script, env):
+    """Seconds to import the bot module in a fresh interpreter."""
+    module_dir, module_file = os.path.split(os.path.abspath(script))
+    module = os.path.splitext(module_file)[0]
+    code = (
+        "import time; t = time.perf_counter(); "
+        f"import {module}; print(time.perf_counter() - t)"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=module_dir,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def measure_first_get_updates(script, env, timeout):
+    """Seconds from process spawn to its first getUpdates call."""
+    server = FakeTelegramServer().start()
+    env = dict(env, TELEGRAM_API_BASE_URL=server.base_url)
+    with tempfile.TemporaryDirectory() as workdir:
+        started = time.monotonic()
+        process = subprocess.Popen(
+            [sys.executable, os.path.abspath(script)],
+            cwd=workdir,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            first = server.wait_for("getUpdates", timeout)
+        finally:
+            process.kill()
+            process.wait()
+            server.stop()
+    if first is None:
+        raise RuntimeError("bot did not call getUpdates before the timeout")
+    return first - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--script", default=os.path.join(REPO_ROOT, "telegram_bot.py"))
+    parser.add_argument("--timeout", type=float, default=30)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        env = bench_env("http://127.0.0.1:9/bot", data_dir)
+        imports = [measure_import(args.script, env) for _ in range(args.runs)]
+        first_updates = [
+            measure_first_get_updates(args.script, env, args.timeout)
+            for _ in range(args.runs)
+        ]
+
+    print(f"script: {args.script}")
+    print(
+        f"import time:          median {statistics.median(imports) * 1000:7.1f} ms"
+        f"  (min {min(imports) * 1000:.1f} ms)"
+    )
+    print(
+        f"time to getUpdates:   median {statistics.median(first_updates) * 1000:7.1f} ms"
+        f"  (min {min(first_updates) * 1000:.1f} ms)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Connection pool benchmark: default requests adapter vs the tuned upstream pool.
+
+Fires bursts of concurrent form POSTs at a local fake university server that
+charges a fixed cost per new connection (standing in for the TCP/TLS
+handshake) and reports throughput, latency and how many connections each
+setup opened:
+
+    python benchmarks/bench_upstream_pool.py --concurrency 32 --bursts 20
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from fake_university import FakeUniversityServer  # noqa: E402
+from upstream_pool import UpstreamPool  # noqa: E402
+
+# What a plain requests.Session() with a default HTTPAdapter gives you
+DEFAULT_CONFIG = {
+    "pool_connections": 10,
+    "pool_maxsize": 10,
+    "pool_block": False,
+    "keepalive": False,
+    "keepalive_expiry": 60,
+    "dns_ttl": 0,
+    "http2": False,
+}
+
+
+def serve(url_queue, connect_cost, latency):
+    server = FakeUniversityServer(connect_cost=connect_cost, latency=latency).start()
+    url_queue.put(server.url)
+    while True:
+        time.sleep(3600)
+
+
+def run(label, config, args):
+    # The server runs in its own process so it doesn't share the client's GIL
+    url_queue = multiprocessing.Queue()
+    server_process = multiprocessing.Process(
+        target=serve,
+        args=(url_queue, args.connect_cost_ms / 1000, args.latency_ms / 1000),
+        daemon=True,
+    )
+    server_process.start()
+    url = url_queue.get(timeout=10)
+
+    pool = UpstreamPool(url, config)
+    session = pool.build_session({"Connection": "keep-alive"}, max_retries=0)
+
+    def one(i):
+        started = time.perf_counter()
+        response = session.post(
+            url, data={"num": f"{i:010d}"}, timeout=30, verify=False
+        )
+        response.content
+        return time.perf_counter() - started
+
+    # Traffic arrives in bursts of `concurrency` requests with idle gaps, like
+    # users piling in when results are published
+    latencies = []
+    busy = 0.0
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        for burst in range(args.bursts):
+            started = time.perf_counter()
+            first = burst * args.concurrency
+            latencies.extend(executor.map(one, range(first, first + args.concurrency)))
+            busy += time.perf_counter() - started
+            time.sleep(args.gap_ms / 1000)
+    latencies.sort()
+    stats = pool.snapshot()
+    server_process.terminate()
+    server_process.join()
+
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(
+        f"{label:<8} {len(latencies) / busy:8.1f} req/s  "
+        f"mean {statistics.mean(latencies) * 1000:6.1f} ms  "
+        f"p95 {p95 * 1000:6.1f} ms  "
+        f"new connections {stats['new_connections']:4d}  "
+        f"reuse {stats['reuse_ratio'] * 100:5.1f}%  "
+        f"wait avg {stats['wait_time_avg'] * 1000:5.2f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--bursts", type=int, default=20)
+    parser.add_argument(
+        "--gap-ms", type=float, default=100, help="idle time between bursts"
+    )
+    parser.add_argument("--pool-size", type=int, default=32)
+    parser.add_argument(
+        "--connect-cost-ms",
+        type=float,
+        default=30,
+        help="simulated handshake cost per new connection",
+    )
+    parser.add_argument(
+        "--latency-ms",
+        type=float,
+        default=50,
+        help="simulated server processing time per request",
+    )
+    args = parser.parse_args()
+
+    # The default adapter logs a warning for every discarded connection
+    logging.getLogger("urllib3.connectionpool").setLevel(logging.ERROR)
+
+    tuned = dict(
+        DEFAULT_CONFIG,
+        pool_maxsize=args.pool_size,
+        pool_block=True,
+        keepalive=True,
+        dns_ttl=300,
+    )
+    print(
+        f"{args.bursts} bursts of {args.concurrency} requests, "
+        f"{args.connect_cost_ms:.0f} ms per new connection, "
+        f"{args.latency_ms:.0f} ms server time"
+    )
+    run("default", DEFAULT_CONFIG, args)
+    run("tuned", tuned, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""Minimal fake Telegram Bot API server for benchmarks.
+
+Answers the handful of Bot API methods the bot uses and records every call
+with a timestamp, so benchmarks can measure when the bot reached a given
+point (e.g. its first ``getUpdates``) without talking to Telegram.
+"""
+
+import json
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BOT_USER = {
+    "id": 1,
+    "is_bot": True,
+    "first_name": "Bench",
+    "username": "bench_bot",
+    "can_join_groups": True,
+    "can_read_all_group_messages": False,
+    "supports_inline_queries": True,
+}
+
+
+class FakeTelegramServer:
+    """Threaded HTTP server speaking just enough of the Bot API."""
+
+    def __init__(self, host="127.0.0.1", port=0, poll_hold=0.5):
+        self.poll_hold = poll_hold
+        # Methods answered with 502 Bad Gateway (to simulate an outage)
+        self.failing_methods = set()
+        # Method -> remaining calls answered with 429 and its retry_after
+        self.flood_methods = {}
+        self.calls = []  # (monotonic time, method, params)
+        self._lock = threading.Lock()
+        self._first_call = {}
+        self._events = {}
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                method = self.path.rstrip("/").rsplit("/", 1)[-1]
+                params = server._parse_params(self.headers, body)
+                flood = server._take_flood(method)
+                if method in server.failing_methods:
+                    status = 502
+                    payload = json.dumps(
+                        {"ok": False, "error_code": 502, "description": "Bad Gateway"}
+                    ).encode()
+                elif flood is not None:
+                    status = 429
+                    payload = json.dumps(
+                        {
+                            "ok": False,
+                            "error_code": 429,
+                            "description": "Too Many Requests: retry after " f"{flood}",
+                            "parameters": {"retry_after": flood},
+                        }
+                    ).encode()
+                else:
+                    status = 200
+                    result = server.handle(method, params)
+                    payload = json.dumps({"ok": True, "result": result}).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The bot process went away mid-request (benchmark teardown)
+                    pass
+
+            do_GET = do_POST
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/bot"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def flood(self, method, times=1, retry_after=1):
+        """Answer the next ``times`` calls of ``method`` with a flood wait."""
+        with self._lock:
+            self.flood_methods[method] = [times, retry_after]
+
+    def _take_flood(self, method):
+        with self._lock:
+            flood = self.flood_methods.get(method)
+            if not flood:
+                return None
+            flood[0] -= 1
+            if flood[0] <= 0:
+                del self.flood_methods[method]
+            self.calls.append((time.monotonic(), f"{method}:429", {}))
+            return flood[1]
+
+    @staticmethod
+    def _parse_params(headers, body):
+        content_type = headers.get("Content-Type", "")
+        if not body:
+            return {}
+        if "json" in content_type:
+            return json.loads(body)
+        if "form-urlencoded" in content_type:
+            return {k: v[0] for k, v in urllib.parse.parse_qs(body.decode()).items()}
+        return {}
+
+    def handle(self, method, params):
+        """Record the call and return the Bot API result for it."""
+        now = time.monotonic()
+        with self._lock:
+            self.calls.append((now, method, params))
+            self._first_call.setdefault(method, now)
+            event = self._events.get(method)
+        if event is not None:
+            event.set()
+
+        if method == "getMe":
+            return BOT_USER
+        if method == "getUpdates":
+            time.sleep(self.poll_hold)
+            return []
+        if method in ("sendMessage", "editMessageText"):
+            chat_id = params.get("chat_id", 1)
+            return {
+                "message_id": int(params.get("message_id", 1)),
+                "date": int(time.time()),
+                "chat": {"id": int(chat_id), "type": "private"},
+                "text": params.get("text", ""),
+            }
+        return True
+
+    def wait_for(self, method, timeout=30):
+        """Block until ``method`` is first called; return its monotonic time."""
+        with self._lock:
+            if method in self._first_call:
+                return self._first_call[method]
+            event = self._events.setdefault(method, threading.Event())
+        if not event.wait(timeout):
+            return None
+        return self._first_call[method]
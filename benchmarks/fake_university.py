@@ -0,0 +1,115 @@
+"""Fake university results server for benchmarks.
+
+Serves a synthetic marks page for any student number over HTTP/1.1
+keep-alive. An optional per-connection setup delay models the TCP/TLS
+handshake cost of the real site, so connection reuse shows up in timings.
+"""
+
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SUBJECTS = [
+    "الدارات المنطقية",
+    "الرياضيات المتقطعة",
+    "الدارات الكهربائية (1)",
+    "الحقول الكهرطيسية",
+    "أسس الهندسة الالكترونية",
+    "الخوارزميات وبنى المعطيات",
+    "قواعد البيانات",
+    "الاتصالات الرقمية",
+    "الذكاء الصنعي",
+    "نظم التشغيل",
+    "معالجة الاشارة",
+    "هندسة البرمجيات",
+]
+
+
+def marks_page(student_number, rows=40, padding=0):
+    """Render a results page shaped like the university's (info + marks tables)."""
+    marks = []
+    for i in range(rows):
+        mark = 35 + (int(student_number[-3:] or 0) + i * 7) % 65
+        year = 2021 + i % 4
+        marks.append(
+            f"<tr><td>{SUBJECTS[i % len(SUBJECTS)]}</td><td>{year + 1}-{year}</td>"
+            f"<td>{'فصل أول' if i % 2 else 'فصل ثاني'}</td><td>{mark // 3}</td>"
+            f"<td>{mark - mark // 3}</td><td>{mark}</td>"
+            f"<td>{'ناجح' if mark >= 60 else 'راسب'}</td></tr>"
+        )
+    layout = "<div class='nav'>" + ("<a href='#'>رابط</a>" * padding) + "</div>"
+    return (
+        "<html><head><meta charset='utf-8'><title>نتائج</title></head><body>"
+        f"<table><tr><td>{layout}</td></tr></table>"
+        "<table><tr><td>الرقم الجامعي</td><td>الكلية</td><td>القسم</td><td>الأسم</td></tr>"
+        f"<tr><td>{student_number}</td><td>الهندسة</td><td>الحواسيب</td>"
+        f"<td>طالب {student_number[-4:]}</td></tr></table>"
+        "<table><tr><th>المادة</th><th>العام</th><th>الفصل</th><th>عملي</th>"
+        "<th>نظري</th><th>الدرجة</th><th>النتيجة</th></tr>"
+        + "".join(marks)
+        + f"</table><div class='footer'>{layout}</div></body></html>"
+    ).encode("utf-8")
+
+
+class FakeUniversityServer:
+    """Threaded HTTP server answering the results form POST."""
+
+    def __init__(
+        self, host="127.0.0.1", port=0, connect_cost=0.0, latency=0.0, rows=40
+    ):
+        self.connect_cost = connect_cost
+        self.latency = latency
+        self.rows = rows
+        self.connections = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.connections += 1
+                if server.connect_cost:
+                    time.sleep(server.connect_cost)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                form = urllib.parse.parse_qs(self.rfile.read(length).decode())
+                with server._lock:
+                    server.requests += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                number = form.get("num", ["0000000000"])[0]
+                body = marks_page(number, server.rows)
+                try:
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/html; charset=utf-8")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.request_queue_size = 128
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/fmee/index.php"
+
+    def start(self):
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
@@ -0,0 +1,411 @@
+"""Load test: bursts of synthetic Telegram updates through the real bot.
+
+Builds the Application with ``create_application()`` and feeds it
+synthetic updates without polling: each simulated user sends a student
+number, waits a moment, then taps an academic-year button. The bot talks
+to a local fake Bot API server and a local fake university server (or
+replays recorded fixtures with ``--fixtures``), so no token or network
+access is needed.
+
+Reports, once per interval and at the end: handler throughput, latency
+percentiles per update kind, event-loop lag and memory growth.
+
+    python benchmarks/load_test.py --users-per-second 20 --duration 30
+    python benchmarks/load_test.py --students 50 --burst 200
+    python benchmarks/load_test.py --fixtures data/fixtures --replay-time-scale 1
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from fake_telegram import BOT_USER, FakeTelegramServer  # noqa: E402
+from fake_university import FakeUniversityServer  # noqa: E402
+
+YEAR_BUTTONS = ["academic_year_1", "academic_year_2", "academic_year_3"]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[int(p / 100 * (len(values) - 1))] if values else 0.0
+
+
+def rss_bytes():
+    """Resident set size of this process (Linux), else peak RSS."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class LoadStats:
+    """Enqueue/finish times per update, loop lag samples and a timeline."""
+
+    def __init__(self):
+        self.enqueued = {}  # update_id -> (kind, monotonic time)
+        self.latencies = {"message": [], "callback": []}
+        self.handled = 0
+        self.loop_lag = []
+        self.timeline = []
+        self._finished = {}  # update_id -> asyncio.Event
+
+    def enqueue(self, update_id, kind):
+        self.enqueued[update_id] = (kind, time.monotonic())
+        self._finished[update_id] = asyncio.Event()
+
+    async def on_handled(self, update, context):
+        """Last handler group: every update passes here once it's done."""
+        kind, started = self.enqueued.pop(update.update_id, (None, None))
+        if kind is None:
+            return
+        self.latencies[kind].append(time.monotonic() - started)
+        self.handled += 1
+        self._finished.pop(update.update_id).set()
+
+    async def wait_handled(self, update_id):
+        event = self._finished.get(update_id)
+        if event is not None:
+            await event.wait()
+
+
+async def monitor_loop_lag(stats, interval=0.01):
+    """Record how late a short sleep wakes up (time the loop was blocked)."""
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        stats.loop_lag.append(time.perf_counter() - started - interval)
+
+
+async def report_timeline(stats, interval, use_tracemalloc):
+    started = time.monotonic()
+    last_handled = 0
+    last_lag = 0
+    last_latencies = {kind: 0 for kind in stats.latencies}
+    print(
+        f"{'t s':>5} {'upd/s':>7} {'pending':>8} {'msg p95':>9} {'cb p95':>9} "
+        f"{'lag max':>9} {'rss MB':>8}" + (f" {'py MB':>7}" if use_tracemalloc else "")
+    )
+    while True:
+        await asyncio.sleep(interval)
+        recent = {
+            kind: values[last_latencies[kind] :]
+            for kind, values in stats.latencies.items()
+        }
+        last_latencies = {kind: len(values) for kind, values in stats.latencies.items()}
+        lags = stats.loop_lag[last_lag:]
+        last_lag = len(stats.loop_lag)
+        sample = {
+            "t": time.monotonic() - started,
+            "rate": (stats.handled - last_handled) / interval,
+            "pending": len(stats.enqueued),
+            "message_p95": percentile(recent["message"], 95),
+            "callback_p95": percentile(recent["callback"], 95),
+            "lag_max": max(lags, default=0.0),
+            "rss": rss_bytes(),
+            "traced": tracemalloc.get_traced_memory()[0] if use_tracemalloc else None,
+        }
+        last_handled = stats.handled
+        stats.timeline.append(sample)
+        print(
+            f"{sample['t']:>5.0f} {sample['rate']:>7.1f} {sample['pending']:>8} "
+            f"{sample['message_p95'] * 1000:>7.0f}ms {sample['callback_p95'] * 1000:>7.0f}ms "
+            f"{sample['lag_max'] * 1000:>7.1f}ms {sample['rss'] / 2**20:>8.1f}"
+            + (f" {sample['traced'] / 2**20:>7.1f}" if use_tracemalloc else "")
+        )
+
+
+class UpdateFactory:
+    """Builds Bot API update payloads for the simulated users."""
+
+    def __init__(self, bot, students):
+        self.bot = bot
+        self.students = students
+        self._next_id = 1
+
+    def _new_id(self):
+        update_id = self._next_id
+        self._next_id += 1
+        return update_id
+
+    @staticmethod
+    def _user(user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+
+    def student_number(self, user_id):
+        if self.students:
+            user_id = user_id % self.students
+        return f"{4000000000 + user_id:010d}"
+
+    def message(self, user_id):
+        from telegram import Update
+
+        update_id = self._new_id()
+        data = {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": self._user(user_id),
+                "text": self.student_number(user_id),
+            },
+        }
+        return Update.de_json(data, self.bot)
+
+    def callback(self, user_id, button):
+        from telegram import Update
+
+        update_id = self._new_id()
+        data = {
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "data": button,
+                "message": {
+                    "message_id": update_id,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": BOT_USER,
+                    "text": "🎓 اختر السنة الدراسية:",
+                },
+            },
+        }
+        return Update.de_json(data, self.bot)
+
+
+async def simulate_user(application, factory, stats, user_id, think_time):
+    """One user: send a student number, then tap a year button."""
+    update = factory.message(user_id)
+    stats.enqueue(update.update_id, "message")
+    await application.update_queue.put(update)
+    await stats.wait_handled(update.update_id)
+
+    await asyncio.sleep(random.expovariate(1 / think_time) if think_time else 0)
+    update = factory.callback(user_id, random.choice(YEAR_BUTTONS))
+    stats.enqueue(update.update_id, "callback")
+    await application.update_queue.put(update)
+    await stats.wait_handled(update.update_id)
+
+
+async def run_load(args, bot_module):
+    from telegram import Update
+    from telegram.ext import TypeHandler
+
+    stats = LoadStats()
+    application = bot_module.create_application()
+    application.add_handler(TypeHandler(Update, stats.on_handled), group=99)
+    await application.initialize()
+    await application.start()
+
+    factory = UpdateFactory(application.bot, args.students)
+    monitors = [
+        asyncio.create_task(monitor_loop_lag(stats)),
+        asyncio.create_task(report_timeline(stats, args.interval, args.tracemalloc)),
+    ]
+    rss_start = rss_bytes()
+    started = time.monotonic()
+
+    users = []
+    # An optional burst up front, then users arrive as a Poisson process
+    for user_id in range(args.burst):
+        users.append(
+            asyncio.create_task(
+                simulate_user(application, factory, stats, user_id, args.think_time)
+            )
+        )
+    user_id = args.burst
+    while time.monotonic() - started < args.duration:
+        if args.users_per_second > 0:
+            await asyncio.sleep(random.expovariate(args.users_per_second))
+        else:
+            await asyncio.sleep(args.duration)
+            break
+        users.append(
+            asyncio.create_task(
+                simulate_user(application, factory, stats, user_id, args.think_time)
+            )
+        )
+        user_id += 1
+    offered_for = time.monotonic() - started
+
+    done, pending = await asyncio.wait(users, timeout=args.drain_timeout)
+    for task in pending:
+        task.cancel()
+    elapsed = time.monotonic() - started
+    for task in monitors:
+        task.cancel()
+    metrics = bot_module.get_metrics()
+    await application.stop()
+    await application.shutdown()
+    bot_module.shutdown_parse_pool()
+
+    return {
+        "stats": stats,
+        "users": len(users),
+        "unfinished": len(pending),
+        "offered_for": offered_for,
+        "elapsed": elapsed,
+        "rss_start": rss_start,
+        "rss_end": rss_bytes(),
+        "metrics": metrics,
+    }
+
+
+def print_summary(result, telegram_server, university_server):
+    stats = result["stats"]
+    print()
+    print(
+        f"{result['users']} users in {result['offered_for']:.1f}s, "
+        f"{stats.handled} updates handled in {result['elapsed']:.1f}s "
+        f"({stats.handled / result['elapsed']:.1f}/s), "
+        f"{result['unfinished']} users unfinished"
+    )
+    for kind, values in stats.latencies.items():
+        print(
+            f"{kind:<9} latency  p50 {percentile(values, 50) * 1000:7.0f} ms  "
+            f"p95 {percentile(values, 95) * 1000:7.0f} ms  "
+            f"p99 {percentile(values, 99) * 1000:7.0f} ms  "
+            f"max {max(values, default=0) * 1000:7.0f} ms"
+        )
+    lag = stats.loop_lag
+    print(
+        f"loop lag   p50 {percentile(lag, 50) * 1000:7.1f} ms  "
+        f"p99 {percentile(lag, 99) * 1000:7.1f} ms  "
+        f"max {max(lag, default=0) * 1000:7.1f} ms"
+    )
+    growth = result["rss_end"] - result["rss_start"]
+    print(
+        f"memory     rss {result['rss_start'] / 2**20:.1f} -> "
+        f"{result['rss_end'] / 2**20:.1f} MB ({growth / 2**20:+.1f} MB)"
+    )
+    if university_server is not None:
+        print(f"upstream   {university_server.requests} requests")
+    methods = {}
+    for _, method, _ in telegram_server.calls:
+        methods[method] = methods.get(method, 0) + 1
+    print(
+        "bot api    "
+        + ", ".join(f"{method} {count}" for method, count in sorted(methods.items()))
+    )
+    classes = result["metrics"]["scheduler"]["classes"]
+    print(
+        "scheduler  "
+        + ", ".join(
+            f"{name} {stats['dispatched']} (expired {stats['expired']}, "
+            f"wait max {stats['wait_max']:.2f}s)"
+            for name, stats in classes.items()
+            if stats["dispatched"] or stats["expired"]
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users-per-second", type=float, default=10)
+    parser.add_argument("--duration", type=float, default=20, help="seconds")
+    parser.add_argument(
+        "--burst", type=int, default=0, help="users arriving all at once at t=0"
+    )
+    parser.add_argument(
+        "--think-time",
+        type=float,
+        default=1.0,
+        help="mean seconds between the number and the button tap",
+    )
+    parser.add_argument(
+        "--students",
+        type=int,
+        default=0,
+        help="distinct student numbers (0 = one per user; fewer gives cache hits)",
+    )
+    parser.add_argument("--rows", type=int, default=40, help="mark rows per page")
+    parser.add_argument(
+        "--upstream-latency", type=float, default=0.3, help="fake site seconds/page"
+    )
+    parser.add_argument("--upstream-rate", type=float, default=50)
+    parser.add_argument("--upstream-in-flight", type=int, default=16)
+    parser.add_argument(
+        "--fixtures", help="replay recorded fixtures instead of the fake site"
+    )
+    parser.add_argument("--replay-time-scale", type=float, default=1.0)
+    parser.add_argument("--parse-executor", choices=("thread", "process"))
+    parser.add_argument("--interval", type=float, default=1.0, help="report seconds")
+    parser.add_argument("--drain-timeout", type=float, default=60)
+    parser.add_argument(
+        "--tracemalloc", action="store_true", help="also track Python heap size"
+    )
+    parser.add_argument("--verbose", action="store_true", help="show bot logs")
+    args = parser.parse_args()
+
+    telegram_server = FakeTelegramServer(poll_hold=0).start()
+    university_server = None
+    data_dir = tempfile.TemporaryDirectory()
+    env = {
+        "BOT_TOKEN": "123456:LOADTEST",
+        "TELEGRAM_API_BASE_URL": telegram_server.base_url,
+        "DATA_DIR": data_dir.name,
+        "PORT": "0",
+        "UPSTREAM_RATE": str(args.upstream_rate),
+        "UPSTREAM_BURST": str(args.upstream_in_flight),
+        "UPSTREAM_MAX_IN_FLIGHT": str(args.upstream_in_flight),
+        "UPSTREAM_POOL_SIZE": str(args.upstream_in_flight),
+        # Simulated users are distinct; don't let per-user limits hide load
+        "USER_RATE_PER_MINUTE": "600",
+        "USER_BURST": "10",
+    }
+    if args.fixtures:
+        env["UPSTREAM_TRANSPORT"] = "replay"
+        env["UPSTREAM_FIXTURES_DIR"] = args.fixtures
+        env["UPSTREAM_REPLAY_TIME_SCALE"] = str(args.replay_time_scale)
+    else:
+        university_server = FakeUniversityServer(
+            latency=args.upstream_latency, rows=args.rows
+        ).start()
+        env["UPSTREAM_URL"] = university_server.url
+    if args.parse_executor:
+        env["PARSE_EXECUTOR"] = args.parse_executor
+    os.environ.update(env)
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    import telegram_bot
+
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+
+    print(
+        f"{args.users_per_second} users/s for {args.duration}s"
+        f"{f' after a burst of {args.burst}' if args.burst else ''}, "
+        f"think time {args.think_time}s, "
+        + (
+            f"replaying {args.fixtures}"
+            if args.fixtures
+            else f"upstream latency {args.upstream_latency}s"
+        )
+    )
+    try:
+        result = asyncio.run(run_load(args, telegram_bot))
+        print_summary(result, telegram_server, university_server)
+    finally:
+        telegram_server.stop()
+        if university_server is not None:
+            university_server.stop()
+        data_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
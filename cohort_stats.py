@@ -0,0 +1,246 @@
+"""Cohort statistics (mark distribution, percentiles, pass rate) per subject.
+
+Built only from locally cached results, never from the university website.
+A department's store is a directory holding ``index.json`` and one
+directory per build (``build<N>``) of column files. A rebuild writes a new
+build directory, switches ``index.json`` over to it and then removes older
+builds, keeping the previous one for queries that still use its index.
+"""
+
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from array import array
+
+from marks_parser import row_sort_key
+
+logger = logging.getLogger(__name__)
+
+# Marker for the "all years" column of a subject
+ALL_YEARS = "*"
+
+PERCENTILES = (10, 25, 50, 75, 90)
+
+
+class CohortStore:
+    """Columnar store of final marks per (subject, year), built from cached results.
+
+    Every column is a file of sorted float32 marks (one latest attempt per
+    student), so distribution, percentile and pass-rate queries only read
+    one small file and never touch the university website.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()  # One rebuild at a time
+        self._index = None
+        self._index_mtime = None
+        self._columns = {}
+
+    # ------------------------------------------------------------------
+    # Building
+    # ------------------------------------------------------------------
+    def rebuild(self, results):
+        """Rebuild all columns from an iterable of parsed results.
+
+        ``results`` yields marks dicts as returned by ``fetch_student_marks``.
+        Concurrent rebuilds of the same store run one after the other.
+        """
+        with self._build_lock:
+            return self._rebuild(results)
+
+    def _rebuild(self, results):
+        started = time.perf_counter()
+        latest = {}  # (subject, year) -> {student_key: (rank, mark, passed)}
+        students = 0
+
+        for student_key, marks_data in results:
+            students += 1
+            for row in marks_data.get("data", []):
+                if len(row) < 7:
+                    continue
+                subject, year = row[0], row[1]
+                rank = row_sort_key(row)
+                mark = rank[2]
+                if mark < 0:
+                    continue
+                result = row[6]
+                if not result.strip():
+                    continue
+                passed = "ناجح" in result
+                for column_key in ((subject, year), (subject, ALL_YEARS)):
+                    column = latest.setdefault(column_key, {})
+                    current = column.get(student_key)
+                    if current is None or rank > current[0]:
+                        column[student_key] = (rank, mark, passed)
+
+        # Columns go to a new build directory, never over files that queries
+        # of the current index may be reading
+        index_path = os.path.join(self.root, "index.json")
+        previous = self._read_build(index_path)
+        build = previous + 1
+        build_dir = f"build{build:06d}"
+        shutil.rmtree(os.path.join(self.root, build_dir), ignore_errors=True)
+        os.makedirs(os.path.join(self.root, build_dir))
+        columns = {}
+        for number, ((subject, year), column) in enumerate(sorted(latest.items())):
+            marks = array("f", sorted(entry[1] for entry in column.values()))
+            file_name = f"{build_dir}/c{number:05d}.f32"
+            with open(os.path.join(self.root, file_name), "wb") as f:
+                marks.tofile(f)
+            columns[f"{subject}|{year}"] = {
+                "subject": subject,
+                "year": year,
+                "file": file_name,
+                "count": len(marks),
+                "passed": sum(1 for entry in column.values() if entry[2]),
+            }
+
+        index = {
+            "build": build,
+            "built_at": time.time(),
+            "students": students,
+            "columns": columns,
+        }
+        with open(index_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(index_path + ".tmp", index_path)
+
+        # Drop builds older than the previous one (and the flat column files
+        # of stores built before builds had directories)
+        keep = {build_dir, f"build{previous:06d}"}
+        for file_name in os.listdir(self.root):
+            path = os.path.join(self.root, file_name)
+            if file_name.startswith("build") and file_name not in keep:
+                shutil.rmtree(path, ignore_errors=True)
+            elif file_name.endswith(".f32") and previous > 0:
+                os.remove(path)
+
+        with self._lock:
+            self._index = None
+            self._columns.clear()
+
+        logger.info(
+            f"Cohort store rebuilt: {students} students, {len(columns)} columns "
+            f"in {time.perf_counter() - started:.2f}s"
+        )
+        return index
+
+    @staticmethod
+    def _read_build(index_path):
+        """Build number of the index on disk (0 if none or unnumbered)."""
+        try:
+            with open(index_path, encoding="utf-8") as f:
+                return json.load(f).get("build", 0)
+        except (OSError, ValueError):
+            return 0
+
+    # ------------------------------------------------------------------
+    # Querying
+    # ------------------------------------------------------------------
+    def _load_index(self):
+        index_path = os.path.join(self.root, "index.json")
+        try:
+            mtime = os.path.getmtime(index_path)
+        except OSError:
+            return None
+        with self._lock:
+            if self._index is None or mtime != self._index_mtime:
+                with open(index_path, encoding="utf-8") as f:
+                    self._index = json.load(f)
+                self._index_mtime = mtime
+                self._columns.clear()
+            return self._index
+
+    def _load_column(self, column):
+        with self._lock:
+            marks = self._columns.get(column["file"])
+            if marks is None:
+                marks = array("f")
+                with open(os.path.join(self.root, column["file"]), "rb") as f:
+                    marks.fromfile(f, column["count"])
+                self._columns[column["file"]] = marks
+            return marks
+
+    def is_built(self):
+        """Return True when an index exists on disk."""
+        return self._load_index() is not None
+
+    def info(self):
+        """Return build metadata (time, students, column count) or None."""
+        index = self._load_index()
+        if index is None:
+            return None
+        return {
+            "built_at": index["built_at"],
+            "students": index["students"],
+            "columns": len(index["columns"]),
+        }
+
+    def find_column(self, subject, year=None):
+        """Find the column for a subject (exact or partial name) and optional year."""
+        index = self._load_index()
+        if index is None:
+            return None
+
+        candidates = []
+        for column in index["columns"].values():
+            if year is None:
+                if column["year"] != ALL_YEARS:
+                    continue
+            elif column["year"] == ALL_YEARS or not column["year"].startswith(year):
+                continue
+            if column["subject"] == subject:
+                return column
+            if subject in column["subject"] or column["subject"] in subject:
+                candidates.append(column)
+
+        if not candidates:
+            return None
+        # Prefer the closest name, then the most populated column
+        return min(
+            candidates,
+            key=lambda c: (abs(len(c["subject"]) - len(subject)), -c["count"]),
+        )
+
+    def query(self, subject, year=None):
+        """Return distribution, percentiles and pass rate for a subject/year."""
+        column = self.find_column(subject, year)
+        if column is None or column["count"] == 0:
+            return None
+
+        marks = self._load_column(column)
+        count = len(marks)
+
+        distribution = [0] * 10
+        for mark in marks:
+            bucket = min(int(mark // 10), 9) if mark > 0 else 0
+            distribution[bucket] += 1
+
+        return {
+            "subject": column["subject"],
+            "year": None if column["year"] == ALL_YEARS else column["year"],
+            "count": count,
+            "passed": column["passed"],
+            "pass_rate": column["passed"] / count,
+            "mean": sum(marks) / count,
+            "min": marks[0],
+            "max": marks[-1],
+            "percentiles": {p: percentile(marks, p) for p in PERCENTILES},
+            "distribution": distribution,
+        }
+
+
+def percentile(sorted_marks, p):
+    """Linear-interpolated percentile of an already sorted sequence."""
+    if not sorted_marks:
+        return 0.0
+    position = (len(sorted_marks) - 1) * p / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_marks) - 1)
+    fraction = position - lower
+    return sorted_marks[lower] + (sorted_marks[upper] - sorted_marks[lower]) * fraction
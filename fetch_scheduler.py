@@ -0,0 +1,271 @@
+"""Priority scheduling of requests to the university website.
+
+Every upstream fetch waits for a slot from :class:`FetchScheduler`. Waiters
+are queued by class (interactive, prefetch, batch); whenever the rate limiter
+has a token and fewer than ``max_in_flight`` requests are running, the next
+waiter is picked by smooth weighted round-robin across the non-empty queues.
+A fetch's class lives in a :class:`FetchTicket`, which can be raised with
+:meth:`FetchScheduler.promote` while it waits (e.g. when a user starts
+waiting on a prefetch). A waiter still queued when its class deadline runs out is removed and
+failed with :class:`FetchDeadlineExceeded` right then, instead of being
+sent late.
+"""
+
+import asyncio
+import contextlib
+import logging
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Dispatch weights per class: while all queues are busy, interactive lookups
+# get 8 of every 12 slots and batch jobs still make progress
+DEFAULT_WEIGHTS = {"interactive": 8, "prefetch": 3, "batch": 1}
+
+# Seconds a request may wait in its queue before it's dropped
+DEFAULT_DEADLINES = {"interactive": 30.0, "prefetch": 15.0, "batch": 600.0}
+
+# Recent wait times kept per class for the p95 metric
+WAIT_SAMPLES = 1000
+
+
+class FetchDeadlineExceeded(Exception):
+    """A queued fetch waited longer than its class deadline."""
+
+
+class FetchTicket:
+    """The class of one fetch, shared by all its attempts."""
+
+    __slots__ = ("priority", "waiter")
+
+    def __init__(self, priority="interactive"):
+        self.priority = priority
+        self.waiter = None  # while queued
+
+
+class _Waiter:
+    __slots__ = ("priority", "enqueued_at", "future", "timer")
+
+    def __init__(self, priority, future):
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.future = future
+        self.timer = None
+
+
+class _ClassStats:
+    __slots__ = ("dispatched", "expired", "wait_total", "wait_max", "waits")
+
+    def __init__(self):
+        self.dispatched = 0
+        self.expired = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.waits = deque(maxlen=WAIT_SAMPLES)
+
+    def record(self, waited):
+        self.dispatched += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        self.waits.append(waited)
+
+    def snapshot(self, depth):
+        waits = sorted(self.waits)
+        return {
+            "depth": depth,
+            "dispatched": self.dispatched,
+            "expired": self.expired,
+            "wait_avg": self.wait_total / self.dispatched if self.dispatched else None,
+            "wait_p95": waits[int(0.95 * (len(waits) - 1))] if waits else None,
+            "wait_max": self.wait_max,
+        }
+
+
+class FetchScheduler:
+    """Weighted fair queues in front of the upstream rate limiter.
+
+    ``rate_limiter`` must provide ``reserve()``, returning the seconds to
+    wait before the reserved request may be sent. The scheduler belongs to
+    one event loop at a time; its dispatcher task is restarted on demand.
+    """
+
+    def __init__(
+        self,
+        rate_limiter,
+        max_in_flight,
+        weights=DEFAULT_WEIGHTS,
+        deadlines=DEFAULT_DEADLINES,
+    ):
+        self.rate_limiter = rate_limiter
+        self.max_in_flight = max_in_flight
+        self.weights = dict(weights)
+        self.deadlines = dict(deadlines)
+        self.in_flight = 0
+        self._queues = {name: deque() for name in self.weights}
+        self._credit = {name: 0 for name in self.weights}
+        self._stats = {name: _ClassStats() for name in self.weights}
+        self._dispatcher = None
+        self._wakeup = None
+        # A rate limiter token taken for a waiter that expired meanwhile;
+        # the next waiter uses it instead of taking another
+        self._token_held = False
+        self.promoted = 0
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority="interactive"):
+        """Wait for a turn to send one upstream request, then hold it.
+
+        ``priority`` is a class name or a :class:`FetchTicket`.
+        """
+        ticket = priority if isinstance(priority, FetchTicket) else None
+        priority = ticket.priority if ticket else priority
+        if priority not in self._queues:
+            raise ValueError(f"Unknown fetch priority: {priority}")
+
+        loop = asyncio.get_running_loop()
+        self._ensure_dispatcher(loop)
+        waiter = _Waiter(priority, loop.create_future())
+        waiter.timer = loop.call_later(self.deadlines[priority], self._expire, waiter)
+        self._queues[priority].append(waiter)
+        if ticket:
+            ticket.waiter = waiter
+        self._wakeup.set()
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            waiter.timer.cancel()
+            if waiter.future.cancelled():
+                self._remove(waiter)
+            elif waiter.future.exception() is None:
+                # Granted just before the waiter was cancelled: give it back
+                self._release()
+            raise
+        finally:
+            if ticket:
+                ticket.waiter = None
+        try:
+            yield
+        finally:
+            self._release()
+
+    def promote(self, ticket, priority):
+        """Raise a fetch to a more urgent class (a less urgent one is ignored).
+
+        If it is queued, it moves to the new class's queue with that class's
+        deadline counted from now; its later attempts also use the new class.
+        """
+        order = list(self.weights)
+        if order.index(priority) >= order.index(ticket.priority):
+            return
+        ticket.priority = priority
+        waiter = ticket.waiter
+        if waiter is None or waiter.future.done():
+            return
+        self._remove(waiter)
+        waiter.priority = priority
+        waiter.enqueued_at = time.monotonic()
+        waiter.timer.cancel()
+        waiter.timer = asyncio.get_running_loop().call_later(
+            self.deadlines[priority], self._expire, waiter
+        )
+        self._queues[priority].append(waiter)
+        self.promoted += 1
+        self._wakeup.set()
+
+    def _remove(self, waiter):
+        try:
+            self._queues[waiter.priority].remove(waiter)
+        except ValueError:
+            pass
+
+    def _expire(self, waiter):
+        """Fail a waiter whose class deadline ran out while it was queued."""
+        if waiter.future.done():
+            return
+        self._remove(waiter)
+        self._stats[waiter.priority].expired += 1
+        waited = time.monotonic() - waiter.enqueued_at
+        waiter.future.set_exception(
+            FetchDeadlineExceeded(
+                f"{waiter.priority} fetch waited {waited:.1f}s "
+                f"(deadline {self.deadlines[waiter.priority]:g}s)"
+            )
+        )
+
+    def _release(self):
+        self.in_flight -= 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _ensure_dispatcher(self, loop):
+        dispatcher = self._dispatcher
+        if dispatcher is not None and not dispatcher.done():
+            if dispatcher.get_loop() is loop:
+                return
+            dispatcher.cancel()
+        if dispatcher is not None and dispatcher.get_loop() is not loop:
+            # Waiters from a previous (closed) loop can never be resumed
+            for queue in self._queues.values():
+                queue.clear()
+            self.in_flight = 0
+        self._wakeup = asyncio.Event()
+        self._dispatcher = loop.create_task(self._dispatch())
+
+    def _has_waiters(self):
+        return any(self._queues.values())
+
+    def _next_waiter(self):
+        """Pop the next live waiter by smooth weighted round-robin."""
+        while True:
+            ready = [name for name, queue in self._queues.items() if queue]
+            if not ready:
+                return None
+            total = sum(self.weights[name] for name in ready)
+            for name in ready:
+                self._credit[name] += self.weights[name]
+            chosen = max(ready, key=self._credit.get)
+            self._credit[chosen] -= total
+
+            waiter = self._queues[chosen].popleft()
+            if waiter.future.done():
+                continue
+            waiter.timer.cancel()
+            self._stats[chosen].record(time.monotonic() - waiter.enqueued_at)
+            return waiter.future
+
+    async def _dispatch(self):
+        while self._has_waiters():
+            if self.in_flight >= self.max_in_flight:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            if not self._token_held:
+                # A token is taken only while someone is waiting for it, and
+                # the class is chosen once it's usable, so work that arrives
+                # while we wait for it still gets its priority
+                delay = self.rate_limiter.reserve()
+                self._token_held = True
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+
+            future = self._next_waiter()
+            if future is not None:
+                self._token_held = False
+                self.in_flight += 1
+                future.set_result(None)
+        self._dispatcher = None
+
+    def snapshot(self):
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "promoted": self.promoted,
+            "classes": {
+                name: stats.snapshot(len(self._queues[name]))
+                for name, stats in self._stats.items()
+            },
+        }
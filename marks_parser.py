@@ -0,0 +1,243 @@
+"""Incremental parser for the university results page.
+
+The page is fed to :class:`MarksPageParser` chunk by chunk as it arrives.
+Only tables are tracked (no DOM is built): mark rows are emitted as soon as
+their ``</tr>`` closes, and the parser reports :attr:`MarksPageParser.done`
+once the marks table ends so the caller can stop reading the response.
+"""
+
+import codecs
+import re
+from html.parser import HTMLParser
+
+# Words that identify the marks table and the student info table
+RESULT_WORDS = ("راسب", "ناجح")
+INFO_WORDS = ("الرقم الجامعي", "الأسم")
+
+_CHARSET_RE = re.compile(r"charset=[\"']?([\w-]+)", re.IGNORECASE)
+
+# Exam sessions in the order they happen within an academic year, matched
+# by a word of the semester cell; unknown sessions sort first
+SEASON_WORDS = (
+    ("أول", 1),
+    ("اول", 1),
+    ("ثاني", 2),
+    ("ثان", 2),
+    ("صيف", 3),
+    ("تكميل", 4),
+)
+
+_YEAR_RE = re.compile(r"\d{4}")
+
+# Rank of each year/semester text seen (the site uses only a handful)
+_year_ranks = {}
+_season_ranks = {}
+_MAX_RANKS = 1024
+
+
+class _Table:
+    __slots__ = ("rows", "text", "is_marks")
+
+    def __init__(self):
+        self.rows = []
+        self.text = []
+        self.is_marks = False
+
+
+class MarksPageParser(HTMLParser):
+    """Streaming extractor for the student info and marks tables.
+
+    ``on_row`` (optional) is called with each marks data row as soon as it
+    is complete.
+    """
+
+    def __init__(self, on_row=None):
+        super().__init__(convert_charrefs=True)
+        self.on_row = on_row
+        self.done = False
+        self.headers = None
+        self.data_rows = []
+        self.student_name = None
+        self.found_info = False
+        self._tables = []
+        self._row = None
+        self._cell = None
+
+    # ------------------------------------------------------------------
+    # HTMLParser callbacks
+    # ------------------------------------------------------------------
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        if tag == "table":
+            self._close_row()
+            self._tables.append(_Table())
+        elif not self._tables:
+            return
+        elif tag == "tr":
+            self._close_row()
+            self._row = []
+        elif tag in ("td", "th"):
+            self._close_cell()
+            if self._row is None:
+                self._row = []
+            self._cell = []
+
+    def handle_endtag(self, tag):
+        if self.done or not self._tables:
+            return
+        if tag in ("td", "th"):
+            self._close_cell()
+        elif tag == "tr":
+            self._close_row()
+        elif tag == "table":
+            self._close_row()
+            self._close_table(self._tables.pop())
+
+    def handle_data(self, data):
+        if self.done or not self._tables:
+            return
+        self._tables[-1].text.append(data)
+        if self._cell is not None:
+            self._cell.append(data)
+
+    # ------------------------------------------------------------------
+    # Table bookkeeping
+    # ------------------------------------------------------------------
+    def _close_cell(self):
+        if self._cell is not None:
+            self._row.append("".join(self._cell).strip())
+            self._cell = None
+
+    def _close_row(self):
+        self._close_cell()
+        if self._row is None:
+            return
+        row, self._row = self._row, None
+        table = self._tables[-1]
+        table.rows.append(row)
+
+        if not table.is_marks and any(
+            word in cell for cell in row for word in RESULT_WORDS
+        ):
+            table.is_marks = True
+            # Rows seen before the first result are header/earlier data rows
+            for earlier in table.rows[:-1]:
+                self._emit(table, earlier)
+        if table.is_marks:
+            self._emit(table, row)
+
+    def _emit(self, table, row):
+        if self.headers is None:
+            self.headers = row
+            return
+        if len(row) >= 6:  # Ensure we have enough columns
+            self.data_rows.append(row)
+            if self.on_row is not None:
+                self.on_row(row)
+
+    def _close_table(self, table):
+        if table.is_marks:
+            self.done = True
+            return
+
+        text = "".join(table.text)
+        if self._tables:
+            # Nested table text also belongs to the enclosing table
+            self._tables[-1].text.append(text)
+        if all(word in text for word in INFO_WORDS) and not self.found_info:
+            self.found_info = True
+            # Name is in the 4th column of the first data row
+            if len(table.rows) > 1 and len(table.rows[1]) >= 4:
+                self.student_name = table.rows[1][3]
+
+    # ------------------------------------------------------------------
+    # Results
+    # ------------------------------------------------------------------
+    def result(self):
+        """Return the parsed marks dict, or None if no marks table was found."""
+        if self.headers is None or not self.done and not self.data_rows:
+            return None
+        return {
+            "headers": self.headers,
+            "data": self.data_rows,
+            "total_subjects": len(self.data_rows),
+            "student_name": self.student_name or "غير محدد",
+        }
+
+
+def year_rank(text):
+    """Latest calendar year of an academic year cell ("2025-2024" -> 2025)."""
+    rank = _year_ranks.get(text)
+    if rank is None:
+        rank = max(map(int, _YEAR_RE.findall(text)), default=0)
+        if len(_year_ranks) < _MAX_RANKS:
+            _year_ranks[text] = rank
+    return rank
+
+
+def season_rank(text):
+    """Position of a semester cell's exam session within the year."""
+    rank = _season_ranks.get(text)
+    if rank is None:
+        rank = next((rank for word, rank in SEASON_WORDS if word in text), 0)
+        if len(_season_ranks) < _MAX_RANKS:
+            _season_ranks[text] = rank
+    return rank
+
+
+def row_sort_key(row):
+    """Numeric (year, session, final mark) key ordering a subject's attempts."""
+    try:
+        mark = float(row[5])
+    except ValueError:
+        mark = -1.0
+    return (year_rank(row[1]), season_rank(row[2]), mark)
+
+
+def latest_attempts(rows):
+    """Keep the latest attempt of each subject (the first of equal ones).
+
+    Subjects stay in the order they first appear in ``rows``.
+    """
+    latest = {}  # subject -> (key, row)
+    for row in rows:
+        key = row_sort_key(row)
+        current = latest.get(row[0])
+        if current is None or key > current[0]:
+            latest[row[0]] = (key, row)
+    return [row for _, row in latest.values()]
+
+
+def response_charset(content_type, default="utf-8"):
+    """Extract the charset from a Content-Type header value."""
+    match = _CHARSET_RE.search(content_type or "")
+    if match:
+        try:
+            codecs.lookup(match.group(1))
+            return match.group(1)
+        except LookupError:
+            pass
+    return default
+
+
+def parse_marks_stream(chunks, charset="utf-8", on_row=None):
+    """Parse an iterable of byte chunks, stopping once the marks table ends.
+
+    Returns ``(result, consumed_all)``: the marks dict (or None) and whether
+    the whole body was read.
+    """
+    decoder = codecs.getincrementaldecoder(charset)(errors="replace")
+    parser = MarksPageParser(on_row=on_row)
+    for chunk in chunks:
+        parser.feed(decoder.decode(chunk))
+        if parser.done:
+            return parser.result(), False
+    parser.feed(decoder.decode(b"", final=True))
+    parser.close()
+    return parser.result(), True
+
+
+def parse_marks_page(content, charset="utf-8"):
+    """Parse a complete page body (bytes)."""
+    return parse_marks_stream([content], charset)[0]
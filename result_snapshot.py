@@ -0,0 +1,301 @@
+"""Compact binary snapshots of a student's parsed results.
+
+A snapshot holds the dict returned by ``fetch_student_marks`` (headers, mark
+rows, total, student name) and decodes back to an equal dict. Rows are
+stored column by column so each column is packed in one go:
+
+- subject: u16 id into the subject catalog
+- year: u16 index into the snapshot's own table of distinct years
+- semester, result: u8 codes
+- practical, theory, final mark: u16 tenths of a mark
+
+Any cell that doesn't fit its typed column is stored as text, so decoding
+is always exact. The catalog is append-only (see :func:`load_catalog`): a
+snapshot records how many catalog entries existed when it was written and
+their checksum, so it stays readable after new subjects are added.
+
+Layout (little-endian)::
+
+    magic "DUR" | version u8 | catalog size u16 | catalog crc32 u32
+    row count u16 | total u16 | header count u8 | year count u16
+    text count u32 | inline flags u8 (bit per column)
+    cell counts        u8 per row
+    columns 0..6       over the rows that have that column
+    text lengths       u32 per string (characters)
+    text               UTF-8: name, headers, years, inline cells by column,
+                       then cells past column 6 by row
+"""
+
+import logging
+import os
+import struct
+import sys
+import zlib
+from array import array
+from itertools import accumulate
+
+MAGIC = b"DUR"
+VERSION = 1
+
+SEMESTERS = ("فصل أول", "فصل ثاني")
+RESULTS = ("", "ناجح", "راسب")
+
+# Column typecodes: subject, year, semester, practical, theory, final, result
+TYPED_COLUMNS = ("H", "H", "B", "H", "H", "H", "B")
+
+_HEADER = struct.Struct("<3sBHIHHBHIB")
+
+_INLINE = {"B": 0xFF, "H": 0xFFFF}
+
+# Marks are written with at most one decimal: "0".."999" and "0.1".."999.9";
+# the code after the last mark is an empty cell
+_MARK_TEXTS = [
+    str(tenths // 10) if tenths % 10 == 0 else f"{tenths // 10}.{tenths % 10}"
+    for tenths in range(10000)
+] + [""]
+_MARK_CODES = {text: code for code, text in enumerate(_MARK_TEXTS)}
+
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotError(ValueError):
+    """The bytes are not a snapshot this codec can decode."""
+
+
+def load_catalog(path, subjects):
+    """Return the persisted subject catalog with any new ``subjects`` appended.
+
+    Ids are positions in this list, so existing entries never move. The
+    file (one subject per line) is rewritten only when subjects are added.
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            catalog = [line.rstrip("\n") for line in f if line.strip()]
+    except OSError:
+        catalog = []
+
+    known = set(catalog)
+    added = [subject for subject in subjects if subject not in known]
+    if added:
+        catalog.extend(added)
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                f.writelines(f"{subject}\n" for subject in catalog)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            logger.warning(f"Could not save subject catalog to {path}: {e}")
+    return catalog
+
+
+def _to_bytes(values):
+    if sys.byteorder == "big" and values.itemsize > 1:
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_bytes(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == "big" and values.itemsize > 1:
+        values.byteswap()
+    return values
+
+
+class SnapshotCodec:
+    """Encoder/decoder bound to one subject catalog.
+
+    Decoding a snapshot whose catalog prefix doesn't match this catalog
+    raises :class:`SnapshotError` (callers treat that as a cache miss).
+    """
+
+    def __init__(self, subjects):
+        self.subjects = list(subjects)
+        if len(self.subjects) >= _INLINE["H"]:
+            raise ValueError("Subject catalog too large for 16-bit ids")
+        # Checksum of every catalog prefix, so older snapshots can be checked
+        self._prefix_crcs = [0]
+        for subject in self.subjects:
+            crc = zlib.crc32(f"{subject}\n".encode("utf-8"), self._prefix_crcs[-1])
+            self._prefix_crcs.append(crc)
+        # Per column: text -> code for encoding, code -> text for decoding
+        # (years use a table stored in each snapshot instead)
+        self._codes = (
+            {name: i for i, name in enumerate(self.subjects)},
+            None,
+            {name: i for i, name in enumerate(SEMESTERS)},
+            _MARK_CODES,
+            _MARK_CODES,
+            _MARK_CODES,
+            {name: i for i, name in enumerate(RESULTS)},
+        )
+        self._texts = (
+            self.subjects,
+            None,
+            SEMESTERS,
+            _MARK_TEXTS,
+            _MARK_TEXTS,
+            _MARK_TEXTS,
+            RESULTS,
+        )
+
+    # ------------------------------------------------------------------
+    # Encoding
+    # ------------------------------------------------------------------
+    def encode(self, result):
+        """Encode a parsed result dict to bytes."""
+        rows = result.get("data") or []
+        headers = result.get("headers") or []
+        counts = bytes(len(row) for row in rows)  # ValueError past 255 cells
+
+        width = len(TYPED_COLUMNS)
+        if counts.count(width) == len(rows):
+            # Every row is a full mark row: transpose in one pass
+            cell_columns = list(zip(*rows)) or [()] * width
+        else:
+            cell_columns = [
+                [row[column] for row in rows if len(row) > column]
+                for column in range(width)
+            ]
+
+        years = {}
+        inline_text = []
+        inline_flags = 0
+        columns = []
+        for column, typecode in enumerate(TYPED_COLUMNS):
+            cells = cell_columns[column]
+            if column == 1:
+                codes = [years.setdefault(cell, len(years)) for cell in cells]
+                if len(years) > _INLINE["H"]:
+                    raise ValueError("Too many distinct years in one result")
+            else:
+                table = self._codes[column]
+                try:
+                    codes = list(map(table.__getitem__, cells))
+                except KeyError:
+                    inline = _INLINE[typecode]
+                    codes = [table.get(cell, inline) for cell in cells]
+                    inline_flags |= 1 << column
+                    inline_text.extend(
+                        cell for cell, code in zip(cells, codes) if code == inline
+                    )
+            columns.append(_to_bytes(array(typecode, codes)))
+
+        text = [result.get("student_name") or "", *headers, *years, *inline_text]
+        for row in rows:
+            if len(row) > width:
+                text.extend(row[width:])
+
+        lengths = array("I", [len(item) for item in text])
+        header = _HEADER.pack(
+            MAGIC,
+            VERSION,
+            len(self.subjects),
+            self._prefix_crcs[-1],
+            len(rows),
+            result.get("total_subjects", len(rows)),
+            len(headers),
+            len(years),
+            len(text),
+            inline_flags,
+        )
+        return b"".join(
+            [header, counts, *columns, _to_bytes(lengths), "".join(text).encode()]
+        )
+
+    # ------------------------------------------------------------------
+    # Decoding
+    # ------------------------------------------------------------------
+    def decode(self, data):
+        """Decode bytes produced by :meth:`encode` back to a result dict."""
+        try:
+            fields = _HEADER.unpack_from(data, 0)
+        except struct.error as e:
+            raise SnapshotError("Truncated snapshot header") from e
+        magic, version, catalog_size, crc = fields[:4]
+        if magic != MAGIC:
+            raise SnapshotError("Not a result snapshot")
+        if version != VERSION:
+            raise SnapshotError(f"Unsupported snapshot version {version}")
+        if (
+            catalog_size >= len(self._prefix_crcs)
+            or crc != self._prefix_crcs[catalog_size]
+        ):
+            raise SnapshotError("Snapshot was written with a different catalog")
+
+        try:
+            return self._decode_body(memoryview(data), *fields[4:])
+        except (ValueError, IndexError, StopIteration) as e:
+            raise SnapshotError("Corrupt snapshot") from e
+
+    def _read(self, view, offset, typecode, count):
+        end = offset + count * array(typecode).itemsize
+        if end > len(view):
+            raise ValueError("snapshot is truncated")
+        return _from_bytes(typecode, view[offset:end]), end
+
+    def _decode_body(
+        self, view, row_count, total, header_count, year_count, text_count, flags
+    ):
+        width = len(TYPED_COLUMNS)
+        offset = _HEADER.size + row_count
+        counts = bytes(view[_HEADER.size : offset])
+        if len(counts) != row_count:
+            raise ValueError("snapshot is truncated")
+        uniform = counts.count(width) == row_count
+        code_columns = []
+        for column, typecode in enumerate(TYPED_COLUMNS):
+            if uniform:
+                size = row_count
+            else:
+                size = sum(1 for count in counts if count > column)
+            codes, offset = self._read(view, offset, typecode, size)
+            code_columns.append(codes)
+        lengths, offset = self._read(view, offset, "I", text_count)
+
+        blob = str(view[offset:], "utf-8")
+        bounds = list(accumulate(lengths, initial=0))
+        if bounds[-1] != len(blob):
+            raise ValueError("text section size mismatch")
+        text = [blob[bounds[i] : bounds[i + 1]] for i in range(text_count)]
+
+        years_start = 1 + header_count
+        years = text[years_start : years_start + year_count]
+        inline_text = iter(text[years_start + year_count :])
+
+        columns = []
+        for column, codes in enumerate(code_columns):
+            texts = years if column == 1 else self._texts[column]
+            if flags & (1 << column):
+                inline = _INLINE[TYPED_COLUMNS[column]]
+                cells = [
+                    next(inline_text) if code == inline else texts[code]
+                    for code in codes
+                ]
+            else:
+                cells = list(map(texts.__getitem__, codes))
+            columns.append(cells)
+
+        if uniform:
+            rows = list(map(list, zip(*columns)))
+        else:
+            iterators = [iter(cells) for cells in columns]
+            rows = []
+            for count in counts:
+                row = [next(iterators[column]) for column in range(min(count, width))]
+                # A loop, not a generator: StopIteration from next() must
+                # reach decode() as is, not as RuntimeError (PEP 479)
+                for _ in range(count - width):
+                    row.append(next(inline_text))
+                rows.append(row)
+        if next(inline_text, None) is not None:
+            raise ValueError("unused text in snapshot")
+
+        return {
+            "headers": text[1:years_start],
+            "data": rows,
+            "total_subjects": total,
+            "student_name": text[0],
+        }
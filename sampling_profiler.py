@@ -0,0 +1,146 @@
+"""On-demand sampling profiler for the running bot.
+
+A profile is taken by a background thread that wakes ``1 / interval``
+times a second for the requested duration and records:
+
+- the Python stack of every other thread (the event loop thread running
+  handlers and filtering, the fetch and parse worker threads), and
+- the coroutine stack of every pending asyncio task on the bot's loop,
+  i.e. where each lookup is currently awaiting.
+
+Stacks are aggregated into the "collapsed" format read by flamegraph.pl,
+speedscope and similar tools: one ``frame;frame;frame count`` line per
+distinct stack. Nothing runs between profiles, so the bot pays nothing
+while idle. Work done in a process pool (``PARSE_EXECUTOR=process``) shows
+up only as threads waiting on the pool.
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+class ProfilerBusy(RuntimeError):
+    """A profile is already being taken."""
+
+
+def _frame_name(code):
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{name} ({os.path.basename(code.co_filename)})"
+
+
+def _thread_stack(frame):
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+    names.reverse()
+    return names
+
+
+def _task_stack(task):
+    """Frames of a task's coroutine chain, outermost first."""
+    names = []
+    awaitable = task.get_coro()
+    while awaitable is not None:
+        frame = getattr(awaitable, "cr_frame", None) or getattr(
+            awaitable, "gi_frame", None
+        )
+        if frame is None:
+            # Awaiting a future or another task rather than a coroutine
+            names.append(f"<{type(awaitable).__name__}>")
+            break
+        names.append(_frame_name(frame.f_code))
+        awaitable = getattr(awaitable, "cr_await", None) or getattr(
+            awaitable, "gi_yieldfrom", None
+        )
+    return names
+
+
+class SamplingProfiler:
+    """Takes one profile at a time; see the module docstring."""
+
+    def __init__(self, interval=0.02, max_seconds=60):
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self._lock = threading.Lock()
+        self.running = False
+        self.profiles = 0
+        self.last_samples = None
+        self.last_overhead = None
+
+    def profile(self, seconds, loop=None):
+        """Sample for ``seconds``; return the collapsed stacks as text.
+
+        Blocks the calling thread, so call it from a worker thread. Tasks
+        are sampled only when the bot's event ``loop`` is given.
+        """
+        seconds = min(max(seconds, self.interval), self.max_seconds)
+        with self._lock:
+            if self.running:
+                raise ProfilerBusy("A profile is already running")
+            self.running = True
+        try:
+            return self._run(seconds, loop)
+        finally:
+            self.running = False
+
+    def _run(self, seconds, loop):
+        stacks = Counter()
+        own_thread = threading.get_ident()
+        samples = 0
+        busy = 0.0
+        deadline = time.monotonic() + seconds
+        next_sample = time.monotonic()
+        while next_sample < deadline:
+            started = time.perf_counter()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_thread:
+                    continue
+                thread = f"thread:{names.get(ident, ident)}"
+                stacks[";".join([thread, *_thread_stack(frame)])] += 1
+            if loop is not None and not loop.is_closed():
+                for task in self._tasks(loop):
+                    stack = _task_stack(task)
+                    if stack:
+                        stacks[";".join(["task", *stack])] += 1
+            samples += 1
+            busy += time.perf_counter() - started
+
+            next_sample += self.interval
+            delay = next_sample - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Sampling is falling behind: skip the missed ticks
+                next_sample = time.monotonic()
+
+        self.profiles += 1
+        self.last_samples = samples
+        self.last_overhead = busy / seconds
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items()))
+
+    @staticmethod
+    def _tasks(loop):
+        # all_tasks() iterates a WeakSet the loop thread may be changing
+        for _ in range(3):
+            try:
+                return [task for task in asyncio.all_tasks(loop) if not task.done()]
+            except RuntimeError:
+                continue
+        return []
+
+    def snapshot(self):
+        return {
+            "running": self.running,
+            "profiles": self.profiles,
+            "interval": self.interval,
+            "last_samples": self.last_samples,
+            "last_overhead": (
+                round(self.last_overhead, 4) if self.last_overhead is not None else None
+            ),
+        }
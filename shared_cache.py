@@ -0,0 +1,206 @@
+"""Cache of result snapshots shared by every bot process on a host.
+
+The cache is a file mapped into memory by each process (put it on a local
+or tmpfs filesystem). It is a fixed table of ``slots`` slots of
+``slot_size`` bytes, grouped in sets of :data:`WAYS`; a key can only live
+in the slots of the set its hash picks, and a new entry replaces the oldest
+one there. Entries that don't fit a slot are not shared.
+
+Readers take no lock. Each slot starts with a sequence number that writers
+make odd while they change the slot and even again when done (a seqlock);
+a reader copies the entry and keeps it only if the sequence number was even
+and unchanged around the copy and the entry's CRC matches. Writers of the
+same set are serialized with an ``fcntl`` lock on the set's bytes (and,
+since those locks are per process, writer threads with a thread lock).
+
+Slot layout (little-endian)::
+
+    sequence u64 | key hash u64 | stored at f64 | key length u16
+    value length u32 | crc32 u32 | key | value
+"""
+
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"DUSC"
+VERSION = 1
+WAYS = 4
+
+_FILE_HEADER = struct.Struct("<4sBII")
+_SLOT_HEADER = struct.Struct("<QQdHII")
+_SEQUENCE = struct.Struct("<Q")
+
+# Attempts at reading a slot that keeps changing before treating it as a miss
+READ_ATTEMPTS = 3
+
+
+def _key_hash(key):
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+
+class SharedCache:
+    """Memory-mapped (stored at, value) entries keyed by bytes; see above.
+
+    An existing file keeps its geometry, so processes started with other
+    settings still agree on the layout.
+    """
+
+    def __init__(self, path, slots, slot_size):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            self.slots, self.slot_size = self._open_layout(slots, slot_size)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        self.sets = self.slots // WAYS
+        self._map = mmap.mmap(self._fd, self._size)
+        self._write_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.too_large = 0
+        self.retries = 0
+
+    @property
+    def _size(self):
+        return _FILE_HEADER.size + self.slots * self.slot_size
+
+    def _open_layout(self, slots, slot_size):
+        header = os.pread(self._fd, _FILE_HEADER.size, 0)
+        if len(header) == _FILE_HEADER.size:
+            magic, version, file_slots, file_slot_size = _FILE_HEADER.unpack(header)
+            if magic == MAGIC and version == VERSION:
+                if (file_slots, file_slot_size) != (slots, slot_size):
+                    logger.info(
+                        f"Shared cache {self.path} keeps its layout of "
+                        f"{file_slots} slots of {file_slot_size} bytes"
+                    )
+                return file_slots, file_slot_size
+
+        slots = max(WAYS, slots - slots % WAYS)
+        slot_size = max(slot_size, _SLOT_HEADER.size + 64)
+        os.ftruncate(self._fd, 0)
+        os.ftruncate(self._fd, _FILE_HEADER.size + slots * slot_size)
+        os.pwrite(self._fd, _FILE_HEADER.pack(MAGIC, VERSION, slots, slot_size), 0)
+        logger.info(
+            f"Created shared cache {self.path}: {slots} slots of {slot_size} bytes"
+        )
+        return slots, slot_size
+
+    def _set_of(self, key_hash):
+        """Offset of the first slot of a key's set."""
+        return _FILE_HEADER.size + (key_hash % self.sets) * WAYS * self.slot_size
+
+    def _read_slot(self, offset, key, key_hash):
+        """The slot's (stored at, value) if it holds ``key``, else None."""
+        for _ in range(READ_ATTEMPTS):
+            sequence, slot_hash, stored_at, key_length, length, crc = (
+                _SLOT_HEADER.unpack_from(self._map, offset)
+            )
+            if sequence & 1:
+                self.retries += 1
+                continue
+            if slot_hash != key_hash or sequence == 0:
+                return None
+            start = offset + _SLOT_HEADER.size
+            end = start + key_length + length
+            if end > offset + self.slot_size:
+                self.retries += 1
+                continue
+            data = self._map[start:end]
+            if _SEQUENCE.unpack_from(self._map, offset)[0] != sequence:
+                self.retries += 1
+                continue
+            if zlib.crc32(data) != crc or data[:key_length] != key:
+                return None
+            return stored_at, data[key_length:]
+        return None
+
+    def get(self, key):
+        """Return the (stored at, value) stored for ``key``, or None."""
+        key_hash = _key_hash(key)
+        offset = self._set_of(key_hash)
+        for way in range(WAYS):
+            entry = self._read_slot(offset + way * self.slot_size, key, key_hash)
+            if entry is not None:
+                self.hits += 1
+                return entry
+        self.misses += 1
+        return None
+
+    def put(self, key, stored_at, value):
+        """Store an entry; return False if it's too large to share."""
+        if _SLOT_HEADER.size + len(key) + len(value) > self.slot_size:
+            self.too_large += 1
+            return False
+        key_hash = _key_hash(key)
+        offset = self._set_of(key_hash)
+        set_size = WAYS * self.slot_size
+        with self._write_lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, set_size, offset)
+            try:
+                self._write(offset, key, key_hash, stored_at, key + value)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, set_size, offset)
+        self.stores += 1
+        return True
+
+    def _write(self, offset, key, key_hash, stored_at, data):
+        """Write ``data`` (key + value) into a slot of the set at ``offset``."""
+        # The slot holding this key, else an empty one, else the oldest
+        target = None
+        victim = None  # (stored at, offset); empty slots count as oldest
+        for way in range(WAYS):
+            slot = offset + way * self.slot_size
+            sequence, slot_hash, slot_stored_at = struct.unpack_from(
+                "<QQd", self._map, slot
+            )
+            if sequence and slot_hash == key_hash:
+                target = slot
+                break
+            age = slot_stored_at if sequence else float("-inf")
+            if victim is None or age < victim[0]:
+                victim = (age, slot)
+        if target is None:
+            target = victim[1]
+
+        sequence = _SEQUENCE.unpack_from(self._map, target)[0]
+        # An odd sequence was left by a writer that died mid-write
+        sequence += sequence & 1
+        _SEQUENCE.pack_into(self._map, target, sequence + 1)
+        start = target + _SLOT_HEADER.size
+        self._map[start : start + len(data)] = data
+        _SLOT_HEADER.pack_into(
+            self._map,
+            target,
+            sequence + 1,
+            key_hash,
+            stored_at,
+            len(key),
+            len(data) - len(key),
+            zlib.crc32(data),
+        )
+        _SEQUENCE.pack_into(self._map, target, sequence + 2)
+
+    def snapshot(self):
+        """This process's counters and the cache geometry."""
+        return {
+            "path": self.path,
+            "slots": self.slots,
+            "slot_size": self.slot_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "too_large": self.too_large,
+            "read_retries": self.retries,
+        }
@@ -0,0 +1,231 @@
+"""Per-department subject catalogs.
+
+Each department's subjects live in ``subjects/<department id>.txt``: a header
+line per academic year ("السنة الثانية:" or, for specializations,
+"السنة الرابعة - حواسيب:") followed by one subject per line. Catalogs are
+loaded the first time a department is looked up, so memory only grows with
+the departments actually in use.
+
+Subject names on the results page don't always match the catalog exactly,
+so a name matches every catalog subject that equals it, contains it or is
+contained in it. Each catalog resolves a page name once and remembers the
+matching subjects and year keys, so classifying a row is a dict lookup
+instead of a scan over every subject of every year.
+"""
+
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Header ordinals and specialization names used in the catalog files
+YEAR_NUMBERS = {
+    "الاولى": "1",
+    "الأولى": "1",
+    "الثانية": "2",
+    "الثالثة": "3",
+    "الرابعة": "4",
+    "الخامسة": "5",
+}
+YEAR_LABELS = {
+    "1": "السنة الأولى",
+    "2": "السنة الثانية",
+    "3": "السنة الثالثة",
+    "4": "السنة الرابعة",
+    "5": "السنة الخامسة",
+}
+SPECIALIZATIONS = {"حواسيب": "computer", "تحكم": "control"}
+SPECIALIZATION_LABELS = {key: label for label, key in SPECIALIZATIONS.items()}
+
+# Distinct page subject names remembered per catalog
+MATCH_CACHE_SIZE = 4096
+
+
+class CatalogError(ValueError):
+    """A catalog file is not in the expected format."""
+
+
+def specialization_label(specialization):
+    return SPECIALIZATION_LABELS.get(specialization, specialization)
+
+
+def year_label(academic_year, specialization=None):
+    """Display name of a year (and specialization), e.g. "السنة الرابعة - حواسيب"."""
+    label = YEAR_LABELS.get(academic_year, f"السنة {academic_year}")
+    if specialization:
+        label += f" - {specialization_label(specialization)}"
+    return label
+
+
+def parse_catalog(lines):
+    """Parse catalog file lines into {year key: [subjects]} in file order.
+
+    Year keys are "2" for a plain year and "4_computer" for a year with a
+    specialization.
+    """
+    sections = {}
+    current = None
+    for line_number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        if line.endswith(":"):
+            title, _, specialization = line[:-1].partition(" - ")
+            ordinal = title.split()[-1]
+            if ordinal not in YEAR_NUMBERS:
+                raise CatalogError(f"line {line_number}: unknown year {title!r}")
+            current = YEAR_NUMBERS[ordinal]
+            specialization = specialization.strip()
+            if specialization:
+                current += f"_{SPECIALIZATIONS.get(specialization, specialization)}"
+            sections.setdefault(current, [])
+        elif current is None:
+            raise CatalogError(f"line {line_number}: subject before any year header")
+        else:
+            sections[current].append(line)
+    return sections
+
+
+class DepartmentCatalog:
+    """Subjects of one department by academic year, indexed by name."""
+
+    def __init__(self, department_id, sections):
+        self.department_id = department_id
+        self.sections = {key: tuple(subjects) for key, subjects in sections.items()}
+        # Canonical subject -> year keys it belongs to
+        self._years = {}
+        for key, subjects in self.sections.items():
+            for subject in subjects:
+                self._years.setdefault(subject, set()).add(key)
+        self._years = {
+            subject: frozenset(keys) for subject, keys in self._years.items()
+        }
+        self._matches = {}  # page subject name -> (catalog subjects, year keys)
+        self._by_specialization = None
+
+    @property
+    def subjects(self):
+        return list(self._years)
+
+    def specializations(self, academic_year):
+        prefix = f"{academic_year}_"
+        return [key[len(prefix) :] for key in self.sections if key.startswith(prefix)]
+
+    def year_keys(self, academic_year, specialization=None):
+        """Section keys covered by a year choice.
+
+        A year with specializations chosen without one covers all of them.
+        """
+        if specialization:
+            key = f"{academic_year}_{specialization}"
+            return (key,) if key in self.sections else ()
+        if academic_year in self.sections:
+            return (academic_year,)
+        return tuple(
+            f"{academic_year}_{name}" for name in self.specializations(academic_year)
+        )
+
+    def subjects_for(self, academic_year, specialization=None):
+        """Catalog subjects of a year choice, in file order without duplicates."""
+        subjects = {}
+        for key in self.year_keys(academic_year, specialization):
+            subjects.update(dict.fromkeys(self.sections[key]))
+        return list(subjects)
+
+    def _lookup(self, name):
+        entry = self._matches.get(name)
+        if entry is None:
+            matched = frozenset(
+                subject for subject in self._years if subject in name or name in subject
+            )
+            keys = frozenset().union(*(self._years[subject] for subject in matched))
+            entry = (matched, keys)
+            if len(self._matches) >= MATCH_CACHE_SIZE:
+                self._matches.clear()
+            self._matches[name] = entry
+        return entry
+
+    def match(self, name):
+        """Catalog subjects a page subject name stands for (may be empty)."""
+        return self._lookup(name)[0]
+
+    def years_of(self, name):
+        """Section keys a page subject name belongs to (may be empty)."""
+        return self._lookup(name)[1]
+
+    def specialization_subjects(self):
+        """{specialization: subjects taught only in that specialization}."""
+        if self._by_specialization is None:
+            by_specialization = {}
+            for key, subjects in self.sections.items():
+                _, _, specialization = key.partition("_")
+                if specialization:
+                    by_specialization.setdefault(specialization, set()).update(subjects)
+            self._by_specialization = {
+                name: frozenset(
+                    subjects.difference(
+                        *(
+                            other
+                            for other_name, other in by_specialization.items()
+                            if other_name != name
+                        )
+                    )
+                )
+                for name, subjects in by_specialization.items()
+            }
+        return self._by_specialization
+
+
+class CatalogRegistry:
+    """Loads ``<directory>/<department id>.txt`` on first use and keeps it."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._catalogs = {}  # department id -> DepartmentCatalog or None
+        self._lock = threading.Lock()
+
+    def get(self, department_id):
+        """The department's catalog, or None if it has no catalog file."""
+        try:
+            return self._catalogs[department_id]
+        except KeyError:
+            pass
+        with self._lock:
+            if department_id not in self._catalogs:
+                self._catalogs[department_id] = self._load(department_id)
+            return self._catalogs[department_id]
+
+    def _load(self, department_id):
+        if not department_id.isalnum():
+            return None
+        path = os.path.join(self.directory, f"{department_id}.txt")
+        try:
+            with open(path, encoding="utf-8") as f:
+                sections = parse_catalog(f)
+        except FileNotFoundError:
+            logger.info(f"No subject catalog for department {department_id}")
+            return None
+        except (OSError, CatalogError) as e:
+            logger.error(f"Could not load subject catalog {path}: {e}")
+            return None
+        catalog = DepartmentCatalog(department_id, sections)
+        logger.info(
+            f"Loaded subject catalog for department {department_id}: "
+            f"{len(catalog.subjects)} subjects in {len(sections)} sections"
+        )
+        return catalog
+
+    def snapshot(self):
+        return {
+            "loaded": sorted(
+                department_id
+                for department_id, catalog in self._catalogs.items()
+                if catalog is not None
+            ),
+            "missing": sorted(
+                department_id
+                for department_id, catalog in self._catalogs.items()
+                if catalog is None
+            ),
+        }
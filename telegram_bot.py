@@ -1,87 +1,383 @@
 import asyncio
+import contextvars
+import functools
+import hashlib
+import hmac
+import itertools
+import json
 import logging
+import marshal
+import math
 import os
 import re
+import signal
+import struct
 import sys
 import threading
 import time
+from collections import OrderedDict, deque
 from datetime import datetime
-from waitress import serve
 
-import requests
-import urllib3
 from dotenv import load_dotenv
-from flask import Flask
 
 # Load environment variables
 load_dotenv()
 
-# Disable SSL warnings
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-from bs4 import BeautifulSoup
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
-from telegram.error import Conflict, NetworkError, TimedOut
+# Only the Telegram stack is imported eagerly: it is needed before the first
+# getUpdates. Flask/waitress and requests/urllib3 are imported where they are
+# first used so restarts reach polling sooner.
+from telegram import (
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InlineQueryResultsButton,
+    InputTextMessageContent,
+    Update,
+)
+from telegram.error import Conflict, Forbidden, NetworkError, TimedOut
 from telegram.ext import (
     Application,
     CallbackQueryHandler,
     CommandHandler,
     ContextTypes,
+    InlineQueryHandler,
     MessageHandler,
+    TypeHandler,
     filters,
 )
 
-# Configure logging
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO,
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler("bot.log", encoding="utf-8"),
-    ],
+from cohort_stats import CohortStore
+from fetch_scheduler import FetchDeadlineExceeded, FetchScheduler, FetchTicket
+from marks_parser import (
+    latest_attempts,
+    parse_marks_page,
+    parse_marks_stream,
+    response_charset,
+    year_rank,
 )
+from result_snapshot import SnapshotCodec, SnapshotError, load_catalog
+from sampling_profiler import ProfilerBusy, SamplingProfiler
+from shared_cache import SharedCache
+from tracing import (
+    JsonLinesExporter,
+    OtlpExporter,
+    RequestIdFilter,
+    Tracer,
+    current_trace_id,
+)
+from subject_catalog import (
+    SPECIALIZATIONS,
+    CatalogRegistry,
+    specialization_label,
+    year_label,
+)
+from telegram_limiter import TelegramRateLimiter
+from upstream_health import CircuitBreaker, RequestLog, mask_student_number
+from upstream_pool import UpstreamPool
+from watch import WatchEngine, WatchRegistry
+
 logger = logging.getLogger(__name__)
 
-# Flask app (for hosting/health check)
-app = Flask(__name__)
 
+def configure_logging():
+    """Configure logging to stdout and bot.log (called from main, not on import)."""
+    handlers = [
+        logging.StreamHandler(sys.stdout),
+        logging.FileHandler("bot.log", encoding="utf-8"),
+    ]
+    # Log lines carry the id of the trace they belong to (or "-")
+    for handler in handlers:
+        handler.addFilter(RequestIdFilter())
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s",
+        level=logging.INFO,
+        handlers=handlers,
+    )
+
+
+def create_flask_app():
+    """Create the Flask app (for hosting/health check)."""
+    from flask import Flask
+
+    app = Flask(__name__)
+
+    @app.route("/")
+    def index():
+        return "Bot is running ✅", 200
+
+    @app.route("/metrics")
+    def metrics():
+        return get_metrics(), 200
+
+    @app.route("/healthz")
+    def healthz():
+        health = get_health()
+        return health, 200 if health["ok"] else 503
+
+    @app.route("/readyz")
+    def readyz():
+        readiness = get_readiness()
+        return readiness, 200 if readiness["ok"] else 503
+
+    def debug_denied():
+        """Error response unless the request carries DEBUG_TOKEN."""
+        from flask import request
+
+        # Disabled unless a token is configured; compared in constant time
+        token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        token = token or request.args.get("token", "")
+        if not DEBUG_TOKEN:
+            return {"error": "not found"}, 404
+        if not hmac.compare_digest(token.encode(), DEBUG_TOKEN.encode()):
+            return {"error": "forbidden"}, 403
+        return None
+
+    @app.route("/debug")
+    def debug():
+        return debug_denied() or (get_debug_info(), 200)
+
+    @app.route("/debug/profile")
+    def debug_profile():
+        from flask import Response, request
+
+        denied = debug_denied()
+        if denied:
+            return denied
+        seconds = request.args.get("seconds", type=float) or PROFILE_DEFAULT_SECONDS
+        loop = bot_supervisor.loop if bot_supervisor else None
+        try:
+            stacks = profiler.profile(seconds, loop)
+        except ProfilerBusy as e:
+            return {"error": str(e)}, 409
+        return Response(
+            stacks,
+            mimetype="text/plain",
+            headers={"Content-Disposition": 'attachment; filename="profile.collapsed"'},
+        )
 
-@app.route("/")
-def index():
-    return "Bot is running ✅", 200
+    return app
 
 
-# Bot token from environment variables
+# Bot token from environment variables (checked when the bot is created, so
+# the fetch pipeline can be imported by tools that don't talk to Telegram)
 BOT_TOKEN = os.getenv("BOT_TOKEN")
-if not BOT_TOKEN:
-    raise ValueError(
-        "BOT_TOKEN not found in environment variables. Please check your .env file."
-    )
 
-# Create a session for better connection handling
-session = requests.Session()
-session.headers.update(
-    {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
-        "Accept-Language": "ar,en-US;q=0.7,en;q=0.3",
-        "Accept-Encoding": "gzip, deflate",
-        "Connection": "keep-alive",
-        "Upgrade-Insecure-Requests": "1",
-    }
+# Optional Bot API server override (e.g. a local Bot API server or a test double)
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL")
+
+# University results endpoint (overridable for local test servers)
+UPSTREAM_URL = os.getenv(
+    "UPSTREAM_URL", "https://www.damascusuniversity.edu.sy/fmee/index.php"
 )
+UPSTREAM_REFERER = UPSTREAM_URL.rsplit("/", 1)[0] + "/"
+
+# Connection pool for the university website
+UPSTREAM_POOL_CONFIG = {
+    # Host pools to keep, and connections kept per host
+    "pool_connections": int(os.getenv("UPSTREAM_POOL_CONNECTIONS", "4")),
+    "pool_maxsize": int(os.getenv("UPSTREAM_POOL_SIZE", "16")),
+    # Wait for a free connection instead of opening a throwaway one
+    "pool_block": os.getenv("UPSTREAM_POOL_BLOCK", "1") == "1",
+    "keepalive": os.getenv("UPSTREAM_TCP_KEEPALIVE", "1") == "1",
+    "keepalive_expiry": float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "60")),
+    "dns_ttl": int(os.getenv("UPSTREAM_DNS_TTL", "300")),  # 0 disables the cache
+    "http2": os.getenv("UPSTREAM_HTTP2", "0") == "1",
+}
+upstream_pool = UpstreamPool(UPSTREAM_URL, UPSTREAM_POOL_CONFIG)
 
-# Configure session for better reliability
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+# Response body is parsed in chunks of this size; after the marks table ends,
+# at most UPSTREAM_DRAIN_LIMIT more bytes are read to keep the connection
+UPSTREAM_CHUNK_SIZE = 16 * 1024
+UPSTREAM_DRAIN_LIMIT = 256 * 1024
+
+# Where pages are parsed and filtered: "thread" parses while streaming in the
+# fetch worker thread; "process" downloads in the thread and parses/filters
+# in a process pool (one worker per core) so peak load isn't GIL-bound
+PARSE_EXECUTOR = os.getenv("PARSE_EXECUTOR", "thread")
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", "0")) or os.cpu_count() or 1
+
+# HTTP session for the university website, created on first use
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Return the shared upstream session, creating it on first use.
+
+    Depending on UPSTREAM_TRANSPORT this is the live pooled session, the
+    live session wrapped to record fixtures, or a fixture replayer.
+    """
+    global _session
+    if _session is not None:
+        return _session
+
+    with _session_lock:
+        if _session is None:
+            if UPSTREAM_TRANSPORT == "replay":
+                from upstream_transport import ReplaySession
+
+                _session = ReplaySession(
+                    UPSTREAM_FIXTURES_DIR, UPSTREAM_REPLAY_TIME_SCALE
+                )
+                return _session
+
+            if UPSTREAM_TRANSPORT not in ("live", "record"):
+                logger.warning(
+                    f"Unknown UPSTREAM_TRANSPORT {UPSTREAM_TRANSPORT!r}; using live"
+                )
+            session = _build_live_session()
+            if UPSTREAM_TRANSPORT == "record":
+                from upstream_transport import RecordingSession
+
+                session = RecordingSession(
+                    session, UPSTREAM_FIXTURES_DIR, UPSTREAM_FIXTURES_SALT
+                )
+                logger.info(f"Recording upstream fixtures to {UPSTREAM_FIXTURES_DIR}")
+            _session = session
+    return _session
+
+
+def check_upstream_transport():
+    """Fail at startup if replay has no fixtures to serve.
+
+    Otherwise every lookup would fail on creating the session, each one
+    counted against the upstream circuit breaker.
+    """
+    if UPSTREAM_TRANSPORT != "replay":
+        return
+    try:
+        get_session()
+    except (OSError, ValueError) as e:
+        raise ValueError(
+            f"UPSTREAM_TRANSPORT=replay needs recorded fixtures in "
+            f"{UPSTREAM_FIXTURES_DIR} (UPSTREAM_FIXTURES_DIR): {e}"
+        ) from e
+
+
+def _build_live_session():
+    """Build the pooled session for the university website."""
+    import urllib3
+    from urllib3.util.retry import Retry
+
+    # Disable SSL warnings
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+    # Configure session for better reliability
+    retry_strategy = Retry(
+        total=3,
+        backoff_factor=1,
+        status_forcelist=[429, 500, 502, 503, 504],
+    )
+    return upstream_pool.build_session(
+        {
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
+            "Accept-Language": "ar,en-US;q=0.7,en;q=0.3",
+            "Accept-Encoding": "gzip, deflate",
+            "Connection": "keep-alive",
+            "Upgrade-Insecure-Requests": "1",
+        },
+        retry_strategy,
+    )
+
+
+# Process pool for PARSE_EXECUTOR=process, created on first use
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+
+def get_parse_pool():
+    """Return the parse process pool, creating it on first use."""
+    global _parse_pool
+    if _parse_pool is not None:
+        return _parse_pool
+
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            # spawn, not fork: the bot process has live threads and an event
+            # loop. Workers encode snapshots with this process's catalog
+            open_storage()
+            _parse_pool = ProcessPoolExecutor(
+                max_workers=PARSE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_start_parse_worker,
+                initargs=(snapshot_codec.subjects,),
+            )
+            logger.info(f"Parse process pool started with {PARSE_WORKERS} workers")
+    return _parse_pool
+
+
+def _start_parse_worker(subjects):
+    """Set up a parse pool worker with the bot's subject catalog."""
+    global snapshot_codec
+    snapshot_codec = SnapshotCodec(subjects)
+
+
+def _replace_parse_pool(broken):
+    """Drop ``broken`` so the next get_parse_pool() starts a new pool."""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is broken:
+            _parse_pool = None
+            logger.warning("Parse process pool broke; starting a new one")
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_parse_pool():
+    """Stop the parse process pool if it was started."""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is not None:
+            _parse_pool.shutdown(cancel_futures=True)
+            _parse_pool = None
+
+
+def call_packed(func, *args):
+    """Run ``func`` in a pool worker and return its result marshalled.
+
+    marshal is the cheapest serializer for the plain dicts/lists/strings
+    the parser and filters return, so results cross the process boundary
+    as one compact bytes object.
+    """
+    return marshal.dumps(func(*args))
+
+
+async def run_cpu_bound(func, *args):
+    """Run parsing/filtering work, in the process pool when enabled.
+
+    A pool whose worker died (e.g. killed for memory) is broken for good, so
+    it's replaced and the call retried once in the new pool.
+    """
+    if PARSE_EXECUTOR != "process":
+        return func(*args)
+    from concurrent.futures.process import BrokenProcessPool
+
+    loop = asyncio.get_running_loop()
+    for attempt in range(2):
+        pool = get_parse_pool()
+        try:
+            packed = await loop.run_in_executor(pool, call_packed, func, *args)
+        except BrokenProcessPool:
+            _replace_parse_pool(pool)
+            if attempt:
+                raise
+            continue
+        return marshal.loads(packed)
+
+
+def warm_up():
+    """Import the fetch stack and build the session ahead of the first lookup."""
+    started = time.perf_counter()
+    get_session()
+    if PARSE_EXECUTOR == "process":
+        # Start the workers now rather than on the first lookup
+        get_parse_pool().submit(len, "").result()
+
+    logger.info(f"Fetch pipeline warmed up in {time.perf_counter() - started:.2f}s")
 
-retry_strategy = Retry(
-    total=3,
-    backoff_factor=1,
-    status_forcelist=[429, 500, 502, 503, 504],
-)
-adapter = HTTPAdapter(max_retries=retry_strategy)
-session.mount("http://", adapter)
-session.mount("https://", adapter)
 
 # Department mapping
 DEPARTMENTS = {
@@ -95,44 +391,847 @@ DEPARTMENTS = {
     "8": "هندسة السيارات والآليات الثقيلة",
 }
 
+# Start fetching a student's results as soon as the number is entered, so
+# the scrape overlaps with the user choosing a year
+PREFETCH_ON_NUMBER = os.getenv("PREFETCH_ON_NUMBER", "1") == "1"
+# Prefetches allowed to run at once; numbers beyond that are fetched on tap
+PREFETCH_MAX_RUNNING = int(os.getenv("PREFETCH_MAX_RUNNING", "32"))
+
+# Inline mode (@bot <student number> [year]): seconds Telegram may reuse an
+# answer for the same query, and how long to wait for an uncached fetch
+# before asking the user to retry (the fetch keeps running meanwhile)
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "300"))
+INLINE_FETCH_TIMEOUT = float(os.getenv("INLINE_FETCH_TIMEOUT", "8"))
+
+# Department looked up until a user picks another one
+DEFAULT_DEPARTMENT_ID = os.getenv("DEFAULT_DEPARTMENT_ID", "2")
+
+# Subject lists per department (subjects/<department id>.txt), loaded on
+# first use of each department
+SUBJECTS_DIR = os.getenv(
+    "SUBJECTS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "subjects")
+)
+subject_catalogs = CatalogRegistry(SUBJECTS_DIR)
+
+# Local storage for cached results and derived analytics
+DATA_DIR = os.getenv("DATA_DIR", "data")
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", "300"))  # seconds
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "2000"))
+# Cached result files: store time (float64) followed by the snapshot
+SNAPSHOT_FILE_HEADER = struct.Struct("<d")
+# How long a "no such student" page is remembered (transient errors never are)
+NEGATIVE_CACHE_TTL = int(os.getenv("NEGATIVE_CACHE_TTL", "600"))  # seconds
+NEGATIVE_CACHE_MAX_ENTRIES = 5000
+# Result snapshots shared by all bot processes on the host through a
+# memory-mapped file (0 slots = off: each process caches on its own). Slots
+# are grouped in sets of 4; snapshots larger than a slot stay per process
+SHARED_CACHE_SLOTS = int(os.getenv("SHARED_CACHE_SLOTS", "0"))
+SHARED_CACHE_SLOT_SIZE = int(os.getenv("SHARED_CACHE_SLOT_SIZE", "4096"))
+SHARED_CACHE_PATH = os.getenv(
+    "SHARED_CACHE_PATH", os.path.join(DATA_DIR, "results", "shared.cache")
+)
+# Rendered result messages, keyed by the cached snapshot they were built from
+RENDER_CACHE_MAX_ENTRIES = int(os.getenv("RENDER_CACHE_MAX_ENTRIES", "1000"))
+
+# Upstream transport: "live", "record" (live, saving anonymized request and
+# response fixtures) or "replay" (serve saved fixtures with their recorded
+# timing multiplied by UPSTREAM_REPLAY_TIME_SCALE; no network access)
+UPSTREAM_TRANSPORT = os.getenv("UPSTREAM_TRANSPORT", "live")
+UPSTREAM_FIXTURES_DIR = os.getenv(
+    "UPSTREAM_FIXTURES_DIR", os.path.join(DATA_DIR, "fixtures")
+)
+UPSTREAM_REPLAY_TIME_SCALE = float(os.getenv("UPSTREAM_REPLAY_TIME_SCALE", "1"))
+# Optional fixed salt for student-number pseudonyms (random per run if unset)
+UPSTREAM_FIXTURES_SALT = os.getenv("UPSTREAM_FIXTURES_SALT")
+
+# Compact binary format for cached results (see open_storage())
+snapshot_codec = None
+
+# Upstream request budget (requests per second and burst size)
+UPSTREAM_RATE = float(os.getenv("UPSTREAM_RATE", "2"))
+UPSTREAM_BURST = int(os.getenv("UPSTREAM_BURST", "4"))
+# Requests allowed to be running against the university website at once
+UPSTREAM_MAX_IN_FLIGHT = int(os.getenv("UPSTREAM_MAX_IN_FLIGHT", "4"))
+
+# Per-user lookup budget (lookups per minute and burst size) and how many
+# users' limiter state is kept before the least recently seen are evicted
+USER_RATE_PER_MINUTE = float(os.getenv("USER_RATE_PER_MINUTE", "6"))
+USER_BURST = int(os.getenv("USER_BURST", "3"))
+USER_LIMITER_MAX_ENTRIES = int(os.getenv("USER_LIMITER_MAX_ENTRIES", "10000"))
+
+# Outbound Telegram API budget: messages per second overall (and burst),
+# per private chat (and burst) and per group per minute; calls rejected with
+# a flood wait are retried this many times
+TELEGRAM_RATE = float(os.getenv("TELEGRAM_RATE", "30"))
+TELEGRAM_BURST = int(os.getenv("TELEGRAM_BURST", "30"))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+TELEGRAM_CHAT_BURST = int(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+TELEGRAM_GROUP_RATE_PER_MINUTE = float(
+    os.getenv("TELEGRAM_GROUP_RATE_PER_MINUTE", "20")
+)
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "3"))
+
+# Consecutive failed requests that open the upstream circuit breaker, and
+# seconds it stays open before a probe request is let through
+UPSTREAM_BREAKER_THRESHOLD = int(os.getenv("UPSTREAM_BREAKER_THRESHOLD", "5"))
+UPSTREAM_BREAKER_COOLDOWN = float(os.getenv("UPSTREAM_BREAKER_COOLDOWN", "30"))
+
+# Health checks: /healthz fails when the event loop hasn't run for this many
+# seconds or the bot hasn't been polling for longer than the grace period;
+# /readyz also fails above this many queued updates and upstream fetches.
+# /debug is only served with DEBUG_TOKEN set (Bearer header or ?token=)
+HEALTH_LOOP_STALL = float(os.getenv("HEALTH_LOOP_STALL", "30"))
+HEALTH_STARTUP_GRACE = float(os.getenv("HEALTH_STARTUP_GRACE", "120"))
+READY_MAX_QUEUE_DEPTH = int(os.getenv("READY_MAX_QUEUE_DEPTH", "200"))
+DEBUG_TOKEN = os.getenv("DEBUG_TOKEN")
+
+# Sampling profiler (/profile and /debug/profile): seconds between samples,
+# default and longest profile duration
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.02"))
+PROFILE_DEFAULT_SECONDS = float(os.getenv("PROFILE_DEFAULT_SECONDS", "10"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+
+# Request tracing: "jsonl" appends traces to TRACE_FILE, "otlp" posts them
+# to a collector (OTLP/HTTP JSON). Traces slower than TRACE_SLOW_MS or with
+# an error are always exported, others with probability TRACE_SAMPLE_RATE
+TRACE_EXPORT = os.getenv("TRACE_EXPORT", "off")
+TRACE_FILE = os.getenv("TRACE_FILE", os.path.join(DATA_DIR, "traces.jsonl"))
+TRACE_OTLP_ENDPOINT = os.getenv(
+    "TRACE_OTLP_ENDPOINT", "http://127.0.0.1:4318/v1/traces"
+)
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "1000"))
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+
+if TRACE_EXPORT == "jsonl":
+    _trace_exporter = JsonLinesExporter(TRACE_FILE)
+elif TRACE_EXPORT == "otlp":
+    _trace_exporter = OtlpExporter(TRACE_OTLP_ENDPOINT, "du-fmee-results-bot")
+else:
+    _trace_exporter = None
+tracer = Tracer(_trace_exporter, TRACE_SLOW_MS, TRACE_SAMPLE_RATE)
+
+# Result-change notifications (/watch): seconds between re-fetches of each
+# watched student, fetches running at once and students watched at most
+WATCH_ENABLED = os.getenv("WATCH_ENABLED", "1") == "1"
+WATCH_INTERVAL = float(os.getenv("WATCH_INTERVAL", "1800"))
+WATCH_CONCURRENCY = int(os.getenv("WATCH_CONCURRENCY", "2"))
+WATCH_MAX_WATCHES = int(os.getenv("WATCH_MAX_WATCHES", "5000"))
+
+# Updates processed at the same time (one slow lookup no longer blocks others)
+BOT_CONCURRENT_UPDATES = int(os.getenv("BOT_CONCURRENT_UPDATES", "64"))
+
+# Telegram user ids allowed to run admin commands (comma separated)
+ADMIN_IDS = {
+    int(user_id)
+    for user_id in os.getenv("ADMIN_IDS", "").split(",")
+    if user_id.strip().isdigit()
+}
+
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Send a message when the command /start is issued."""
-    logger.info("start command called")
-    welcome_text = """
+class ResultCache:
+    """Parsed results cache: bounded in memory, persisted on disk.
+
+    Results are held as binary snapshots (see result_snapshot.py), both in
+    the in-memory LRU and in ``<student>.snap`` files. The disk copy is what
+    the cohort analytics are built from, so entries are kept there even
+    after they expire from the in-memory LRU. JSON files written by older
+    versions are still read.
+
+    With a ``shared`` cache (see shared_cache.py) the snapshots are held
+    there instead of in this process, so every bot process on the host
+    sees each fetched result; only snapshots too large for it stay in the
+    local LRU.
+    """
+
+    def __init__(self, root, ttl, max_entries, codec, shared=None):
+        self.root = root
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.codec = codec
+        self.shared = shared
+        self._entries = OrderedDict()  # (dept, student) -> (stored_at, snapshot)
+        self._lock = threading.Lock()
+
+    def _path(self, student_number, department_id, extension=".snap"):
+        return os.path.join(self.root, department_id, f"{student_number}{extension}")
+
+    def get(self, student_number, department_id, max_age=None):
+        """Return a cached result younger than ``max_age`` seconds, or None."""
+        max_age = self.ttl if max_age is None else max_age
+        key = (department_id, student_number)
+        now = time.time()
+
+        entry = self._entry(key)
+        if entry is None:
+            entry = self._read(student_number, department_id)
+            if entry is None:
+                return None
+            self._remember(key, entry)
+
+        stored_at, snapshot = entry
+        if now - stored_at > max_age:
+            return None
+        return self._decode(snapshot)
+
+    def put(self, student_number, department_id, result, snapshot=None):
+        """Store a parsed result (or its already encoded snapshot)."""
+        if snapshot is None:
+            snapshot = self.codec.encode(result)
+        entry = (time.time(), snapshot)
+        self._remember((department_id, student_number), entry)
+
+        path = self._path(student_number, department_id)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + ".tmp", "wb") as f:
+                f.write(SNAPSHOT_FILE_HEADER.pack(entry[0]))
+                f.write(snapshot)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            logger.warning(f"Could not persist cached result for {student_number}: {e}")
+
+    def digest(self, student_number, department_id):
+        """Content hash of the result held in memory, or None if there is none.
+
+        Equal snapshots of the same student hash the same, so anything keyed
+        by the digest stays valid across re-fetches until the marks change.
+        """
+        entry = self._entry((department_id, student_number))
+        if entry is None:
+            return None
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f"{department_id}:{student_number}:".encode())
+        digest.update(entry[1])
+        return digest.digest()
+
+    def is_fresh(self, student_number, department_id):
+        """Whether a result younger than the TTL is held in memory."""
+        entry = self._entry((department_id, student_number))
+        return entry is not None and time.time() - entry[0] <= self.ttl
+
+    @staticmethod
+    def _shared_key(key):
+        return f"{key[0]}:{key[1]}".encode()
+
+    def _entry(self, key):
+        """The (stored_at, snapshot) held in memory for a key, or None."""
+        if self.shared is not None:
+            entry = self.shared.get(self._shared_key(key))
+            if entry is not None:
+                return entry
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        return entry
+
+    def _remember(self, key, entry):
+        if self.shared is not None and self.shared.put(self._shared_key(key), *entry):
+            with self._lock:
+                self._entries.pop(key, None)
+            return
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _decode(self, snapshot):
+        try:
+            return self.codec.decode(snapshot)
+        except SnapshotError as e:
+            logger.debug(f"Discarding unreadable cached result: {e}")
+            return None
+
+    def _read(self, student_number, department_id):
+        try:
+            with open(self._path(student_number, department_id), "rb") as f:
+                data = f.read()
+            (stored_at,) = SNAPSHOT_FILE_HEADER.unpack_from(data)
+            return stored_at, data[SNAPSHOT_FILE_HEADER.size :]
+        except (OSError, struct.error):
+            pass
+        # Results cached before the snapshot format
+        try:
+            with open(
+                self._path(student_number, department_id, ".json"), encoding="utf-8"
+            ) as f:
+                stored = json.load(f)
+            return stored["stored_at"], self.codec.encode(stored["result"])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "shared": self.shared.snapshot() if self.shared else None,
+            }
+
+    def iter_results(self, department_id):
+        """Yield (student_number, result) for every result stored on disk."""
+        department_dir = os.path.join(self.root, department_id)
+        if not os.path.isdir(department_dir):
+            return
+        student_numbers = set()
+        for file_name in os.listdir(department_dir):
+            student_number, extension = os.path.splitext(file_name)
+            if extension in (".snap", ".json"):
+                student_numbers.add(student_number)
+        for student_number in sorted(student_numbers):
+            entry = self._read(student_number, department_id)
+            if entry is None:
+                continue
+            result = self._decode(entry[1])
+            if result is not None:
+                yield student_number, result
+
+
+# Opened with the rest of the stored state by open_storage()
+result_cache = None
+
+
+class NegativeCache:
+    """Short-lived, in-memory record of student numbers with no results page.
+
+    Only pages that were fully received and had no marks table are added;
+    network errors and bad status codes are retried instead.
+    """
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (dept, student) -> stored_at
+        self._lock = threading.Lock()
+        self.hits = 0
+
+    def contains(self, student_number, department_id):
+        key = (department_id, student_number)
+        with self._lock:
+            stored_at = self._entries.get(key)
+            if stored_at is None:
+                return False
+            if time.time() - stored_at > self.ttl:
+                del self._entries[key]
+                return False
+            self.hits += 1
+            return True
+
+    def add(self, student_number, department_id):
+        key = (department_id, student_number)
+        with self._lock:
+            self._entries[key] = time.time()
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def snapshot(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits}
+
+
+negative_cache = NegativeCache(NEGATIVE_CACHE_TTL, NEGATIVE_CACHE_MAX_ENTRIES)
+
+
+class Prefetcher:
+    """Background full-history fetches started when a student number arrives.
+
+    The fetch doesn't depend on the year the user then picks, so it runs
+    while they choose. There is at most one prefetch per chat: a new number
+    cancels the previous one (an abandoned lookup), and no new prefetch
+    starts while ``max_running`` are already in progress. A prefetch stays
+    pending, running or done, until the year-button handler claims it (the
+    last ``max_pending`` chats are remembered).
+    """
+
+    def __init__(self, max_running, max_pending=10000):
+        self.max_running = max_running
+        self.max_pending = max_pending
+        self._tasks = OrderedDict()  # chat id -> (student, department, task)
+        self.running = 0
+        self.started = 0
+        self.claimed = 0
+        self.cancelled = 0
+        self.skipped = 0
+
+    def pending(self, chat_id, student_number, department_id):
+        """Whether the chat has an unclaimed prefetch of this lookup."""
+        current = self._tasks.get(chat_id)
+        return current is not None and current[:2] == (student_number, department_id)
+
+    def can_start(self, chat_id, student_number, department_id):
+        """Whether start() would start a new prefetch for this lookup."""
+        if self.pending(chat_id, student_number, department_id):
+            return False
+        current = self._tasks.get(chat_id)
+        replaced = current is not None and not current[2].done()
+        return self.running - replaced < self.max_running
+
+    def start(self, chat_id, student_number, department_id):
+        if not self.can_start(chat_id, student_number, department_id):
+            if not self.pending(chat_id, student_number, department_id):
+                self.skipped += 1
+            return
+        current = self._tasks.pop(chat_id, None)
+        if current is not None and not current[2].done():
+            current[2].cancel()
+            self.cancelled += 1
+
+        # Not part of the handler's trace, which ends before the fetch does
+        task = asyncio.get_running_loop().create_task(
+            fetch_student_marks(
+                student_number, "all", department_id, priority="prefetch"
+            ),
+            context=contextvars.Context(),
+        )
+        self._tasks[chat_id] = (student_number, department_id, task)
+        while len(self._tasks) > self.max_pending:
+            self._tasks.popitem(last=False)
+        self.running += 1
+        self.started += 1
+
+        def finished(done_task):
+            self.running -= 1
+
+        task.add_done_callback(finished)
+
+    def claim(self, chat_id, student_number, department_id):
+        """The chat's prefetch task for this lookup (running or done), or None."""
+        if not self.pending(chat_id, student_number, department_id):
+            return None
+        self.claimed += 1
+        return self._tasks.pop(chat_id)[2]
+
+    def snapshot(self):
+        return {
+            "running": self.running,
+            "pending": len(self._tasks),
+            "max_running": self.max_running,
+            "started": self.started,
+            "claimed": self.claimed,
+            "cancelled": self.cancelled,
+            "skipped": self.skipped,
+        }
+
+
+prefetcher = Prefetcher(PREFETCH_MAX_RUNNING)
+
+
+class RenderCache:
+    """Bounded LRU of rendered result messages.
+
+    Keys start with the result snapshot's digest (see
+    :meth:`ResultCache.digest`), so a changed result never matches an old
+    render; stale entries simply fall out of the LRU.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> message text
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if key is None:
+            return None
+        with self._lock:
+            text = self._entries.get(key)
+            if text is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return text
+
+    def put(self, key, text):
+        if key is None:
+            return
+        with self._lock:
+            self._entries[key] = text
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+render_cache = RenderCache(RENDER_CACHE_MAX_ENTRIES)
+
+
+def marks_render_key(user_data, selected_year):
+    """Render cache key for the user's cached result, or None if uncached."""
+    digest = result_cache.digest(
+        user_data["student_number"], user_data["department_id"]
+    )
+    if digest is None:
+        return None
+    # The missing-subjects list depends on the chosen academic year too
+    year_key = (user_data.get("academic_year"), selected_year)
+    return (digest, year_key, user_data.get("specialization"))
+
+
+class UpstreamRateLimiter:
+    """Token bucket shared by every request to the university website.
+
+    Callers reserve a token under a thread lock and sleep outside of it, so
+    the limiter works the same from the bot and from the batch CLI.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token now; return how long to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0
+            return -self._tokens / self.rate
+
+    async def acquire(self):
+        """Wait until the next upstream request is allowed."""
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+upstream_rate_limiter = UpstreamRateLimiter(UPSTREAM_RATE, UPSTREAM_BURST)
+
+# Interactive lookups go ahead of prefetch and batch work for upstream slots
+fetch_scheduler = FetchScheduler(upstream_rate_limiter, UPSTREAM_MAX_IN_FLIGHT)
+
+upstream_breaker = CircuitBreaker(UPSTREAM_BREAKER_THRESHOLD, UPSTREAM_BREAKER_COOLDOWN)
+upstream_request_log = RequestLog()
+
+profiler = SamplingProfiler(PROFILE_INTERVAL, PROFILE_MAX_SECONDS)
+
+
+class UserRateLimiter:
+    """Per-user token buckets and per-chat in-flight callback tracking.
+
+    Buckets live in an LRU bounded by ``max_entries``; an evicted user just
+    starts again with a full bucket. Only used from the event loop thread.
+    """
+
+    def __init__(self, rate_per_minute, burst, max_entries):
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.max_entries = max_entries
+        self._buckets = OrderedDict()  # user_id -> (tokens, updated)
+        self._in_flight = set()  # (chat_id, callback_data)
+        self.throttled = 0
+        self.debounced = 0
+
+    def _refill(self, user_id):
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(user_id, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        self._buckets[user_id] = (tokens, now)
+        while len(self._buckets) > self.max_entries:
+            self._buckets.popitem(last=False)
+        return tokens
+
+    def retry_after(self, user_id):
+        """Seconds until the user has a lookup available (0 if they have one)."""
+        tokens = self._refill(user_id)
+        if tokens >= 1:
+            return 0
+        return (1 - tokens) / self.rate
+
+    def acquire(self, user_id):
+        """Take one lookup from the user's bucket; return the wait if empty."""
+        wait = self.retry_after(user_id)
+        if wait > 0:
+            self.throttled += 1
+            return wait
+        tokens, updated = self._buckets[user_id]
+        self._buckets[user_id] = (tokens - 1, updated)
+        return 0
+
+    def begin(self, chat_id, callback_data):
+        """Mark a callback in flight; False if the same one is already running."""
+        key = (chat_id, callback_data)
+        if key in self._in_flight:
+            self.debounced += 1
+            return False
+        self._in_flight.add(key)
+        return True
+
+    def end(self, chat_id, callback_data):
+        self._in_flight.discard((chat_id, callback_data))
+
+    def snapshot(self):
+        return {
+            "tracked_users": len(self._buckets),
+            "in_flight": len(self._in_flight),
+            "throttled": self.throttled,
+            "debounced": self.debounced,
+        }
+
+
+user_rate_limiter = UserRateLimiter(
+    USER_RATE_PER_MINUTE, USER_BURST, USER_LIMITER_MAX_ENTRIES
+)
+
+
+telegram_rate_limiter = TelegramRateLimiter(
+    TELEGRAM_RATE,
+    TELEGRAM_BURST,
+    TELEGRAM_CHAT_RATE,
+    TELEGRAM_CHAT_BURST,
+    TELEGRAM_GROUP_RATE_PER_MINUTE / 60,
+    TELEGRAM_MAX_RETRIES,
+    tracer=tracer,
+)
+
+
+# Messages sent as is, and templates filled with str.format. Defined once
+# here rather than rebuilt in every handler call
+WELCOME_TEXT = f"""
 🎓 مرحباً بك في بوت علاماتي - نتائج جامعة دمشق
-كلية الهندسة الميكانيكية والكهربائية - قسم هندسة الحواسيب والأتمتة
+كلية الهندسة الميكانيكية والكهربائية - جميع الأقسام
 
 يمكنك الحصول على نتائجك الامتحانية بسهولة!
+🏛️ القسم الافتراضي هو {DEPARTMENTS.get(DEFAULT_DEPARTMENT_ID, "غير محدد")}، ويمكنك اختيار قسمك من زر "🏛️ تغيير القسم"
 
 📋 الأوامر المتاحة:
 /help - المساعدة
 /get_marks - الحصول على النتائج
     """
-    await update.message.reply_text(welcome_text)
-
-
-async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Send a message when the command /help is issued."""
-    logger.info("help command called")
-    help_text = """
+HELP_TEXT = f"""
 🔍 كيفية استخدام بوت علاماتي:
 
 1️⃣ أرسل رقمك الجامعي "وليس الامتحاني"
-2️⃣ اختر السنة الدراسية
+2️⃣ اختر السنة الدراسية، أو اضغط "🏛️ تغيير القسم" إذا لم تكن من قسم {DEPARTMENTS.get(DEFAULT_DEPARTMENT_ID, "غير محدد")}
 3️⃣ احصل على نتائجك!
 
+🔔 /watch لتصلك العلامات الجديدة فور صدورها، و /unwatch لإيقافها
+
 📞 للدعم: تواصل مع المطور @karabala10
     """
-    await update.message.reply_text(help_text)
+ASK_STUDENT_NUMBER_TEXT = "📝 أرسل رقمك الجامعي للحصول على النتائج:"
+INVALID_STUDENT_NUMBER_TEXT = "❌ رقم جامعي غير صحيح. يجب أن يكون 10 أرقام."
+LOADING_TEXT = "⏳ جاري جلب النتائج..."
+NO_RESULTS_TEXT = (
+    "❌ لم يتم العثور على نتائج. تأكد من صحة البيانات.\n\n"
+    "🔧 الأسباب المحتملة:\n"
+    "• رقم الطالب غير صحيح\n"
+    "• مشكلة في الاتصال بالموقع\n"
+    "• الموقع غير متاح مؤقتاً\n\n"
+    "🔄 حاول مرة أخرى بعد قليل."
+)
+FETCH_ERROR_TEXT = (
+    "❌ حدث خطأ أثناء جلب النتائج.\n\n"
+    "🔧 الأسباب المحتملة:\n"
+    "• مشكلة في الاتصال بالإنترنت\n"
+    "• الموقع غير متاح مؤقتاً\n"
+    "• بيانات غير صحيحة\n\n"
+    "🔄 حاول مرة أخرى بعد قليل."
+)
+CHOOSE_YEAR_TEMPLATE = (
+    "✅ رقمك الجامعي: {student_number}\n"
+    "🏛️ القسم: {department}\n\n"
+    "📚 اختر السنة الدراسية:"
+)
+YEAR_LOADING_TEMPLATE = (
+    "✅ السنة المختارة: {year}\n✅ القسم: {department}\n\n⏳ جاري جلب النتائج..."
+)
+NO_YEAR_RESULTS_TEMPLATE = (
+    "❌ لم يتم العثور على نتائج للسنة المختارة: {year}\n\n"
+    "🔍 الأسباب المحتملة:\n"
+    "• لم تتقدم إلى أي مادة في هذه السنة\n"
+    "• لم يتم رفع النتائج بعد\n"
+    "• البيانات غير متاحة مؤقتاً\n\n"
+    "💡 يمكنك:\n"
+    "• اختيار سنة أخرى\n"
+    "• التأكد من صحة رقمك الجامعي\n"
+    "• المحاولة لاحقاً\n\n"
+    "🔄 للبحث مرة أخرى، أرسل رقمك الجامعي."
+)
+
+
+def throttle_message(wait):
+    """Friendly message for a user who ran out of lookups."""
+    return (
+        f"🐢 طلبات كثيرة خلال وقت قصير.\n\n"
+        f"⏳ يرجى الانتظار {math.ceil(wait)} ثانية ثم المحاولة مرة أخرى."
+    )
+
+
+# One cohort store per department, built only from the local result cache
+cohort_stores = {}
+
+
+def get_cohort_store(department_id):
+    """Return the cohort analytics store for a department."""
+    store = cohort_stores.get(department_id)
+    if store is None:
+        # setdefault: rebuild threads may get here at the same time, and
+        # must share one store (and its build lock)
+        store = cohort_stores.setdefault(
+            department_id,
+            CohortStore(os.path.join(DATA_DIR, "cohort", department_id)),
+        )
+    return store
+
+
+def rebuild_cohort_store(department_id):
+    """Rebuild a department's cohort store from cached results (no network)."""
+    store = get_cohort_store(department_id)
+    return store.rebuild(result_cache.iter_results(department_id))
+
+
+def is_admin(update: Update):
+    """Check whether the update comes from a configured admin."""
+    user = update.effective_user
+    return user is not None and user.id in ADMIN_IDS
+
+
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Send a message when the command /start is issued."""
+    logger.info("start command called")
+    await update.message.reply_text(WELCOME_TEXT)
+
+
+async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Send a message when the command /help is issued."""
+    logger.info("help command called")
+    await update.message.reply_text(HELP_TEXT)
 
 
 async def get_marks_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start the marks retrieval process."""
     logger.info("get_marks_command called")
-    await update.message.reply_text("📝 أرسل رقمك الجامعي للحصول على النتائج:")
+    await update.message.reply_text(ASK_STUDENT_NUMBER_TEXT)
+
+
+async def cohort_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin: show cohort statistics for a subject from the local analytics store."""
+    logger.info("cohort command called")
+    if not is_admin(update):
+        return
+
+    args = list(context.args or [])
+    exam_year = None
+    if args and re.match(r"^\d{4}$", args[-1]):
+        exam_year = args.pop()
+    subject = " ".join(args).strip()
+    if not subject:
+        await update.message.reply_text(
+            "📊 الاستخدام: /cohort <اسم المادة> [السنة]\n"
+            "مثال: /cohort قواعد البيانات 2025\n\n"
+            "🔄 لإعادة بناء الإحصائيات: /cohort_rebuild"
+        )
+        return
+
+    department_id = context.user_data.get("department_id", DEFAULT_DEPARTMENT_ID)
+    store = get_cohort_store(department_id)
+    if not store.is_built():
+        await asyncio.to_thread(rebuild_cohort_store, department_id)
+
+    started = time.perf_counter()
+    stats = store.query(subject, exam_year)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    logger.info(f"Cohort query for {subject!r} ({exam_year}) took {elapsed_ms:.2f}ms")
+
+    if not stats:
+        await update.message.reply_text(
+            f"❌ لا توجد بيانات محفوظة للمادة: {subject}"
+            + (f" ({exam_year})" if exam_year else "")
+        )
+        return
+
+    percentiles = stats["percentiles"]
+    distribution_lines = "\n".join(
+        f"• {bucket * 10}-{bucket * 10 + 9}: {count}"
+        for bucket, count in enumerate(stats["distribution"])
+        if count
+    )
+    await update.message.reply_text(
+        f"📊 إحصائيات المادة: {stats['subject']}\n"
+        f"📅 السنة: {stats['year'] or 'جميع السنوات'}\n\n"
+        f"👥 عدد الطلاب: {stats['count']}\n"
+        f"✅ نسبة النجاح: {stats['pass_rate'] * 100:.1f}%\n"
+        f"📈 المتوسط: {stats['mean']:.2f}\n"
+        f"⬇️ الأدنى: {stats['min']:.0f} | ⬆️ الأعلى: {stats['max']:.0f}\n\n"
+        f"📐 المئينات:\n"
+        f"• P10: {percentiles[10]:.1f} | P25: {percentiles[25]:.1f}\n"
+        f"• P50: {percentiles[50]:.1f}\n"
+        f"• P75: {percentiles[75]:.1f} | P90: {percentiles[90]:.1f}\n\n"
+        f"📋 التوزيع:\n{distribution_lines}"
+    )
+
+
+async def cohort_rebuild_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin: rebuild the cohort analytics store from cached results."""
+    logger.info("cohort_rebuild command called")
+    if not is_admin(update):
+        return
+
+    department_id = context.user_data.get("department_id", DEFAULT_DEPARTMENT_ID)
+    index = await asyncio.to_thread(rebuild_cohort_store, department_id)
+    await update.message.reply_text(
+        f"✅ تم تحديث الإحصائيات\n"
+        f"👥 عدد الطلاب: {index['students']}\n"
+        f"📚 عدد الأعمدة: {len(index['columns'])}"
+    )
+
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin: sample the running bot for a few seconds and send the stacks."""
+    logger.info("profile command called")
+    if not is_admin(update):
+        return
+
+    seconds = PROFILE_DEFAULT_SECONDS
+    if context.args:
+        try:
+            seconds = float(context.args[0])
+        except ValueError:
+            await update.message.reply_text(
+                f"⏱️ الاستخدام: /profile [عدد الثواني، حتى {PROFILE_MAX_SECONDS:g}]"
+            )
+            return
+    seconds = min(max(seconds, 1), PROFILE_MAX_SECONDS)
+
+    await update.message.reply_text(f"⏱️ جاري تسجيل الأداء لمدة {seconds:g} ثانية...")
+    try:
+        stacks = await asyncio.to_thread(
+            profiler.profile, seconds, asyncio.get_running_loop()
+        )
+    except ProfilerBusy:
+        await update.message.reply_text("⏳ يوجد تسجيل أداء قيد التنفيذ بالفعل.")
+        return
+
+    stats = profiler.snapshot()
+    await update.message.reply_document(
+        document=stacks.encode("utf-8"),
+        filename=f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}.collapsed",
+        caption=(
+            f"📈 {stats['last_samples']} عينة خلال {seconds:g} ثانية\n"
+            f"(صيغة collapsed لـ flamegraph.pl أو speedscope)"
+        ),
+    )
 
 
+@tracer.traced("student_number", root=True)
 async def handle_student_number(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle student number input."""
     student_number = update.message.text.strip()
@@ -141,48 +1240,139 @@ async def handle_student_number(update: Update, context: ContextTypes.DEFAULT_TY
 
     # Validate student number
     if not re.match(r"^\d{10}$", student_number):
-        await update.message.reply_text("❌ رقم جامعي غير صحيح. يجب أن يكون 10 أرقام.")
+        await update.message.reply_text(INVALID_STUDENT_NUMBER_TEXT)
         return
 
+    # Don't offer another lookup to a user who has used up their budget
+    user = update.effective_user
+    if user is not None and not is_admin(update):
+        wait = user_rate_limiter.retry_after(user.id)
+        if wait > 0:
+            await update.message.reply_text(throttle_message(wait))
+            return
+
     # Store student number in context
     context.user_data["student_number"] = student_number
     logger.info(f"Student number stored: {student_number}")
 
-    # Create academic year selection keyboard
-    keyboard = [
-        [InlineKeyboardButton("السنة الأولى", callback_data="academic_year_1")],
-        [InlineKeyboardButton("السنة الثانية", callback_data="academic_year_2")],
-        [InlineKeyboardButton("السنة الثالثة", callback_data="academic_year_3")],
-        [
-            InlineKeyboardButton(
-                "السنة الرابعة - حواسيب", callback_data="academic_year_4_computer"
-            )
-        ],
-        [
-            InlineKeyboardButton(
-                "السنة الرابعة - تحكم", callback_data="academic_year_4_control"
-            )
-        ],
-        [
-            InlineKeyboardButton(
-                "السنة الخامسة - حواسيب", callback_data="academic_year_5_computer"
-            )
-        ],
-        [
-            InlineKeyboardButton(
-                "السنة الخامسة - تحكم", callback_data="academic_year_5_control"
+    department_id = context.user_data.setdefault("department_id", DEFAULT_DEPARTMENT_ID)
+    chat_id = update.effective_chat.id
+    if PREFETCH_ON_NUMBER and prefetcher.can_start(
+        chat_id, student_number, department_id
+    ):
+        # A prefetch is a lookup: it's paid for now (and skipped when the
+        # budget is used up), and the year tap that claims it is free
+        if is_admin(update) or (
+            user is not None and user_rate_limiter.acquire(user.id) == 0
+        ):
+            prefetcher.start(chat_id, student_number, department_id)
+
+    await update.message.reply_text(
+        CHOOSE_YEAR_TEMPLATE.format(
+            student_number=student_number,
+            department=DEPARTMENTS.get(department_id, "غير محدد"),
+        ),
+        reply_markup=academic_year_keyboard(department_id),
+    )
+
+
+@tracer.traced()
+async def fetch_for_year_choice(chat_id, student_number, department_id):
+    """Full history for a year-button tap, sharing the chat's prefetch if any.
+
+    The lookup is interactive: a prefetch that is still running is joined
+    and raised to the interactive class (see fetch_student_marks), a
+    finished one is served from the caches, and a failed one is retried.
+    """
+    prefetch = prefetcher.claim(chat_id, student_number, department_id)
+    if prefetch is None:
+        tracer.annotate(prefetch="none")
+    else:
+        tracer.annotate(prefetch="running" if not prefetch.done() else "done")
+    return await fetch_student_marks(student_number, "all", department_id)
+
+
+def build_academic_year_keyboard(department_id):
+    """Year buttons for a department's catalog, plus a department switch.
+
+    Departments without a subject catalog can't be split by year, so they
+    only get an "all years" button.
+    """
+    catalog = subject_catalogs.get(department_id)
+    keyboard = []
+    if catalog is not None:
+        for key in catalog.sections:
+            academic_year, _, specialization = key.partition("_")
+            keyboard.append(
+                [
+                    InlineKeyboardButton(
+                        year_label(academic_year, specialization),
+                        callback_data=f"academic_year_{key}",
+                    )
+                ]
             )
-        ],
+    else:
+        keyboard.append(
+            [InlineKeyboardButton("📚 جميع السنوات", callback_data="academic_year_all")]
+        )
+    keyboard.append(
+        [InlineKeyboardButton("🏛️ تغيير القسم", callback_data="choose_department")]
+    )
+    return InlineKeyboardMarkup(keyboard)
+
+
+# Keyboards are immutable, so each is built once (see build_keyboards) and
+# the same object is sent every time
+year_keyboards = {}  # department id -> InlineKeyboardMarkup
+
+
+def academic_year_keyboard(department_id):
+    keyboard = year_keyboards.get(department_id)
+    if keyboard is None:
+        keyboard = year_keyboards[department_id] = build_academic_year_keyboard(
+            department_id
+        )
+    return keyboard
+
+
+DEPARTMENT_KEYBOARD = InlineKeyboardMarkup(
+    [
+        [InlineKeyboardButton(name, callback_data=f"department_{department_id}")]
+        for department_id, name in DEPARTMENTS.items()
     ]
+)
 
-    reply_markup = InlineKeyboardMarkup(keyboard)
 
-    await update.message.reply_text(
-        f"✅ رقمك الجامعي: {student_number}\n\n📚 اختر السنة الدراسية:",
-        reply_markup=reply_markup,
+def build_keyboards():
+    """Build every department's year keyboard ahead of the first message."""
+    for department_id in DEPARTMENTS:
+        academic_year_keyboard(department_id)
+
+
+async def handle_department_choice(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Switch the user's department and show its academic years."""
+    query = update.callback_query
+    await query.answer()
+
+    department_id = query.data.split("_", 1)[1]
+    if department_id not in DEPARTMENTS:
+        return
+    context.user_data["department_id"] = department_id
+    logger.info(f"Department selected: {department_id}")
+
+    student_number = context.user_data.get("student_number")
+    if not student_number:
+        await query.edit_message_text(ASK_STUDENT_NUMBER_TEXT)
+        return
+    await query.edit_message_text(
+        CHOOSE_YEAR_TEMPLATE.format(
+            student_number=student_number, department=DEPARTMENTS[department_id]
+        ),
+        reply_markup=academic_year_keyboard(department_id),
     )
 
 
+@tracer.traced()
 async def handle_academic_year_selection(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ):
@@ -203,18 +1393,24 @@ async def handle_academic_year_selection(
     context.user_data["academic_year"] = academic_year
     context.user_data["specialization"] = specialization
 
-    # Automatically select department 2 (هندسة الحواسيب والأتمتة)
-    context.user_data["department_id"] = "2"
+    # The department picked with the keyboard, else the default one
+    department_id = context.user_data.setdefault("department_id", DEFAULT_DEPARTMENT_ID)
 
     # Show loading message and proceed directly to fetch marks
-    year_display = f"السنة {academic_year}"
-    if specialization:
-        specialization_display = "حواسيب" if specialization == "computer" else "تحكم"
-        year_display += f" - {specialization_display}"
+    if academic_year == "all":
+        year_display = "جميع السنوات"
+    else:
+        year_display = year_label(academic_year, specialization)
 
-    await query.edit_message_text(
-        f"✅ السنة المختارة: {year_display}\n✅ القسم: هندسة الحواسيب والأتمتة\n\n⏳ جاري جلب النتائج..."
-    )
+    # Skip the loading edit when the result is already cached: the result
+    # replaces it right away, so it would only cost an extra API call
+    if not result_cache.is_fresh(context.user_data["student_number"], department_id):
+        await query.edit_message_text(
+            YEAR_LOADING_TEMPLATE.format(
+                year=year_display,
+                department=DEPARTMENTS.get(department_id, "غير محدد"),
+            )
+        )
 
     # Fetch marks directly instead of calling handle_department_selection
     try:
@@ -222,9 +1418,9 @@ async def handle_academic_year_selection(
         logger.info(
             f"Fetching data for student: {context.user_data['student_number']}, department: {context.user_data['department_id']}"
         )
-        all_marks_data = await fetch_student_marks(
+        all_marks_data = await fetch_for_year_choice(
+            update.effective_chat.id if update.effective_chat else None,
             context.user_data["student_number"],
-            "all",  # Fetch all years
             context.user_data["department_id"],
         )
 
@@ -236,10 +1432,22 @@ async def handle_academic_year_selection(
             # Store all marks data in context
             context.user_data["all_marks_data"] = all_marks_data
 
+            # Same result and year as an earlier view: reuse its message
+            render_key = marks_render_key(context.user_data, year_display)
+            if await send_cached_marks_result(query, render_key):
+                return
+
             # Filter data by academic year and specialization
-            filtered_data = filter_marks_by_academic_year(
-                all_marks_data, academic_year, specialization
-            )
+            if academic_year == "all":
+                filtered_data = dict(all_marks_data)
+            else:
+                filtered_data = await run_cpu_bound(
+                    filter_marks_by_academic_year,
+                    all_marks_data,
+                    academic_year,
+                    specialization,
+                    department_id,
+                )
 
             if filtered_data and filtered_data["data"]:
                 logger.info(f"Filtered subjects: {len(filtered_data['data'])}")
@@ -248,44 +1456,21 @@ async def handle_academic_year_selection(
                     "student_name", "غير محدد"
                 )
                 await send_marks_result(
-                    query, filtered_data, context.user_data, year_display
+                    query, filtered_data, context.user_data, year_display, render_key
                 )
             else:
                 # Show proper message when no results found for the selected year
                 logger.info("No results found for selected academic year")
                 await query.edit_message_text(
-                    f"❌ لم يتم العثور على نتائج للسنة المختارة: {year_display}\n\n"
-                    f"🔍 الأسباب المحتملة:\n"
-                    f"• لم تتقدم إلى أي مادة في هذه السنة\n"
-                    f"• لم يتم رفع النتائج بعد\n"
-                    f"• البيانات غير متاحة مؤقتاً\n\n"
-                    f"💡 يمكنك:\n"
-                    f"• اختيار سنة أخرى\n"
-                    f"• التأكد من صحة رقمك الجامعي\n"
-                    f"• المحاولة لاحقاً\n\n"
-                    f"🔄 للبحث مرة أخرى، أرسل رقمك الجامعي."
+                    NO_YEAR_RESULTS_TEMPLATE.format(year=year_display)
                 )
         else:
             logger.error("No data fetched from university website")
-            await query.edit_message_text(
-                "❌ لم يتم العثور على نتائج. تأكد من صحة البيانات.\n\n"
-                "🔧 الأسباب المحتملة:\n"
-                "• رقم الطالب غير صحيح\n"
-                "• مشكلة في الاتصال بالموقع\n"
-                "• الموقع غير متاح مؤقتاً\n\n"
-                "🔄 حاول مرة أخرى بعد قليل."
-            )
+            await query.edit_message_text(NO_RESULTS_TEXT)
 
     except Exception as e:
         logger.error(f"Error fetching marks: {e}")
-        await query.edit_message_text(
-            "❌ حدث خطأ أثناء جلب النتائج.\n\n"
-            "🔧 الأسباب المحتملة:\n"
-            "• مشكلة في الاتصال بالإنترنت\n"
-            "• الموقع غير متاح مؤقتاً\n"
-            "• بيانات غير صحيحة\n\n"
-            "🔄 حاول مرة أخرى بعد قليل."
-        )
+        await query.edit_message_text(FETCH_ERROR_TEXT)
 
 
 async def handle_year_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -310,6 +1495,7 @@ async def handle_year_selection(update: Update, context: ContextTypes.DEFAULT_TY
         await query.edit_message_text(f"❌ لم يتم العثور على نتائج للسنة {year_data}.")
 
 
+@tracer.traced()
 async def handle_department_selection(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ):
@@ -320,21 +1506,22 @@ async def handle_department_selection(
     logger.info("handle_department_selection called")
     logger.info(f"User data: {context.user_data}")
 
-    # Department is already set to "2" in handle_academic_year_selection
-    dept_id = context.user_data.get("department_id", "2")
+    # Department is already set in handle_academic_year_selection
+    dept_id = context.user_data.get("department_id", DEFAULT_DEPARTMENT_ID)
     logger.info(f"Using department_id: {dept_id}")
 
-    # Show loading message
-    await query.edit_message_text("⏳ جاري جلب النتائج...")
+    # Show loading message (unless the result is already cached)
+    if not result_cache.is_fresh(context.user_data["student_number"], dept_id):
+        await query.edit_message_text(LOADING_TEXT)
 
     try:
         # Fetch all years data
         logger.info(
             f"Fetching data for student: {context.user_data['student_number']}, department: {dept_id}"
         )
-        all_marks_data = await fetch_student_marks(
+        all_marks_data = await fetch_for_year_choice(
+            update.effective_chat.id if update.effective_chat else None,
             context.user_data["student_number"],
-            "all",  # Fetch all years
             dept_id,
         )
 
@@ -356,79 +1543,264 @@ async def handle_department_selection(
                 f"Academic year: {academic_year}, Specialization: {specialization}"
             )
 
+            year_display = year_label(academic_year, specialization)
+
+            # Same result and year as an earlier view: reuse its message
+            render_key = marks_render_key(context.user_data, year_display)
+            if await send_cached_marks_result(query, render_key):
+                return
+
             # Filter data by academic year and specialization
-            filtered_data = filter_marks_by_academic_year(
-                all_marks_data, academic_year, specialization
+            filtered_data = await run_cpu_bound(
+                filter_marks_by_academic_year,
+                all_marks_data,
+                academic_year,
+                specialization,
+                dept_id,
             )
 
             if filtered_data and filtered_data["data"]:
-                year_display = f"السنة {academic_year}"
-                if specialization:
-                    specialization_display = (
-                        "حواسيب" if specialization == "computer" else "تحكم"
-                    )
-                    year_display += f" - {specialization_display}"
-
                 logger.info(f"Filtered subjects: {len(filtered_data['data'])}")
                 # Pass the original all_marks_data to preserve student_name
                 filtered_data["student_name"] = all_marks_data.get(
                     "student_name", "غير محدد"
                 )
                 await send_marks_result(
-                    query, filtered_data, context.user_data, year_display
+                    query, filtered_data, context.user_data, year_display, render_key
                 )
             else:
-                year_display = f"السنة {academic_year}"
-                if specialization:
-                    specialization_display = (
-                        "حواسيب" if specialization == "computer" else "تحكم"
-                    )
-                    year_display += f" - {specialization_display}"
-
                 # Show proper message when no results found for the selected year
                 logger.info("No results found for selected academic year")
                 await query.edit_message_text(
-                    f"❌ لم يتم العثور على نتائج للسنة المختارة: {year_display}\n\n"
-                    f"🔍 الأسباب المحتملة:\n"
-                    f"• لم تتقدم إلى أي مادة في هذه السنة\n"
-                    f"• لم يتم رفع النتائج بعد\n"
-                    f"• البيانات غير متاحة مؤقتاً\n\n"
-                    f"💡 يمكنك:\n"
-                    f"• اختيار سنة أخرى\n"
-                    f"• التأكد من صحة رقمك الجامعي\n"
-                    f"• المحاولة لاحقاً\n\n"
-                    f"🔄 للبحث مرة أخرى، أرسل رقمك الجامعي."
+                    NO_YEAR_RESULTS_TEMPLATE.format(year=year_display)
                 )
         else:
             logger.error("No data fetched from university website")
-            await query.edit_message_text(
-                "❌ لم يتم العثور على نتائج. تأكد من صحة البيانات.\n\n"
-                "🔧 الأسباب المحتملة:\n"
-                "• رقم الطالب غير صحيح\n"
-                "• مشكلة في الاتصال بالموقع\n"
-                "• الموقع غير متاح مؤقتاً\n\n"
-                "🔄 حاول مرة أخرى بعد قليل."
-            )
+            await query.edit_message_text(NO_RESULTS_TEXT)
 
     except Exception as e:
         logger.error(f"Error fetching marks: {e}")
-        await query.edit_message_text(
-            "❌ حدث خطأ أثناء جلب النتائج.\n\n"
-            "🔧 الأسباب المحتملة:\n"
-            "• مشكلة في الاتصال بالإنترنت\n"
-            "• الموقع غير متاح مؤقتاً\n"
-            "• بيانات غير صحيحة\n\n"
-            "🔄 حاول مرة أخرى بعد قليل."
+        await query.edit_message_text(FETCH_ERROR_TEXT)
+
+
+@tracer.traced()
+def fetch_marks_page(payload):
+    """POST the results form and parse the page while it streams in.
+
+    Parsing stops as soon as the marks table ends. The rest of the body is
+    drained (when small) so the connection can go back to the pool.
+    Returns ``(status_code, result)``; result is None if no marks table.
+    """
+    import requests
+
+    response = get_session().post(
+        UPSTREAM_URL,
+        data=payload,
+        headers={
+            "Referer": UPSTREAM_REFERER,
+        },
+        timeout=30,
+        verify=False,  # Disable SSL verification for university site
+        stream=True,
+    )
+    try:
+        if response.status_code != 200:
+            return response.status_code, None
+
+        chunks = response.iter_content(UPSTREAM_CHUNK_SIZE)
+        first = next(chunks, b"")
+        if not first:
+            # An empty body is a broken response, not a "no such student" page
+            raise requests.exceptions.ConnectionError("Empty response body")
+        charset = response_charset(response.headers.get("Content-Type"))
+        result, consumed_all = parse_marks_stream(
+            itertools.chain([first], chunks), charset
         )
+        if not consumed_all:
+            drained = 0
+            for chunk in chunks:
+                drained += len(chunk)
+                if drained > UPSTREAM_DRAIN_LIMIT:
+                    break  # Cheaper to drop the connection than read on
+        return response.status_code, result
+    finally:
+        response.close()
+
+
+def parse_marks_snapshot(content, charset):
+    """Parse a page in a pool worker; return its snapshot bytes or None."""
+    result = parse_marks_page(content, charset)
+    return None if result is None else snapshot_codec.encode(result)
+
+
+@tracer.traced()
+def download_marks_page(payload):
+    """POST the results form and return ``(status_code, body, charset)``.
+
+    Used when parsing happens in the process pool: the whole body is read
+    here and parsed by ``parse_marks_page`` in a worker process.
+    """
+    import requests
+
+    response = get_session().post(
+        UPSTREAM_URL,
+        data=payload,
+        headers={
+            "Referer": UPSTREAM_REFERER,
+        },
+        timeout=30,
+        verify=False,  # Disable SSL verification for university site
+    )
+    try:
+        charset = response_charset(response.headers.get("Content-Type"))
+        if response.status_code == 200 and not response.content:
+            raise requests.exceptions.ConnectionError("Empty response body")
+        return response.status_code, response.content, charset
+    finally:
+        response.close()
+
 
+class FetchFailed(Exception):
+    """The results page couldn't be fetched (the site failed, not the number)."""
+
+
+@tracer.traced()
+async def fetch_student_marks(
+    student_number, year, department_id, priority="interactive", raise_errors=False
+):
+    """Fetch student marks from the university website.
 
-async def fetch_student_marks(student_number, year, department_id):
-    """Fetch student marks from the university website."""
+    ``priority`` is the scheduler class: "interactive", "prefetch" or "batch".
+    Returns None for a student number without results, and also when the
+    fetch failed unless ``raise_errors`` is set, which raises FetchFailed.
+    """
     logger.info(
-        f"fetch_student_marks called with: student_number={student_number}, year={year}, department_id={department_id}"
+        f"fetch_student_marks called with: student_number={student_number}, year={year}, department_id={department_id}, priority={priority}"
+    )
+    tracer.annotate(year=year, department=department_id, priority=priority)
+    # Full histories are cached; per-year requests always go upstream
+    if year == "all":
+        cached = result_cache.get(student_number, department_id)
+        if cached is not None:
+            logger.info(f"fetch_student_marks cache hit for {student_number}")
+            tracer.annotate(cache="hit")
+            return cached
+        if negative_cache.contains(student_number, department_id):
+            logger.info(f"fetch_student_marks negative cache hit for {student_number}")
+            tracer.annotate(cache="negative")
+            return None
+
+        # Join a fetch of the same history that is already running (e.g. a
+        # prefetch), raising it to our priority if that's more urgent. It's
+        # shielded so one caller giving up doesn't cancel it for the others;
+        # it's cancelled when its last caller gives up
+        loop = asyncio.get_running_loop()
+        key = (department_id, student_number)
+        entry = _inflight_fetches.get(key)
+        if entry is None or entry[0].get_loop() is not loop:
+            entry = [None, 0, FetchTicket(priority), None]
+            # Traced on its own (see _run_shared_fetch), not in our trace
+            task = entry[0] = loop.create_task(
+                _run_shared_fetch(entry, student_number, department_id),
+                context=contextvars.Context(),
+            )
+            _inflight_fetches[key] = entry
+
+            def forget(done_task):
+                current = _inflight_fetches.get(key)
+                if current is not None and current[0] is done_task:
+                    del _inflight_fetches[key]
+
+            task.add_done_callback(forget)
+        else:
+            logger.info(
+                f"fetch_student_marks joining running fetch for {student_number}"
+            )
+            fetch_scheduler.promote(entry[2], priority)
+        task = entry[0]
+        entry[1] += 1
+        try:
+            return await asyncio.shield(task)
+        except FetchFailed:
+            if raise_errors:
+                raise
+            return None
+        except asyncio.CancelledError:
+            if entry[1] == 1 and not task.done():
+                task.cancel()
+            raise
+        finally:
+            entry[1] -= 1
+            tracer.annotate(shared_fetch_trace=entry[3])
+
+    try:
+        return await _fetch_marks_upstream(
+            student_number, year, department_id, FetchTicket(priority)
+        )
+    except FetchFailed:
+        if raise_errors:
+            raise
+        return None
+
+
+# (department, student) -> [task fetching that full history, waiting callers,
+# its FetchTicket, its trace id]
+_inflight_fetches = {}
+
+
+async def _run_shared_fetch(entry, student_number, department_id):
+    """A full-history fetch shared by its callers, traced as its own trace.
+
+    It outlives the interaction that started it, so its stages get a trace
+    of their own; each caller's trace links to it by id.
+    """
+    with tracer.span("shared_fetch", root=True, priority=entry[2].priority):
+        entry[3] = current_trace_id()
+        return await _fetch_marks_upstream(
+            student_number, "all", department_id, entry[2]
+        )
+
+
+async def _fetch_marks_upstream(student_number, year, department_id, ticket):
+    """Request and parse the results page, logging the fetch for /debug."""
+    request_id = upstream_request_log.begin(
+        student_number, year, department_id, ticket.priority
     )
+    outcome = "error"
+    try:
+        result = await _fetch_marks_with_retries(
+            student_number, year, department_id, ticket
+        )
+        outcome = "found" if result else "empty"
+        return result
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        raise
+    finally:
+        upstream_request_log.end(request_id, outcome)
+
+
+@tracer.traced()
+async def _fetch_marks_with_retries(student_number, year, department_id, ticket):
+    """Request and parse the results page, with retries.
+
+    Every attempt waits for its upstream slot in ``ticket``'s class. Returns
+    None if the student has no results and raises FetchFailed if the page
+    couldn't be fetched.
+    """
+    import requests
+
     max_retries = 3
     for attempt in range(max_retries):
+        tracer.annotate(attempts=attempt + 1)
+        # The site has been failing: don't queue up for it until a probe
+        # request gets through
+        if not upstream_breaker.allow():
+            logger.warning(
+                f"fetch_student_marks skipped for {student_number}: upstream "
+                f"circuit breaker is {upstream_breaker.state}"
+            )
+            raise FetchFailed(f"upstream circuit breaker is {upstream_breaker.state}")
         try:
             # Prepare payload based on year selection
             if year == "all":
@@ -458,105 +1830,93 @@ async def fetch_student_marks(student_number, year, department_id):
                     "Season": "1",
                 }
 
-            # Make request with session
-            response = session.post(
-                "https://www.damascusuniversity.edu.sy/fmee/index.php",
-                data=payload,
-                headers={
-                    "Referer": "https://www.damascusuniversity.edu.sy/fmee/",
-                },
-                timeout=30,
-                verify=False,  # Disable SSL verification for university site
-            )
-
-            if response.status_code != 200:
-                if attempt < max_retries - 1:
-                    continue
-                return None
-
-            # Parse HTML
-            soup = BeautifulSoup(response.content, "html.parser")
-            tables = soup.find_all("table")
-
-            # Find table with marks
-            marks_table = None
-            student_info_table = None
-            for table in tables:
-                table_text = table.get_text()
-                if "راسب" in table_text or "ناجح" in table_text:
-                    marks_table = table
-                elif "الرقم الجامعي" in table_text and "الأسم" in table_text:
-                    student_info_table = table
-
-            if not marks_table:
-                if attempt < max_retries - 1:
-                    continue
-                return None
+            # Wait for an upstream slot by priority, then request and parse
+            # in a worker thread so the event loop keeps serving other users
+            async with fetch_scheduler.slot(ticket):
+                if PARSE_EXECUTOR == "process":
+                    status_code, body, charset = await asyncio.to_thread(
+                        download_marks_page, payload
+                    )
+                    result = snapshot = None
+                    if status_code == 200:
+                        # Parsed results come back from the worker as snapshots
+                        try:
+                            snapshot = await run_cpu_bound(
+                                parse_marks_snapshot, body, charset
+                            )
+                            if snapshot is not None:
+                                result = snapshot_codec.decode(snapshot)
+                        except Exception as e:
+                            # Our parse workers failed, not the site, which
+                            # answered: no breaker failure and no retry
+                            upstream_breaker.record_success()
+                            logger.error(
+                                f"Parsing failed in fetch_student_marks for "
+                                f"{student_number}: {e}"
+                            )
+                            raise FetchFailed(f"parsing failed: {e}") from e
+                else:
+                    snapshot = None
+                    status_code, result = await asyncio.to_thread(
+                        fetch_marks_page, payload
+                    )
 
-            # Extract student name from student info table
-            student_name = "غير محدد"
-            if student_info_table:
-                info_rows = student_info_table.find_all("tr")
-                if len(info_rows) > 1:
-                    first_data_row = info_rows[1]
-                    first_data_cells = first_data_row.find_all(["td", "th"])
-                    if len(first_data_cells) >= 4:  # Name is in the 4th column
-                        student_name = first_data_cells[3].get_text().strip()
-
-            # Extract marks data
-            rows = marks_table.find_all("tr")
-            if len(rows) < 2:
+            if status_code != 200:
+                upstream_breaker.record_failure()
                 if attempt < max_retries - 1:
                     continue
+                raise FetchFailed(f"upstream returned HTTP {status_code}")
+            upstream_breaker.record_success()
+
+            if not result:
+                # A complete page without a marks table means the student
+                # number doesn't exist; asking again won't change that
+                logger.info(f"No results page for {student_number}")
+                if year == "all":
+                    negative_cache.add(student_number, department_id)
                 return None
 
-            # Get header
-            header_row = rows[0]
-            header_cells = header_row.find_all(["td", "th"])
-            headers = [cell.get_text().strip() for cell in header_cells]
-
-            # Get data rows (all subjects, not just successful ones)
-            data_rows = []
-            for row in rows[1:]:
-                cells = row.find_all(["td", "th"])
-                if len(cells) >= 6:  # Ensure we have enough columns
-                    row_data = [cell.get_text().strip() for cell in cells]
-                    data_rows.append(row_data)
-
-            result = {
-                "headers": headers,
-                "data": data_rows,
-                "total_subjects": len(data_rows),
-                "student_name": student_name,
-            }
-            logger.info(f"fetch_student_marks returning: {len(data_rows)} subjects")
+            logger.info(
+                f"fetch_student_marks returning: {result['total_subjects']} subjects"
+            )
+            if year == "all":
+                result_cache.put(student_number, department_id, result, snapshot)
             return result
 
+        except FetchFailed:
+            raise
+        except FetchDeadlineExceeded as e:
+            # The site is saturated; retrying would only queue again
+            logger.warning(f"fetch_student_marks dropped for {student_number}: {e}")
+            raise FetchFailed(str(e)) from e
         except requests.exceptions.ConnectionError as e:
+            upstream_breaker.record_failure()
             logger.error(
                 f"Connection error in fetch_student_marks (attempt {attempt + 1}): {e}"
             )
             if attempt < max_retries - 1:
-                time.sleep(3)  # Wait 3 seconds before retry
+                await asyncio.sleep(3)  # Wait 3 seconds before retry
                 continue
-            return None
+            raise FetchFailed(str(e)) from e
         except requests.exceptions.Timeout as e:
+            upstream_breaker.record_failure()
             logger.error(
                 f"Timeout error in fetch_student_marks (attempt {attempt + 1}): {e}"
             )
             if attempt < max_retries - 1:
-                time.sleep(2)  # Wait 2 seconds before retry
+                await asyncio.sleep(2)  # Wait 2 seconds before retry
                 continue
-            return None
+            raise FetchFailed(str(e)) from e
         except Exception as e:
+            upstream_breaker.record_failure()
             logger.error(f"Error in fetch_student_marks (attempt {attempt + 1}): {e}")
             if attempt < max_retries - 1:
-                time.sleep(2)  # Wait 2 seconds before retry
+                await asyncio.sleep(2)  # Wait 2 seconds before retry
                 continue
-            return None
+            raise FetchFailed(str(e)) from e
 
     logger.error("fetch_student_marks failed after all retries")
-    return None
+    raise FetchFailed("failed after all retries")
 
 
 def get_available_years(marks_data):
@@ -570,15 +1930,18 @@ def get_available_years(marks_data):
             if "-" in year_text:
                 year = year_text.split("-")[0]
                 years.add(year)
-    result = sorted(list(years), reverse=True)  # Latest first
+    result = sorted(years, key=lambda year: (year_rank(year), year), reverse=True)
     logger.info(f"get_available_years returning: {result}")
     return result
 
 
-def detect_student_specialization(marks_data):
+def detect_student_specialization(marks_data, department_id=DEFAULT_DEPARTMENT_ID):
     """Detect student's actual specialization based on their subjects."""
     if not marks_data or not marks_data["data"]:
         return None
+    catalog = subject_catalogs.get(department_id)
+    if catalog is None:
+        return None
 
     # Get all subjects from student's data
     student_subjects = set()
@@ -587,355 +1950,77 @@ def detect_student_specialization(marks_data):
             subject = row[0]
             student_subjects.add(subject)
 
-    # Define computer-specific subjects (only unique to computer specialization)
-    computer_subjects = {
-        "النظم المضمنة",
-        "شبكات حاسوبية متقدمة",
-        "برمجة الشبكات الحاسوبية",
-        "أمن المعلومات والشبكات",
-        "شبكات الحواسيب وتراسل المعطيات",
-        "نظم الاتصالات الحديثة",
-        "نظرية الترميز",
-    }
-
-    # Define control-specific subjects (only unique to control specialization)
-    control_subjects = {
-        "التحكم اللاخطي",
-        "التحكم العائم",
-        "الآلات الكهربائية الخاصة",
-        "الالكترونيات الصناعية",
-        "النظم الخبيرة",
-        "نظم الروبوتية والآلات المبرمجة",
-        "شبكات الحواسيب و تراسل المعطيات",
-        "الشبكات الحاسوبية الصناعية وبروتوكولاتها",
-    }
-
-    # Define shared subjects (common to both specializations)
-    shared_subjects = {
-        "نظم التشغيل",
-        "الاتصالات الرقمية",
-        "الذكاء الصنعي",
-        "قواعد البيانات",
-        "البنى المتقدمة للحاسوب",
-        "معالجة الاشارة",
-        "الوحدات المحيطية للحاسوب",
-        "هندسة البرمجيات",
-    }
-
-    # Count matches for each specialization
-    computer_matches = 0
-    control_matches = 0
-    shared_matches = 0
-
+    # Subjects taught in only one specialization identify it
+    unique_subjects = catalog.specialization_subjects()
+    matches = dict.fromkeys(unique_subjects, 0)
     for subject in student_subjects:
-        # Check for computer-specific subjects
-        for comp_subject in computer_subjects:
-            if comp_subject in subject or subject in comp_subject:
-                computer_matches += 1
+        matched = catalog.match(subject)
+        for specialization, subjects in unique_subjects.items():
+            if matched & subjects:
+                matches[specialization] += 1
                 break
-        else:
-            # Check for control-specific subjects
-            for ctrl_subject in control_subjects:
-                if ctrl_subject in subject or subject in ctrl_subject:
-                    control_matches += 1
-                    break
-            else:
-                # Check for shared subjects
-                for shared_subject in shared_subjects:
-                    if shared_subject in subject or subject in shared_subject:
-                        shared_matches += 1
-                        break
-
-    # Determine specialization based on matches
-    # If only shared subjects, cannot determine specialization
-    if computer_matches == 0 and control_matches == 0 and shared_matches > 0:
-        return None
 
-    # If only computer-specific subjects or more computer matches
-    if computer_matches > control_matches and computer_matches > 0:
-        return "computer"
-    # If only control-specific subjects or more control matches
-    elif control_matches > computer_matches and control_matches > 0:
-        return "control"
-    # If equal matches or no specific subjects
-    else:
+    # The specialization with the most specific subjects; none on a tie
+    ranked = sorted(matches.items(), key=lambda item: item[1], reverse=True)
+    if not ranked or ranked[0][1] == 0:
         return None
+    if len(ranked) > 1 and ranked[1][1] == ranked[0][1]:
+        return None
+    return ranked[0][0]
 
 
-def get_missing_subjects(marks_data, academic_year, specialization=None):
+@tracer.traced()
+def get_missing_subjects(
+    marks_data, academic_year, specialization=None, department_id=DEFAULT_DEPARTMENT_ID
+):
     """Get subjects that should be in this academic year but are not found."""
     if not marks_data or not marks_data["data"]:
         return []
 
-    # Define subjects for each academic year based on subjects.txt
-    academic_year_subjects = {
-        "1": [
-            "اللغة الاجنبية (1)",
-            "اللغة الاجنبية (2)",
-            "التحليل الرياضي (1)",
-            "التحليل الرياضي (2)",
-            "الفيزياء (1)",
-            "الفيزياء (2)",
-            "أسس الهندسة الكهربائية",
-            "الجبر الخطي",
-            "الميكانيك الهندسي",
-            "اللغة العربية",
-            "البرمجة (1)",
-            "المدخل الى الحاسوب والبرمجة",
-            "الثقافة القومية",
-            "الورشات التخصصية (كهربائية والكترونية)",
-        ],
-        "2": [
-            "الدارات المنطقية",
-            "الرياضيات المتقطعة",
-            "الدارات الكهربائية (1)",
-            "الحقول الكهرطيسية",
-            "أسس الهندسة الالكترونية",
-            "الخوارزميات وبنى المعطيات",
-            "اللغة الاجنبية (3)",
-            "التمثيل والرسم الهندسي",
-            "التحليل الرياضي (3)",
-            "البرمجة (2)",
-            "التحليل العددي",
-            "اللغة الاجنبية (4)",
-            "القياسات وأجهزة القياس الكهربائية",
-            "الدارات الكهربائية (2)",
-        ],
-        "3": [
-            "تحليل النظم",
-            "نظم التحكم الآلي",
-            "نظرية التحكم الآلي",
-            "المعالجات الصغرية ونظمها",
-            "الدارات الالكترونية (1)",
-            "القياسات الالكترونية",
-            "أسس هندسة الاتصالات",
-            "الدارات الالكترونية (2)",
-            "بنية الحاسوب وتنظيمه",
-            "النظم المنطقية والرقمية",
-            "الاحتمال والاحصاء",
-            "بحوث العمليات",
-        ],
-        "4_computer": [
-            "قواعد البيانات",
-            "الاتصالات الرقمية",
-            "الذكاء الصنعي",
-            "نظم التشغيل",
-            "معالجة الاشارة",
-            "نظرية الترميز",
-            "الوحدات المحيطية للحاسوب",
-            "البنى المتقدمة للحاسوب",
-            "هندسة البرمجيات",
-            "النظم المضمنة",
-            "شبكات الحواسيب وتراسل المعطيات",
-        ],
-        "4_control": [
-            "نظم التشغيل",
-            "التحكم اللاخطي",
-            "الاتصالات الرقمية",
-            "الالكترونيات الصناعية",
-            "التحكم العائم",
-            "الآلات الكهربائية الخاصة",
-            "الذكاء الصنعي",
-            "قواعد البيانات",
-            "الوحدات المحيطية للحاسوب",
-            "شبكات الحواسيب و تراسل المعطيات",
-            "هندسة البرمجيات",
-            "معالجة الاشارة",
-        ],
-        "5_computer": [
-            "الابصار الحاسوبي",
-            "شبكات حاسوبية متقدمة",
-            "الوثوقية ومعايير الجودة",
-            "الشبكات العصبونية",
-            "نظم الاتصالات الحديثة",
-            "برمجة الشبكات الحاسوبية",
-            "الاقتصاد الهندسي وادارة الاعمال",
-            "أمن المعلومات والشبكات",
-        ],
-        "5_control": [
-            "النظم الخبيرة",
-            "الوثوقية ومعايير الجودة",
-            "الابصار الحاسوبي",
-            "الاقتصاد الهندسي وادارة الاعمال",
-            "الشبكات العصبونية",
-            "نظم الروبوتية والآلات المبرمجة",
-            "الشبكات الحاسوبية الصناعية وبروتوكولاتها",
-            "البنى المتقدمة للحاسوب",
-        ],
-    }
-
     # Get target subjects for the academic year
-    year_key = academic_year
-    if specialization:
-        year_key = f"{academic_year}_{specialization}"
-
-    target_subjects = academic_year_subjects.get(year_key, [])
+    catalog = subject_catalogs.get(department_id)
+    if catalog is None:
+        return []
+    # A year with specializations chosen without one has no single list
+    if not specialization and academic_year not in catalog.sections:
+        return []
+    target_subjects = catalog.subjects_for(academic_year, specialization)
     if not target_subjects:
         return []
 
-    # Get subjects that are actually found
+    # Catalog subjects that the student's rows stand for
     found_subjects = set()
     for row in marks_data["data"]:
         if len(row) >= 6:
-            subject = row[0]
-            found_subjects.add(subject)
+            found_subjects.update(catalog.match(row[0]))
 
     # Find missing subjects
-    missing_subjects = []
-    for target_subject in target_subjects:
-        found = False
-        for found_subject in found_subjects:
-            if (
-                target_subject == found_subject
-                or target_subject in found_subject
-                or found_subject in target_subject
-            ):
-                found = True
-                break
-        if not found:
-            missing_subjects.append(target_subject)
-
-    return missing_subjects
+    return [subject for subject in target_subjects if subject not in found_subjects]
 
 
-def filter_marks_by_academic_year(marks_data, academic_year, specialization=None):
+@tracer.traced()
+def filter_marks_by_academic_year(
+    marks_data, academic_year, specialization=None, department_id=DEFAULT_DEPARTMENT_ID
+):
     """Filter marks data by academic year and specialization."""
     logger.info(
-        f"filter_marks_by_academic_year called with academic_year={academic_year}, specialization={specialization}"
+        f"filter_marks_by_academic_year called with academic_year={academic_year}, specialization={specialization}, department_id={department_id}"
     )
     if not marks_data or not marks_data["data"]:
         logger.info("No marks data provided")
         return None
 
-    # Define subjects for each academic year based on subjects.txt
-    academic_year_subjects = {
-        "1": [
-            "اللغة الاجنبية (1)",
-            "اللغة الاجنبية (2)",
-            "التحليل الرياضي (1)",
-            "التحليل الرياضي (2)",
-            "الفيزياء (1)",
-            "الفيزياء (2)",
-            "أسس الهندسة الكهربائية",
-            "الجبر الخطي",
-            "الميكانيك الهندسي",
-            "اللغة العربية",
-            "البرمجة (1)",
-            "المدخل الى الحاسوب والبرمجة",
-            "الثقافة القومية",
-            "الورشات التخصصية (كهربائية والكترونية)",
-        ],
-        "2": [
-            "الدارات المنطقية",
-            "الرياضيات المتقطعة",
-            "الدارات الكهربائية (1)",
-            "الحقول الكهرطيسية",
-            "أسس الهندسة الالكترونية",
-            "الخوارزميات وبنى المعطيات",
-            "اللغة الاجنبية (3)",
-            "التمثيل والرسم الهندسي",
-            "التحليل الرياضي (3)",
-            "البرمجة (2)",
-            "التحليل العددي",
-            "اللغة الاجنبية (4)",
-            "القياسات وأجهزة القياس الكهربائية",
-            "الدارات الكهربائية (2)",
-        ],
-        "3": [
-            "تحليل النظم",
-            "نظم التحكم الآلي",
-            "نظرية التحكم الآلي",
-            "المعالجات الصغرية ونظمها",
-            "الدارات الالكترونية (1)",
-            "القياسات الالكترونية",
-            "أسس هندسة الاتصالات",
-            "الدارات الالكترونية (2)",
-            "بنية الحاسوب وتنظيمه",
-            "النظم المنطقية والرقمية",
-            "الاحتمال والاحصاء",
-            "بحوث العمليات",
-        ],
-        "4_computer": [
-            "قواعد البيانات",
-            "الاتصالات الرقمية",
-            "الذكاء الصنعي",
-            "نظم التشغيل",
-            "معالجة الاشارة",
-            "نظرية الترميز",
-            "الوحدات المحيطية للحاسوب",
-            "البنى المتقدمة للحاسوب",
-            "هندسة البرمجيات",
-            "النظم المضمنة",
-            "شبكات الحواسيب وتراسل المعطيات",
-        ],
-        "4_control": [
-            "نظم التشغيل",
-            "التحكم اللاخطي",
-            "الاتصالات الرقمية",
-            "الالكترونيات الصناعية",
-            "التحكم العائم",
-            "الآلات الكهربائية الخاصة",
-            "الذكاء الصنعي",
-            "قواعد البيانات",
-            "الوحدات المحيطية للحاسوب",
-            "شبكات الحواسيب و تراسل المعطيات",
-            "هندسة البرمجيات",
-            "معالجة الاشارة",
-        ],
-        "5_computer": [
-            "الابصار الحاسوبي",
-            "شبكات حاسوبية متقدمة",
-            "الوثوقية ومعايير الجودة",
-            "الشبكات العصبونية",
-            "نظم الاتصالات الحديثة",
-            "برمجة الشبكات الحاسوبية",
-            "الاقتصاد الهندسي وادارة الاعمال",
-            "أمن المعلومات والشبكات",
-        ],
-        "5_control": [
-            "النظم الخبيرة",
-            "الوثوقية ومعايير الجودة",
-            "الابصار الحاسوبي",
-            "الاقتصاد الهندسي وادارة الاعمال",
-            "الشبكات العصبونية",
-            "نظم الروبوتية والآلات المبرمجة",
-            "الشبكات الحاسوبية الصناعية وبروتوكولاتها",
-            "البنى المتقدمة للحاسوب",
-        ],
-    }
-
-    # Get subjects for the selected academic year
-    if specialization:
-        year_key = f"{academic_year}_{specialization}"
-        target_subjects = academic_year_subjects.get(year_key, [])
-    else:
-        # For years 4 and 5 without specialization, get all subjects from both specializations
-        if academic_year in ["4", "5"]:
-            computer_key = f"{academic_year}_computer"
-            control_key = f"{academic_year}_control"
-            computer_subjects = academic_year_subjects.get(computer_key, [])
-            control_subjects = academic_year_subjects.get(control_key, [])
-            # Combine both lists and remove duplicates
-            target_subjects = list(set(computer_subjects + control_subjects))
-        else:
-            year_key = academic_year
-            target_subjects = academic_year_subjects.get(year_key, [])
-
-    # Debug logging
-    logger.info(f"Academic year: {academic_year}, Specialization: {specialization}")
-    if specialization:
-        logger.info(f"Year key: {academic_year}_{specialization}")
-    else:
-        logger.info(f"Year key: {academic_year} (no specialization)")
-    logger.info(f"Target subjects count: {len(target_subjects)}")
-
-    if not target_subjects:
+    # Sections of the department's catalog for the selected academic year
+    # (years 4 and 5 without specialization cover both specializations)
+    catalog = subject_catalogs.get(department_id)
+    year_keys = catalog.year_keys(academic_year, specialization) if catalog else ()
+    logger.info(f"Year keys: {year_keys}")
+    if not year_keys:
         return None
+    year_keys = frozenset(year_keys)
 
     # Filter data to include only subjects from the academic year
     filtered_data = []
-    logger.info(f"Looking for subjects in academic year {academic_year}")
-    logger.info(f"Target subjects: {target_subjects[:3]}...")  # Show first 3
     logger.info(f"Total subjects to search: {len(marks_data['data'])}")
 
     for row in marks_data["data"]:
@@ -953,17 +2038,9 @@ def filter_marks_by_academic_year(marks_data, academic_year, specialization=None
             ):
                 continue
 
-            # Check if subject matches any of the target subjects (partial match)
-            for target_subject in target_subjects:
-                # More precise matching - exact match or very close match
-                if (
-                    subject == target_subject
-                    or target_subject in subject
-                    or subject in target_subject
-                ):
-                    filtered_data.append(row)
-                    logger.info(f"Matched: {subject} -> {target_subject}")
-                    break
+            # Subject belongs to one of the selected sections (partial match)
+            if catalog.years_of(subject) & year_keys:
+                filtered_data.append(row)
 
     logger.info(f"Found {len(filtered_data)} matching subjects")
 
@@ -972,50 +2049,8 @@ def filter_marks_by_academic_year(marks_data, academic_year, specialization=None
         # Return None to indicate no results found for this academic year
         return None
 
-    # Group by subject and get latest mark for each
-    subjects = {}
-    for row in filtered_data:
-        if len(row) >= 6:
-            subject = row[0]  # Subject name
-            year = row[1] if len(row) > 1 else ""  # Year
-            semester = row[2] if len(row) > 2 else ""  # Semester
-            final_mark = row[5] if len(row) > 5 else ""
-            result = row[6] if len(row) > 6 else ""
-
-            # Skip if no valid mark or result
-            if (
-                not final_mark
-                or final_mark.strip() == ""
-                or not result
-                or result.strip() == ""
-            ):
-                continue
-
-            # Keep only the latest attempt for each subject
-            if subject not in subjects:
-                subjects[subject] = row
-            else:
-                # Compare years first (higher year is more recent)
-                current_year = subjects[subject][1]
-                if year > current_year:
-                    subjects[subject] = row
-                elif year == current_year:
-                    # If same year, compare semesters (فصل ثاني is later than فصل أول)
-                    current_semester = subjects[subject][2]
-                    if semester == "فصل ثاني" and current_semester == "فصل أول":
-                        subjects[subject] = row
-                    # If same year and semester, keep the one with higher mark
-                    elif semester == current_semester:
-                        try:
-                            current_mark = float(subjects[subject][5])
-                            new_mark = float(row[5])
-                            if new_mark > current_mark:
-                                subjects[subject] = row
-                        except (ValueError, IndexError):
-                            pass
-
-    # Convert back to list format
-    final_data = list(subjects.values())
+    # Keep only the latest attempt for each subject
+    final_data = latest_attempts(filtered_data)
 
     return {
         "headers": marks_data["headers"],
@@ -1050,44 +2085,8 @@ def filter_marks_by_year(marks_data, selected_year):
     if not year_data:
         return None
 
-    # Group by subject and get latest mark for each
-    subjects = {}
-    for row in year_data:
-        if len(row) >= 6:
-            subject = row[0]  # Subject name
-            semester = row[2]  # Semester
-            final_mark = row[5] if len(row) > 5 else ""
-            result = row[6] if len(row) > 6 else ""
-
-            # Skip if no valid mark or result
-            if (
-                not final_mark
-                or final_mark.strip() == ""
-                or not result
-                or result.strip() == ""
-            ):
-                continue
-
-            # Keep only the latest semester for each subject
-            if subject not in subjects:
-                subjects[subject] = row
-            else:
-                # Compare semesters (فصل ثاني is later than فصل أول)
-                current_semester = subjects[subject][2]
-                if semester == "فصل ثاني" and current_semester == "فصل أول":
-                    subjects[subject] = row
-                # If same semester, keep the one with higher mark
-                elif semester == current_semester:
-                    try:
-                        current_mark = float(subjects[subject][5])
-                        new_mark = float(row[5])
-                        if new_mark > current_mark:
-                            subjects[subject] = row
-                    except (ValueError, IndexError):
-                        pass
-
-    # Convert back to list format
-    filtered_data = list(subjects.values())
+    # Keep only the latest attempt for each subject
+    filtered_data = latest_attempts(year_data)
 
     result = {
         "headers": marks_data["headers"],
@@ -1100,54 +2099,61 @@ def filter_marks_by_year(marks_data, selected_year):
     return result
 
 
-async def send_marks_result(query, marks_data, user_data, selected_year=None):
-    """Send formatted marks result to user."""
-    logger.info(f"send_marks_result called with {len(marks_data['data'])} subjects")
-    try:
-        # Calculate statistics (only for successful subjects)
-        total_marks = 0
-        valid_marks = 0
-        successful_subjects = 0
-        failed_subjects = 0
-
-        for row in marks_data["data"]:
-            if len(row) >= 6:  # Ensure we have the final mark column
-                try:
-                    mark = float(row[5])  # Final mark column
-                    result = row[6] if len(row) > 6 else ""  # Result column
-
-                    if "ناجح" in result:
-                        total_marks += mark
-                        valid_marks += 1
-                        successful_subjects += 1
-                    else:
-                        failed_subjects += 1
-                except (ValueError, IndexError):
-                    pass
-
-        average = total_marks / valid_marks if valid_marks > 0 else 0
-
-        # Get missing subjects
-        missing_subjects = get_missing_subjects(
-            marks_data, user_data.get("academic_year"), user_data.get("specialization")
-        )
+def calculate_marks_statistics(marks_data):
+    """Count successful/failed subjects and average the successful marks."""
+    total_marks = 0
+    valid_marks = 0
+    successful_subjects = 0
+    failed_subjects = 0
+
+    for row in marks_data["data"]:
+        if len(row) >= 6:  # Ensure we have the final mark column
+            try:
+                mark = float(row[5])  # Final mark column
+                result = row[6] if len(row) > 6 else ""  # Result column
+
+                if "ناجح" in result:
+                    total_marks += mark
+                    valid_marks += 1
+                    successful_subjects += 1
+                else:
+                    failed_subjects += 1
+            except (ValueError, IndexError):
+                pass
+
+    average = total_marks / valid_marks if valid_marks > 0 else 0
+    return successful_subjects, failed_subjects, average
+
+
+@tracer.traced()
+def render_marks_result(marks_data, user_data, selected_year=None):
+    """Build the result message text for a (filtered) marks result."""
+    # Calculate statistics (only for successful subjects)
+    successful_subjects, failed_subjects, average = calculate_marks_statistics(
+        marks_data
+    )
+
+    # Get missing subjects
+    missing_subjects = get_missing_subjects(
+        marks_data,
+        user_data.get("academic_year"),
+        user_data.get("specialization"),
+        user_data.get("department_id", DEFAULT_DEPARTMENT_ID),
+    )
 
-        # Format result message
-        year_display = selected_year if selected_year else "جميع السنوات"
+    # Format result message
+    year_display = selected_year if selected_year else "جميع السنوات"
 
-        # Add specialization info if selected
-        specialization_info = ""
-        specialization = user_data.get("specialization")
-        if specialization:
-            specialization_display = (
-                "حواسيب" if specialization == "computer" else "تحكم"
-            )
-            specialization_info = f"\n🎯 التخصص: {specialization_display}"
+    # Add specialization info if selected
+    specialization_info = ""
+    specialization = user_data.get("specialization")
+    if specialization:
+        specialization_info = f"\n🎯 التخصص: {specialization_label(specialization)}"
 
-        # Get student name from marks data
-        student_name = marks_data.get("student_name", "غير محدد")
+    # Get student name from marks data
+    student_name = marks_data.get("student_name", "غير محدد")
 
-        result_text = f"""🎓 نتائج الطالب: {user_data['student_number']}
+    result_text = f"""🎓 نتائج الطالب: {user_data['student_number']}
 👤 الاسم: {student_name}
 📚 القسم: {DEPARTMENTS.get(user_data['department_id'], 'غير محدد')}
 📅 السنة: {year_display}{specialization_info}
@@ -1160,32 +2166,55 @@ async def send_marks_result(query, marks_data, user_data, selected_year=None):
 
 📋 النتائج:"""
 
-        # Add all marks details
-        for i, row in enumerate(marks_data["data"]):
-            if len(row) >= 6:
-                subject = row[0] if len(row) > 0 else "غير محدد"
-                final_mark = row[5] if len(row) > 5 else "غير محدد"
-                semester = row[2] if len(row) > 2 else "غير محدد"
-                result = row[6] if len(row) > 6 else "غير محدد"
-                year = row[1] if len(row) > 1 else "غير محدد"
+    # Add all marks details
+    for i, row in enumerate(marks_data["data"]):
+        if len(row) >= 6:
+            subject = row[0] if len(row) > 0 else "غير محدد"
+            final_mark = row[5] if len(row) > 5 else "غير محدد"
+            semester = row[2] if len(row) > 2 else "غير محدد"
+            result = row[6] if len(row) > 6 else "غير محدد"
+            year = row[1] if len(row) > 1 else "غير محدد"
 
-                # Truncate long subject names
-                if len(subject) > 35:
-                    subject = subject[:32] + "..."
+            # Truncate long subject names
+            if len(subject) > 35:
+                subject = subject[:32] + "..."
 
-                # Add status emoji
-                status_emoji = "✅" if "ناجح" in result else "❌"
+            # Add status emoji
+            status_emoji = "✅" if "ناجح" in result else "❌"
 
-                result_text += (
-                    f"\n{status_emoji} {subject}: {final_mark} ({year} - {semester})"
-                )
+            result_text += (
+                f"\n{status_emoji} {subject}: {final_mark} ({year} - {semester})"
+            )
 
-        # Add missing subjects if any
-        if missing_subjects:
-            result_text += "\n\n❌ المواد التي لم يتم التقدم إليها:"
-            for missing_subject in missing_subjects:
-                result_text += f"\n• {missing_subject}"
+    # Add missing subjects if any
+    if missing_subjects:
+        result_text += "\n\n❌ المواد التي لم يتم التقدم إليها:"
+        for missing_subject in missing_subjects:
+            result_text += f"\n• {missing_subject}"
 
+    return result_text
+
+
+@tracer.traced()
+async def send_cached_marks_result(query, render_key):
+    """Show a previously rendered result; return False if there is none."""
+    result_text = render_cache.get(render_key)
+    if result_text is None:
+        return False
+    logger.info("Reusing rendered result message")
+    await query.edit_message_text(result_text)
+    return True
+
+
+@tracer.traced()
+async def send_marks_result(
+    query, marks_data, user_data, selected_year=None, render_key=None
+):
+    """Send formatted marks result to user."""
+    logger.info(f"send_marks_result called with {len(marks_data['data'])} subjects")
+    try:
+        result_text = render_marks_result(marks_data, user_data, selected_year)
+        render_cache.put(render_key, result_text)
         await query.edit_message_text(result_text)
 
     except Exception as e:
@@ -1193,16 +2222,345 @@ async def send_marks_result(query, marks_data, user_data, selected_year=None):
         await query.edit_message_text("❌ حدث خطأ في عرض النتائج.")
 
 
+@tracer.traced("callback_query", root=True)
 async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle callback queries."""
     query = update.callback_query
 
     logger.info(f"handle_callback_query called with data: {query.data}")
+    tracer.annotate(data=query.data)
 
     if query.data.startswith("academic_year_"):
-        await handle_academic_year_selection(update, context)
+        chat_id = update.effective_chat.id if update.effective_chat else None
+        # Repeated taps on the same button while its lookup is running
+        if not user_rate_limiter.begin(chat_id, query.data):
+            await query.answer("⏳ جاري جلب النتائج، يرجى الانتظار...")
+            return
+        try:
+            # The lookup was already paid for if it's the chat's prefetch
+            prepaid = prefetcher.pending(
+                chat_id,
+                context.user_data.get("student_number"),
+                context.user_data.get("department_id", DEFAULT_DEPARTMENT_ID),
+            )
+            if not is_admin(update) and not prepaid:
+                wait = user_rate_limiter.acquire(query.from_user.id)
+                if wait > 0:
+                    await query.answer(throttle_message(wait), show_alert=True)
+                    return
+            await handle_academic_year_selection(update, context)
+        finally:
+            user_rate_limiter.end(chat_id, query.data)
+    elif query.data == "choose_department":
+        await query.answer()
+        await query.edit_message_text(
+            "🏛️ اختر القسم:", reply_markup=DEPARTMENT_KEYBOARD
+        )
+    elif query.data.startswith("department_"):
+        await handle_department_choice(update, context)
     elif query.data == "new_search":
-        await query.edit_message_text("📝 أرسل رقمك الجامعي للحصول على النتائج:")
+        await query.edit_message_text(ASK_STUDENT_NUMBER_TEXT)
+
+
+# "<student number> [year] [specialization]", e.g. "2019123456 4 حواسيب"
+INLINE_QUERY_PATTERN = re.compile(r"^(\d{10})(?:\s+([1-5])(?:[\s_]+(\S+))?)?$")
+
+
+@tracer.traced()
+async def render_year_view(all_marks_data, view, year_display):
+    """Result text for one year of a full history, or None if it's empty.
+
+    ``view`` holds the same keys as a chat's user_data (student_number,
+    department_id, academic_year, specialization), so chat and inline
+    lookups share rendered messages.
+    """
+    render_key = marks_render_key(view, year_display)
+    result_text = render_cache.get(render_key)
+    if result_text is not None:
+        return result_text
+
+    if view["academic_year"] == "all":
+        filtered_data = dict(all_marks_data)
+    else:
+        filtered_data = await run_cpu_bound(
+            filter_marks_by_academic_year,
+            all_marks_data,
+            view["academic_year"],
+            view["specialization"],
+            view["department_id"],
+        )
+    if not filtered_data or not filtered_data["data"]:
+        return None
+    filtered_data["student_name"] = all_marks_data.get("student_name", "غير محدد")
+    result_text = render_marks_result(filtered_data, view, year_display)
+    render_cache.put(render_key, result_text)
+    return result_text
+
+
+def inline_article(result_id, title, text, description=None):
+    return InlineQueryResultArticle(
+        id=result_id,
+        title=title,
+        description=description,
+        input_message_content=InputTextMessageContent(text),
+    )
+
+
+@tracer.traced("inline_query", root=True)
+async def handle_inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Answer "@bot <student number> [year]" with result messages to send."""
+    query = update.inline_query
+    match = INLINE_QUERY_PATTERN.match(query.query.strip())
+    if not match:
+        # Still typing (or not a lookup): point at the expected format
+        await query.answer(
+            [],
+            cache_time=INLINE_CACHE_TIME,
+            button=InlineQueryResultsButton(
+                text="📝 اكتب رقمك الجامعي ثم السنة (اختياري)", start_parameter="help"
+            ),
+        )
+        return
+
+    student_number, academic_year, specialization = match.groups()
+    specialization = SPECIALIZATIONS.get(specialization, specialization)
+    department_id = context.user_data.get("department_id", DEFAULT_DEPARTMENT_ID)
+    logger.info(
+        f"Inline lookup: student={student_number}, year={academic_year}, specialization={specialization}"
+    )
+
+    # Cached histories are free; a new fetch costs the user's lookup budget
+    all_marks_data = result_cache.get(student_number, department_id)
+    if all_marks_data is None:
+        if not is_admin(update):
+            wait = user_rate_limiter.acquire(query.from_user.id)
+            if wait > 0:
+                await query.answer(
+                    [inline_article("throttled", "⏳", throttle_message(wait))],
+                    cache_time=0,
+                    is_personal=True,
+                )
+                return
+        try:
+            all_marks_data = await asyncio.wait_for(
+                asyncio.shield(
+                    fetch_student_marks(student_number, "all", department_id)
+                ),
+                INLINE_FETCH_TIMEOUT,
+            )
+        except asyncio.TimeoutError:
+            # The fetch keeps running and fills the cache for the next query
+            await query.answer(
+                [
+                    inline_article(
+                        "pending",
+                        "⏳ جاري جلب النتائج...",
+                        "⏳ جاري جلب النتائج، أعد المحاولة بعد لحظات.",
+                        "أعد كتابة الطلب بعد لحظات",
+                    )
+                ],
+                cache_time=0,
+                is_personal=True,
+            )
+            return
+
+    if not all_marks_data or not all_marks_data["data"]:
+        await query.answer(
+            [
+                inline_article(
+                    "not_found",
+                    "❌ لم يتم العثور على نتائج",
+                    f"❌ لم يتم العثور على نتائج للرقم الجامعي {student_number}.",
+                    "تأكد من صحة الرقم الجامعي",
+                )
+            ],
+            cache_time=0,
+            is_personal=True,
+        )
+        return
+
+    # One result per year of the department (or just the requested one)
+    catalog = subject_catalogs.get(department_id)
+    if academic_year:
+        choices = [(academic_year, specialization)]
+    elif catalog is not None:
+        choices = [key.partition("_")[::2] for key in catalog.sections]
+    else:
+        choices = []
+    choices.append(("all", None))
+
+    results = []
+    student_name = all_marks_data.get("student_name", "")
+    for year, year_specialization in choices:
+        year_specialization = year_specialization or None
+        if year == "all":
+            year_display = "جميع السنوات"
+        else:
+            year_display = year_label(year, year_specialization)
+        view = {
+            "student_number": student_number,
+            "department_id": department_id,
+            "academic_year": year,
+            "specialization": year_specialization,
+        }
+        result_text = await render_year_view(all_marks_data, view, year_display)
+        if result_text is not None:
+            results.append(
+                inline_article(
+                    f"{student_number}_{year}_{year_specialization or ''}",
+                    f"📅 {year_display}",
+                    result_text,
+                    student_name,
+                )
+            )
+
+    await query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=True)
+
+
+@tracer.traced("watch_check", root=True)
+async def fetch_for_watch(student_number, department_id):
+    """Scheduled re-fetch of a watched student, behind interactive lookups."""
+    return await fetch_student_marks(
+        student_number, "all", department_id, priority="batch"
+    )
+
+
+# Opened with the rest of the stored state by open_storage()
+watch_registry = None
+watch_engine = None
+
+
+def open_storage():
+    """Load the state kept in DATA_DIR: subject catalog, caches and watches.
+
+    Called at startup (and by the scripts that use the caches) rather than
+    on import, so importing the bot, e.g. in a parse worker, writes nothing.
+    Later calls do nothing.
+    """
+    global snapshot_codec, result_cache, watch_registry, watch_engine
+    if snapshot_codec is not None:
+        return
+
+    # Subjects are stored as ids into an append-only catalog kept next to
+    # the cache, so ids stay stable when the subject lists change. It's
+    # seeded from the default department; other departments' subject names
+    # are stored inline
+    default_catalog = subject_catalogs.get(DEFAULT_DEPARTMENT_ID)
+    snapshot_codec = SnapshotCodec(
+        load_catalog(
+            os.path.join(DATA_DIR, "results", "catalog.txt"),
+            sorted(default_catalog.subjects) if default_catalog else [],
+        )
+    )
+    result_cache = ResultCache(
+        os.path.join(DATA_DIR, "results"),
+        RESULT_CACHE_TTL,
+        RESULT_CACHE_MAX_ENTRIES,
+        snapshot_codec,
+        (
+            SharedCache(SHARED_CACHE_PATH, SHARED_CACHE_SLOTS, SHARED_CACHE_SLOT_SIZE)
+            if SHARED_CACHE_SLOTS
+            else None
+        ),
+    )
+    watch_registry = WatchRegistry(
+        os.path.join(DATA_DIR, "watches"), snapshot_codec, WATCH_MAX_WATCHES
+    )
+    watch_engine = WatchEngine(
+        watch_registry, fetch_for_watch, WATCH_INTERVAL, WATCH_CONCURRENCY
+    )
+
+
+def format_watch_changes(watch, changes):
+    """Notification text listing new and changed marks."""
+    text = f"🔔 تحديث في نتائج الطالب: {watch.student_number}\n"
+    for previous, row in changes:
+        subject, year, semester = row[0], row[1], row[2]
+        final_mark = row[5] if len(row) > 5 else "غير محدد"
+        result = row[6] if len(row) > 6 else ""
+        status_emoji = "✅" if "ناجح" in result else "❌"
+        if previous is None:
+            text += f"\n🆕 {status_emoji} {subject}: {final_mark} ({year} - {semester})"
+        else:
+            old_mark = previous[5] if len(previous) > 5 else "غير محدد"
+            text += (
+                f"\n✏️ {status_emoji} {subject}: {old_mark} ← {final_mark} "
+                f"({year} - {semester})"
+            )
+    text += "\n\n🔕 لإيقاف التنبيهات: /unwatch"
+    return text
+
+
+async def notify_watch(bot, chat_id, watch, changes):
+    """Send a watch notification; False if the chat blocked the bot."""
+    try:
+        await bot.send_message(chat_id, format_watch_changes(watch, changes))
+    except Forbidden:
+        return False
+    except Exception as e:
+        logger.error(f"Could not notify chat {chat_id} of result changes: {e}")
+    return True
+
+
+async def watch_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Get notified when new or changed marks are posted for a student."""
+    logger.info("watch command called")
+    student_number = (
+        context.args[0] if context.args else context.user_data.get("student_number")
+    )
+    if not student_number or not re.match(r"^\d{10}$", student_number):
+        await update.message.reply_text(
+            "🔔 الاستخدام: /watch <الرقم الجامعي>\n"
+            "أو أرسل رقمك الجامعي أولاً ثم /watch"
+        )
+        return
+
+    # Taking the baseline is a lookup like any other
+    user = update.effective_user
+    if user is not None and not is_admin(update):
+        wait = user_rate_limiter.acquire(user.id)
+        if wait > 0:
+            await update.message.reply_text(throttle_message(wait))
+            return
+
+    department_id = context.user_data.get("department_id", DEFAULT_DEPARTMENT_ID)
+    result = await fetch_student_marks(student_number, "all", department_id)
+    if not result or not result["data"]:
+        await update.message.reply_text(
+            "❌ لم يتم العثور على نتائج لهذا الرقم، لا يمكن تفعيل التنبيه.\n\n"
+            "🔄 تأكد من الرقم الجامعي وحاول مرة أخرى."
+        )
+        return
+
+    if not watch_registry.subscribe(
+        update.effective_chat.id,
+        student_number,
+        department_id,
+        result,
+        watch_engine.next_check(time.time()),
+    ):
+        await update.message.reply_text(
+            "⚠️ عدد المشتركين في التنبيهات وصل إلى الحد الأقصى، حاول لاحقاً."
+        )
+        return
+    await update.message.reply_text(
+        f"🔔 تم تفعيل التنبيه للرقم الجامعي: {student_number}\n\n"
+        f"⏱️ سيتم فحص النتائج كل {math.ceil(WATCH_INTERVAL / 60)} دقيقة وإرسال "
+        f"العلامات الجديدة أو المعدّلة فقط.\n"
+        f"🔕 لإيقاف التنبيهات: /unwatch"
+    )
+
+
+async def unwatch_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Stop result-change notifications for this chat."""
+    logger.info("unwatch command called")
+    watch = watch_registry.unsubscribe(update.effective_chat.id)
+    if watch is None:
+        await update.message.reply_text("ℹ️ لا يوجد تنبيه مفعّل في هذه المحادثة.")
+        return
+    await update.message.reply_text(
+        f"🔕 تم إيقاف التنبيه للرقم الجامعي: {watch.student_number}"
+    )
 
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -1226,15 +2584,85 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
             logger.error(f"Error sending error message: {e}")
 
 
+_background_services_started = False
+_background_services_task = None
+_background_services_lock = threading.Lock()
+
+
+def start_background_services():
+    """Start the Flask server and the fetch warm-up (once per process)."""
+    global _background_services_started
+    with _background_services_lock:
+        if _background_services_started:
+            return
+        _background_services_started = True
+
+    # Run Flask (health check) in a background thread
+    threading.Thread(target=run_flask, daemon=True).start()
+    threading.Thread(target=warm_up, daemon=True).start()
+
+
+async def post_init(application):
+    """Defer the background services until polling has started.
+
+    Importing Flask/requests while the bot is still connecting competes for
+    the GIL and delays the first getUpdates, so they start right after it.
+    """
+
+    async def start_when_polling():
+        for _ in range(100):
+            if application.updater and application.updater.running:
+                break
+            await asyncio.sleep(0.05)
+        start_background_services()
+        if WATCH_ENABLED:
+            watch_engine.start(functools.partial(notify_watch, application.bot))
+
+    global _background_services_task
+    _background_services_task = asyncio.get_running_loop().create_task(
+        start_when_polling()
+    )
+
+
+async def record_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Note when the last update arrived (reported by the health checks)."""
+    if bot_supervisor is not None:
+        bot_supervisor.metrics["last_update_at"] = time.time()
+
+
 def create_application():
     """Create and configure the bot application."""
-    application = Application.builder().token(BOT_TOKEN).build()
+    if not BOT_TOKEN:
+        raise ValueError(
+            "BOT_TOKEN not found in environment variables. Please check your .env file."
+        )
+    check_upstream_transport()
+    build_keyboards()
+    open_storage()
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .post_init(post_init)
+        # Handle users' updates concurrently; repeated taps are debounced
+        .concurrent_updates(BOT_CONCURRENT_UPDATES)
+        .rate_limiter(telegram_rate_limiter)
+    )
+    if TELEGRAM_API_BASE_URL:
+        builder = builder.base_url(TELEGRAM_API_BASE_URL)
+    application = builder.build()
 
     # Add handlers
+    application.add_handler(TypeHandler(Update, record_update), group=-1)
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("get_marks", get_marks_command))
+    application.add_handler(CommandHandler("watch", watch_command))
+    application.add_handler(CommandHandler("unwatch", unwatch_command))
+    application.add_handler(CommandHandler("cohort", cohort_command))
+    application.add_handler(CommandHandler("cohort_rebuild", cohort_rebuild_command))
+    application.add_handler(CommandHandler("profile", profile_command))
     application.add_handler(CallbackQueryHandler(handle_callback_query))
+    application.add_handler(InlineQueryHandler(handle_inline_query))
     application.add_handler(
         MessageHandler(filters.TEXT & ~filters.COMMAND, handle_student_number)
     )
@@ -1245,139 +2673,422 @@ def create_application():
     return application
 
 
-def run_bot_with_retry():
-    """Run the bot with automatic reconnection on errors."""
-    max_retries = float("inf")  # Retry forever
-    retry_delay = 5  # Start with 5 seconds delay
+# Supervisor tuning: this many polling errors within the window trigger a
+# transport reconnect (PTB already retries single getUpdates failures)
+SUPERVISOR_ERROR_THRESHOLD = 3
+SUPERVISOR_ERROR_WINDOW = 60  # seconds
 
-    retry_count = 0
-    application = None
 
-    while retry_count < max_retries:
-        try:
-            logger.info(f"🤖 Bot is starting... (Attempt {retry_count + 1})")
-            print(f"🤖 Bot is starting... (Attempt {retry_count + 1})")
-
-            # Clean up previous application if it exists
-            if application is not None:
-                try:
-                    logger.info("Cleaning up previous application instance...")
-                    application.stop()
-                    application.shutdown()
-                    time.sleep(2)  # Wait for cleanup
-                except Exception as cleanup_error:
-                    logger.warning(f"Error during cleanup: {cleanup_error}")
-
-            application = create_application()
-
-            logger.info("✅ Bot is running and polling for updates...")
-            print("✅ Bot is running and polling for updates...")
-
-            # Reset retry delay on successful start
-            retry_delay = 5
-            retry_count = 0
-
-            # Start polling - this will block until stopped or error
-            application.run_polling(
-                allowed_updates=Update.ALL_TYPES,
-                drop_pending_updates=True,  # Drop pending updates to avoid conflicts
-                close_loop=False,
-            )
+class BotSupervisor:
+    """Keep one Application alive and reconnect only its Telegram transport.
 
-        except KeyboardInterrupt:
-            logger.info("🛑 Bot stopped by user (KeyboardInterrupt)")
-            print("🛑 Bot stopped by user")
-            if application:
-                try:
-                    application.stop()
-                    application.shutdown()
-                except Exception:
-                    pass
-            break
+    On repeated polling errors the updater is stopped, the bot's HTTP clients
+    are closed and recreated, and polling resumes. The Application with its
+    handlers and user_data, the result cache and the upstream session are
+    left untouched, so nothing has to be rebuilt or re-warmed.
+    """
 
-        except Conflict as e:
-            # Conflict error means another instance is running
-            retry_count += 1
-            error_msg = (
-                f"⚠️ Conflict detected: Another bot instance may be running. {str(e)}"
+    def __init__(self, application):
+        self.application = application
+        self.metrics = {
+            "state": "created",
+            "state_since": time.time(),
+            "started_at": None,
+            "polling_since": None,
+            "reconnects_total": 0,
+            "reconnects_by_reason": {"network": 0, "conflict": 0, "error": 0},
+            "polling_errors_total": 0,
+            "last_error": None,
+            "last_reconnect_at": None,
+            "last_restart_latency": None,
+            "max_restart_latency": None,
+            "total_restart_latency": 0.0,
+            "last_update_at": None,
+        }
+        # Refreshed every second by a task on the bot's loop (stall detection)
+        self.heartbeat = None
+        self.loop = None  # The bot's event loop while running (for profiling)
+        self._recent_errors = deque()
+        self._pending_reason = None
+        self._stop_event = None
+        self._reconnect_event = None
+        self._first_poll = True
+
+    def snapshot(self):
+        """Return a copy of the supervisor metrics for reporting."""
+        metrics = dict(self.metrics)
+        metrics["reconnects_by_reason"] = dict(self.metrics["reconnects_by_reason"])
+        reconnects = metrics["reconnects_total"]
+        metrics["avg_restart_latency"] = (
+            metrics["total_restart_latency"] / reconnects if reconnects else None
+        )
+        return metrics
+
+    def _set_state(self, state):
+        self.metrics["state"] = state
+        self.metrics["state_since"] = time.time()
+
+    async def _beat(self):
+        while True:
+            self.heartbeat = time.monotonic()
+            await asyncio.sleep(1)
+
+    def stop(self):
+        """Ask the supervisor to shut the bot down."""
+        if self._stop_event is not None:
+            self._stop_event.set()
+
+    def _on_polling_error(self, error):
+        """Error callback for the updater's polling loop."""
+        if isinstance(error, Conflict):
+            reason = "conflict"
+            logger.warning(
+                f"⚠️ Conflict detected: Another bot instance may be running. {error}"
             )
-            logger.warning(error_msg)
-            print(error_msg)
-            print("💡 Make sure only one instance of the bot is running.")
-            print(f"🔄 Waiting {retry_delay} seconds before retry...")
-
-            # Clean up this instance
-            if application:
-                try:
-                    application.stop()
-                    application.shutdown()
-                    time.sleep(2)
-                except Exception:
-                    pass
-                application = None
-
-            # Longer wait for conflict errors (30 seconds minimum)
-            time.sleep(max(retry_delay, 30))
-            retry_delay = min(retry_delay * 2, 120)  # Max 2 minutes for conflicts
-
-        except (TimedOut, NetworkError) as e:
-            # Network errors - retry quickly
-            retry_count += 1
-            error_msg = f"🌐 Network error: {type(e).__name__}: {str(e)}"
-            logger.warning(error_msg)
-            print(error_msg)
-            print(f"🔄 Reconnecting in {retry_delay} seconds...")
+        elif isinstance(error, (TimedOut, NetworkError)):
+            reason = "network"
+            logger.warning(f"🌐 Network error: {type(error).__name__}: {error}")
+        else:
+            reason = "error"
+            logger.error(f"❌ Polling error: {type(error).__name__}: {error}")
+
+        self.metrics["polling_errors_total"] += 1
+        self.metrics["last_error"] = f"{type(error).__name__}: {error}"
+
+        now = time.monotonic()
+        self._recent_errors.append(now)
+        while self._recent_errors and now - self._recent_errors[0] > (
+            SUPERVISOR_ERROR_WINDOW
+        ):
+            self._recent_errors.popleft()
+
+        if reason == "conflict" or len(self._recent_errors) >= (
+            SUPERVISOR_ERROR_THRESHOLD
+        ):
+            if self._pending_reason is None:
+                self._pending_reason = reason
+                self._reconnect_event.set()
+
+    async def _sleep(self, delay):
+        """Sleep for ``delay`` seconds; return True if a stop was requested."""
+        try:
+            await asyncio.wait_for(self._stop_event.wait(), delay)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _start_polling(self):
+        await self.application.updater.start_polling(
+            allowed_updates=Update.ALL_TYPES,
+            # Drop stale updates only on boot; keep the ones queued during a reconnect
+            drop_pending_updates=self._first_poll,
+            error_callback=self._on_polling_error,
+        )
+        self._first_poll = False
+        self._set_state("polling")
+        self.metrics["polling_since"] = time.time()
+
+    async def _connect(self):
+        """Initialize the application and start polling, retrying network errors."""
+        retry_delay = 5
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                logger.info(f"🤖 Bot is starting... (Attempt {attempt})")
+                print(f"🤖 Bot is starting... (Attempt {attempt})")
+                await self.application.initialize()
+                break
+            except (TimedOut, NetworkError) as e:
+                logger.warning(f"🌐 Network error: {type(e).__name__}: {e}")
+                print(f"🔄 Reconnecting in {retry_delay} seconds...")
+                if await self._sleep(retry_delay):
+                    return False
+                retry_delay = min(retry_delay * 1.5, 30)
+
+        if self.application.post_init:
+            await self.application.post_init(self.application)
+        await self._start_polling()
+        await self.application.start()
+        logger.info("✅ Bot is running and polling for updates...")
+        print("✅ Bot is running and polling for updates...")
+        return True
+
+    async def _reconnect(self, reason):
+        """Recreate the Telegram transport and resume polling."""
+        started = time.monotonic()
+        self._set_state("reconnecting")
+        logger.info(f"🔌 Reconnecting Telegram transport (reason: {reason})")
+
+        updater = self.application.updater
+        if updater.running:
+            await updater.stop()
+
+        # Conflicts mean another instance is polling: give it time to go away
+        retry_delay = 30 if reason == "conflict" else 0
+        while True:
+            if retry_delay:
+                print(f"🔄 Reconnecting in {retry_delay} seconds...")
+                if await self._sleep(retry_delay):
+                    return
+            try:
+                # Closes and rebuilds the HTTP clients, then checks them with getMe
+                await self.application.bot.shutdown()
+                await self.application.bot.initialize()
+                await self._start_polling()
+                break
+            except (TimedOut, NetworkError) as e:
+                logger.warning(f"🌐 Reconnect failed: {type(e).__name__}: {e}")
+                retry_delay = min(max(retry_delay * 1.5, 5), 30)
+
+        latency = time.monotonic() - started
+        self._recent_errors.clear()
+        self.metrics["reconnects_total"] += 1
+        self.metrics["reconnects_by_reason"][reason] += 1
+        self.metrics["last_reconnect_at"] = time.time()
+        self.metrics["last_restart_latency"] = latency
+        self.metrics["total_restart_latency"] += latency
+        self.metrics["max_restart_latency"] = max(
+            latency, self.metrics["max_restart_latency"] or 0
+        )
+        logger.info(f"✅ Transport reconnected in {latency:.2f}s")
 
-            if application:
-                try:
-                    application.stop()
-                    application.shutdown()
-                except Exception:
-                    pass
-                application = None
+    async def _shutdown(self):
+        self._set_state("stopping")
+        application = self.application
+        try:
+            if application.updater and application.updater.running:
+                await application.updater.stop()
+            if application.running:
+                await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+        finally:
+            await application.shutdown()
+            if application.post_shutdown:
+                await application.post_shutdown(application)
+            shutdown_parse_pool()
+            self._set_state("stopped")
+
+    async def run(self):
+        """Run the bot until stopped, reconnecting the transport on errors."""
+        self._stop_event = asyncio.Event()
+        self._reconnect_event = asyncio.Event()
+        self.loop = asyncio.get_running_loop()
+        self._set_state("starting")
+        self.metrics["started_at"] = time.time()
+
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError):
+                pass  # Not available on this platform/thread
+
+        heartbeat = asyncio.ensure_future(self._beat())
+        try:
+            if not await self._connect():
+                return
+            stop_wait = asyncio.ensure_future(self._stop_event.wait())
+            while not self._stop_event.is_set():
+                reconnect_wait = asyncio.ensure_future(self._reconnect_event.wait())
+                await asyncio.wait(
+                    {stop_wait, reconnect_wait}, return_when=asyncio.FIRST_COMPLETED
+                )
+                if self._stop_event.is_set():
+                    reconnect_wait.cancel()
+                    break
+                self._reconnect_event.clear()
+                reason, self._pending_reason = self._pending_reason, None
+                await self._reconnect(reason or "error")
+                # Errors reported while reconnecting are already handled
+                self._pending_reason = None
+                self._reconnect_event.clear()
+        finally:
+            heartbeat.cancel()
+            await self._shutdown()
 
-            time.sleep(retry_delay)
-            retry_delay = min(
-                retry_delay * 1.5, 30
-            )  # Max 30 seconds for network errors
 
+# The running supervisor (for metrics reporting)
+bot_supervisor = None
+
+
+def run_bot_with_retry():
+    """Run the bot with automatic reconnection on errors.
+
+    Transport problems are handled inside :class:`BotSupervisor` without
+    rebuilding the Application. Only if the supervisor itself fails is a new
+    Application created, with exponential backoff as before.
+    """
+    global bot_supervisor
+    retry_delay = 5
+
+    while True:
+        bot_supervisor = BotSupervisor(create_application())
+        try:
+            asyncio.run(bot_supervisor.run())
+            logger.info("🛑 Bot stopped")
+            print("🛑 Bot stopped")
+            break
+        except KeyboardInterrupt:
+            logger.info("🛑 Bot stopped by user (KeyboardInterrupt)")
+            print("🛑 Bot stopped by user")
+            break
         except Exception as e:
-            retry_count += 1
             error_msg = f"❌ Error occurred: {type(e).__name__}: {str(e)}"
             logger.error(error_msg, exc_info=True)
             print(error_msg)
-            print(f"🔄 Reconnecting in {retry_delay} seconds...")
-
-            # Clean up on any error
-            if application:
-                try:
-                    application.stop()
-                    application.shutdown()
-                except Exception:
-                    pass
-                application = None
-
-            # Exponential backoff with max delay of 60 seconds
+            print(f"🔄 Restarting in {retry_delay} seconds...")
             time.sleep(retry_delay)
+            # Exponential backoff with max delay of 60 seconds
             retry_delay = min(retry_delay * 2, 60)
 
 
+def get_metrics():
+    """Collect runtime metrics from the bot's components."""
+    return {
+        "supervisor": bot_supervisor.snapshot() if bot_supervisor else None,
+        "upstream_pool": upstream_pool.snapshot(),
+        "transport": {
+            "mode": UPSTREAM_TRANSPORT,
+            **(_session.snapshot() if hasattr(_session, "snapshot") else {}),
+        },
+        "user_limiter": user_rate_limiter.snapshot(),
+        "telegram_api": telegram_rate_limiter.snapshot(),
+        "scheduler": fetch_scheduler.snapshot(),
+        "upstream_breaker": upstream_breaker.snapshot(),
+        "negative_cache": negative_cache.snapshot(),
+        "render_cache": render_cache.snapshot(),
+        "prefetch": prefetcher.snapshot(),
+        "watch": watch_engine.snapshot(),
+        "profiler": profiler.snapshot(),
+        "tracing": tracer.snapshot(),
+        "subject_catalogs": subject_catalogs.snapshot(),
+        "parse_executor": {
+            "mode": PARSE_EXECUTOR,
+            "workers": PARSE_WORKERS if PARSE_EXECUTOR == "process" else None,
+        },
+    }
+
+
+def get_health():
+    """Liveness: the bot's event loop is running and it is (or soon will be)
+    polling Telegram. Restarting the process is the fix when this fails."""
+    supervisor = bot_supervisor
+    if supervisor is None:
+        return {"ok": False, "reason": "bot not started", "state": None}
+    now = time.time()
+    metrics = supervisor.metrics
+    state = metrics["state"]
+    updater = supervisor.application.updater
+    loop_age = (
+        time.monotonic() - supervisor.heartbeat
+        if supervisor.heartbeat is not None
+        else None
+    )
+    state_age = now - metrics["state_since"]
+
+    reason = None
+    if loop_age is not None and loop_age > HEALTH_LOOP_STALL:
+        reason = f"event loop stalled for {loop_age:.0f}s"
+    elif state in ("stopping", "stopped"):
+        reason = f"bot is {state}"
+    elif state == "polling" and not (updater and updater.running):
+        reason = "polling loop is not running"
+    elif state != "polling" and state_age > HEALTH_STARTUP_GRACE:
+        reason = f"{state} for {state_age:.0f}s"
+    return {
+        "ok": reason is None,
+        "reason": reason,
+        "state": state,
+        "state_for": round(state_age, 1),
+        "loop_heartbeat_age": round(loop_age, 3) if loop_age is not None else None,
+        "last_update_age": (
+            round(now - metrics["last_update_at"], 1)
+            if metrics["last_update_at"]
+            else None
+        ),
+        "polling_errors_total": metrics["polling_errors_total"],
+        "last_error": metrics["last_error"],
+    }
+
+
+def get_readiness():
+    """Readiness: healthy, polling, the university site reachable and the
+    queues short enough to take more users."""
+    health = get_health()
+    supervisor = bot_supervisor
+    update_queue = supervisor.application.update_queue.qsize() if supervisor else 0
+    scheduler = fetch_scheduler.snapshot()
+    fetch_queue = sum(stats["depth"] for stats in scheduler["classes"].values())
+    breaker = upstream_breaker.snapshot()
+
+    reason = health["reason"]
+    if reason is None and health["state"] != "polling":
+        reason = f"not polling ({health['state']})"
+    if reason is None and breaker["state"] == "open":
+        reason = "university website is failing (circuit breaker open)"
+    if reason is None and update_queue + fetch_queue > READY_MAX_QUEUE_DEPTH:
+        reason = f"queue depth {update_queue + fetch_queue}"
+    return {
+        "ok": reason is None,
+        "reason": reason,
+        "state": health["state"],
+        "upstream_breaker": breaker["state"],
+        "update_queue": update_queue,
+        "fetch_queue": fetch_queue,
+        "fetches_in_flight": scheduler["in_flight"],
+    }
+
+
+def get_debug_info():
+    """Internals for troubleshooting: caches, running fetches, slow fetches."""
+    return {
+        "health": get_health(),
+        "readiness": get_readiness(),
+        "caches": {
+            "results": result_cache.snapshot(),
+            "negative": negative_cache.snapshot(),
+            "render": render_cache.snapshot(),
+            "subject_catalogs": subject_catalogs.snapshot(),
+        },
+        "upstream_breaker": upstream_breaker.snapshot(),
+        "scheduler": fetch_scheduler.snapshot(),
+        "fetches_running": upstream_request_log.running(),
+        # Full-history fetches and how many lookups are waiting on each
+        "shared_fetches": [
+            {"student": mask_student_number(student), "waiters": entry[1]}
+            for (_, student), entry in list(_inflight_fetches.items())
+        ],
+        "prefetch": prefetcher.snapshot(),
+        "slowest_fetches": upstream_request_log.slowest(10),
+        "telegram_api": telegram_rate_limiter.snapshot(),
+        "user_limiter": user_rate_limiter.snapshot(),
+    }
+
+
 def run_flask():
+    from waitress import serve
+
     port = int(os.environ.get("PORT", 5000))
     logger.info(f"Starting Flask (waitress) server on port {port}")
-    serve(app, host="0.0.0.0", port=port)
+    serve(create_flask_app(), host="0.0.0.0", port=port)
 
 
 def main():
     """Main entry point for the bot and Flask app."""
+    configure_logging()
     logger.info("=" * 50)
     logger.info(f"Bot startup at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     logger.info("=" * 50)
+    open_storage()
 
     try:
-        # Run Flask (health check) in a background thread
-        flask_thread = threading.Thread(target=run_flask, daemon=True)
-        flask_thread.start()
+        # Flask and the warm-up start once polling is up; the timer makes sure
+        # the health check comes up even if Telegram is unreachable at boot
+        fallback_timer = threading.Timer(5, start_background_services)
+        fallback_timer.daemon = True
+        fallback_timer.start()
 
         # Run the bot in the main thread
         run_bot_with_retry()
@@ -0,0 +1,280 @@
+"""Outbound Telegram Bot API calls: rate limiting, flood waits and metrics.
+
+:class:`TelegramRateLimiter` plugs into python-telegram-bot as the bot's
+rate limiter, so every API call except ``getUpdates`` passes through it:
+
+- A global token bucket keeps the bot under Telegram's overall limit and a
+  per-chat bucket under the per-chat one (stricter for groups). Answers to
+  callback and inline queries skip both: Telegram doesn't count them
+  against chat limits and the user is waiting on them.
+- A 429 ("Too Many Requests") pauses every call for the ``retry_after``
+  Telegram asks for, then the call is retried up to ``max_retries`` times.
+- An ``editMessageText`` with the same content as the previous edit of
+  that message is answered locally instead of sent (Telegram would reject
+  it with "message is not modified").
+
+Call counts, latency, 429s and time spent throttled are kept per endpoint
+for the metrics endpoint. With a ``tracer`` (see tracing.py), each call is
+also recorded as a span of the request that made it.
+"""
+
+import asyncio
+import contextlib
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict, deque
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Answered right away: not counted against chat limits, and time-critical
+UNTHROTTLED_ENDPOINTS = frozenset({"answerCallbackQuery", "answerInlineQuery"})
+
+# Recent latencies kept per endpoint for the percentile metrics
+LATENCY_SAMPLES = 1000
+
+
+class _Bucket:
+    """Token bucket reserving ahead: a caller takes a token (possibly going
+    into debt) and is told how long to wait before using it."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def reserve(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0
+        return -self.tokens / self.rate
+
+
+class _EndpointStats:
+    __slots__ = ("calls", "errors", "rate_limited", "latency_total", "latencies")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.latency_total = 0.0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    def record(self, latency):
+        self.calls += 1
+        self.latency_total += latency
+        self.latencies.append(latency)
+
+    def snapshot(self):
+        latencies = sorted(self.latencies)
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "rate_limited": self.rate_limited,
+            "latency_avg": self.latency_total / self.calls if self.calls else None,
+            "latency_p95": (
+                latencies[int(0.95 * (len(latencies) - 1))] if latencies else None
+            ),
+            "latency_max": latencies[-1] if latencies else None,
+        }
+
+
+def _retry_after_seconds(error):
+    retry_after = error.retry_after
+    if hasattr(retry_after, "total_seconds"):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+def _edit_fingerprint(data):
+    """Hash of everything an editMessageText changes on the message."""
+    content = {
+        name: value
+        for name, value in data.items()
+        if name not in ("chat_id", "message_id", "inline_message_id")
+    }
+    encoded = json.dumps(
+        content,
+        sort_keys=True,
+        ensure_ascii=False,
+        default=lambda value: (
+            value.to_dict() if hasattr(value, "to_dict") else str(value)
+        ),
+    )
+    return hashlib.blake2b(encoded.encode("utf-8"), digest_size=16).digest()
+
+
+class TelegramRateLimiter(BaseRateLimiter):
+    """Global and per-chat token buckets with retry on flood waits.
+
+    Rates are messages per second. Chat buckets live in an LRU bounded by
+    ``max_chats``; an evicted chat starts again with a full bucket. Only
+    used from the event loop thread.
+    """
+
+    def __init__(
+        self,
+        rate,
+        burst,
+        chat_rate,
+        chat_burst,
+        group_rate,
+        max_retries,
+        max_chats=10000,
+        max_tracked_messages=10000,
+        tracer=None,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self.max_tracked_messages = max_tracked_messages
+        self.tracer = tracer
+        self._global = _Bucket(rate, burst)
+        self._chats = OrderedDict()  # chat id -> _Bucket
+        self._last_edits = OrderedDict()  # (chat, message) -> content hash
+        self._paused_until = 0.0
+        self._stats = {}  # endpoint -> _EndpointStats
+        self.throttled = 0
+        self.throttled_time = 0.0
+        self.flood_waits = 0
+        self.retries = 0
+        self.edits_skipped = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.pop(chat_id, None)
+        if bucket is None:
+            # Negative ids are groups and channels, limited per minute
+            if isinstance(chat_id, int) and chat_id < 0:
+                bucket = _Bucket(self.group_rate, self.chat_burst)
+            else:
+                bucket = _Bucket(self.chat_rate, self.chat_burst)
+        self._chats[chat_id] = bucket
+        while len(self._chats) > self.max_chats:
+            self._chats.popitem(last=False)
+        return bucket
+
+    def _reserve(self, chat_id):
+        """Take the global and chat tokens; return the wait before sending."""
+        now = time.monotonic()
+        delay = max(self._global.reserve(now), self._paused_until - now)
+        if chat_id is not None:
+            delay = max(delay, self._chat_bucket(chat_id).reserve(now))
+        return delay
+
+    def _stats_for(self, endpoint):
+        stats = self._stats.get(endpoint)
+        if stats is None:
+            stats = self._stats[endpoint] = _EndpointStats()
+        return stats
+
+    def _message_key(self, data):
+        if data.get("inline_message_id"):
+            return (None, data["inline_message_id"])
+        if data.get("message_id") is not None:
+            return (data.get("chat_id"), data["message_id"])
+        return None
+
+    def _remember_edit(self, key, fingerprint):
+        self._last_edits.pop(key, None)
+        if fingerprint is not None:
+            self._last_edits[key] = fingerprint
+            while len(self._last_edits) > self.max_tracked_messages:
+                self._last_edits.popitem(last=False)
+
+    async def process_request(
+        self, callback, args, kwargs, endpoint, data, rate_limit_args
+    ):
+        stats = self._stats_for(endpoint)
+
+        message_key = None
+        fingerprint = None
+        if endpoint.startswith("edit"):
+            message_key = self._message_key(data)
+        if message_key is not None and endpoint == "editMessageText":
+            fingerprint = _edit_fingerprint(data)
+            if self._last_edits.get(message_key) == fingerprint:
+                self._last_edits.move_to_end(message_key)
+                self.edits_skipped += 1
+                return True
+
+        throttled = endpoint not in UNTHROTTLED_ENDPOINTS
+        chat_id = data.get("chat_id")
+        for attempt in range(self.max_retries + 1):
+            if throttled:
+                delay = self._reserve(chat_id)
+            else:
+                delay = self._paused_until - time.monotonic()
+            if delay > 0:
+                self.throttled += 1
+                self.throttled_time += delay
+                await asyncio.sleep(delay)
+
+            started = time.monotonic()
+            span = (
+                self.tracer.span(f"telegram:{endpoint}", attempt=attempt + 1)
+                if self.tracer
+                else contextlib.nullcontext()
+            )
+            try:
+                with span:
+                    result = await callback(*args, **kwargs)
+            except RetryAfter as e:
+                stats.rate_limited += 1
+                self.flood_waits += 1
+                wait = _retry_after_seconds(e)
+                self._paused_until = max(self._paused_until, time.monotonic() + wait)
+                if attempt == self.max_retries:
+                    stats.errors += 1
+                    logger.error(
+                        f"Telegram flood wait on {endpoint}, giving up after "
+                        f"{attempt + 1} attempts"
+                    )
+                    raise
+                self.retries += 1
+                logger.warning(
+                    f"Telegram flood wait on {endpoint}: pausing calls for {wait}s"
+                )
+                continue
+            except Exception:
+                stats.errors += 1
+                stats.record(time.monotonic() - started)
+                raise
+            stats.record(time.monotonic() - started)
+            if message_key is not None:
+                self._remember_edit(message_key, fingerprint)
+            return result
+
+    def snapshot(self):
+        return {
+            "calls": sum(stats.calls for stats in self._stats.values()),
+            "flood_waits": self.flood_waits,
+            "retries": self.retries,
+            "throttled": self.throttled,
+            "throttled_time": round(self.throttled_time, 3),
+            "paused_for": max(0.0, round(self._paused_until - time.monotonic(), 3)),
+            "edits_skipped": self.edits_skipped,
+            "tracked_chats": len(self._chats),
+            "endpoints": {
+                endpoint: stats.snapshot()
+                for endpoint, stats in sorted(self._stats.items())
+            },
+        }
@@ -0,0 +1,24 @@
+import pytest
+
+from batch_lookup import ResultWriter, read_completed
+
+
+@pytest.mark.parametrize("output_format", ["jsonl", "csv"])
+def test_resume_after_torn_line(tmp_path, output_format):
+    path = str(tmp_path / f"results.{output_format}")
+    writer = ResultWriter(path, output_format)
+    writer.write({"student_number": "1", "status": "ok"})
+    writer.write({"student_number": "2", "status": "error"})
+    writer.close()
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"student_numb' if output_format == "jsonl" else "3,o")
+
+    assert read_completed(path, output_format) == {"1"}
+
+    writer = ResultWriter(path, output_format)
+    writer.write({"student_number": "2", "status": "ok"})
+    writer.write({"student_number": "3", "status": "not_found"})
+    writer.close()
+    assert read_completed(path, output_format) == {"1", "2", "3"}
+    with open(path, encoding="utf-8") as f:
+        assert "student_numb{" not in f.read()
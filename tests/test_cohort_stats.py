@@ -0,0 +1,61 @@
+import os
+import threading
+
+from cohort_stats import CohortStore
+
+
+def make_results(subjects, students=20):
+    for student in range(students):
+        rows = [
+            [subject, "2025-2024", "فصل أول", "", "", str(40 + student), "ناجح"]
+            for subject in subjects
+        ]
+        yield str(student), {"data": rows}
+
+
+def test_rebuild_and_query(tmp_path):
+    store = CohortStore(str(tmp_path))
+    index = store.rebuild(make_results(["برمجة 1", "رياضيات 1"]))
+    assert index["students"] == 20
+    stats = store.query("برمجة 1")
+    assert stats["count"] == 20
+    assert stats["min"] == 40 and stats["max"] == 59
+
+
+def test_concurrent_rebuilds(tmp_path):
+    store = CohortStore(str(tmp_path))
+    errors = []
+
+    def rebuild(subjects):
+        try:
+            for _ in range(10):
+                store.rebuild(make_results(subjects))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [
+        threading.Thread(target=rebuild, args=(["برمجة 1", "رياضيات 1"],)),
+        threading.Thread(target=rebuild, args=(["برمجة 1", "رياضيات 1", "أ"],)),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert store.query("رياضيات 1")["count"] == 20
+    # Only the current and the previous build are kept
+    assert len([name for name in os.listdir(tmp_path) if name.startswith("build")]) == 2
+
+
+def test_old_index_survives_a_rebuild(tmp_path):
+    store = CohortStore(str(tmp_path))
+    store.rebuild(make_results(["برمجة 1", "رياضيات 1"]))
+    column = store.find_column("رياضيات 1")
+
+    # A new subject sorts first and renumbers every column
+    store.rebuild(make_results(["أ", "برمجة 1", "رياضيات 1"], students=5))
+    store._columns.clear()
+    marks = store._load_column(column)
+    assert len(marks) == 20 and marks[0] == 40
+    assert store.query("رياضيات 1")["count"] == 5
@@ -0,0 +1,62 @@
+import random
+
+import pytest
+
+from result_snapshot import SnapshotCodec, SnapshotError
+
+CATALOG = ["برمجة 1", "رياضيات 1", "دارات كهربائية"]
+
+
+def sample_result():
+    rows = []
+    for i in range(12):
+        subject = CATALOG[i % len(CATALOG)] if i % 4 else f"مادة غير مفهرسة {i}"
+        row = [
+            subject,
+            "2025-2024" if i % 2 else "2024-2023",
+            "فصل أول" if i % 3 else "فصل ثاني",
+            str(i * 2),
+            "غائب" if i == 5 else str(i * 3),
+            str(40 + i * 4),
+            "ناجح" if i % 2 else "راسب",
+        ]
+        if i % 3 == 0:
+            row.append("ملاحظة")  # Cells past the typed columns
+        rows.append(row)
+    rows.append(["مادة بلا علامة", "2025-2024", "فصل أول", "", "", ""])
+    return {
+        "headers": ["المادة", "العام", "الفصل", "عملي", "نظري", "العلامة", "النتيجة"],
+        "data": rows,
+        "total_subjects": len(rows),
+        "student_name": "طالب تجريبي",
+    }
+
+
+@pytest.fixture
+def codec():
+    return SnapshotCodec(CATALOG)
+
+
+def test_round_trip(codec):
+    result = sample_result()
+    assert codec.decode(codec.encode(result)) == result
+
+
+def test_truncated_snapshots_are_rejected(codec):
+    data = codec.encode(sample_result())
+    for size in range(len(data)):
+        with pytest.raises(SnapshotError):
+            codec.decode(data[:size])
+
+
+def test_corrupted_snapshots_decode_or_raise_snapshot_error(codec):
+    data = codec.encode(sample_result())
+    rng = random.Random(0)
+    for _ in range(5000):
+        corrupted = bytearray(data)
+        for _ in range(rng.randint(1, 3)):
+            corrupted[rng.randrange(len(corrupted))] ^= 1 << rng.randrange(8)
+        try:
+            codec.decode(bytes(corrupted))
+        except SnapshotError:
+            pass
@@ -0,0 +1,360 @@
+"""Lightweight request tracing for the bot's handler pipeline.
+
+A trace covers one user interaction (a message, a button tap or an inline
+query). It is started by the outermost :func:`Tracer.traced` handler and
+every traced function called while it runs (fetching, parsing, filtering,
+rendering, sending) records a timed span under it. The current trace and
+span live in context variables, so concurrent updates never mix and
+``asyncio.to_thread`` workers join the trace of their caller. Work in a
+process pool is not traced.
+
+Traces are tail-sampled when they finish: slow traces (at least
+``slow_ms``) and failed ones are always exported, others with probability
+``sample_rate``. Exporters write JSON lines to a file or send OTLP/HTTP
+JSON to a collector from a background thread, so the event loop never
+waits on them. With no exporter, spans cost a context variable lookup.
+"""
+
+import abc
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_current_trace = contextvars.ContextVar("trace", default=None)
+_current_span = contextvars.ContextVar("span", default=None)
+
+
+def current_trace_id():
+    """Id of the trace being recorded in this context, or None."""
+    trace = _current_trace.get()
+    return trace.trace_id if trace is not None else None
+
+
+class RequestIdFilter(logging.Filter):
+    """Adds ``request_id`` (the trace id, or "-") to every log record."""
+
+    def filter(self, record):
+        trace_id = current_trace_id()
+        record.request_id = trace_id[:16] if trace_id else "-"
+        return True
+
+
+class Trace:
+    __slots__ = ("trace_id", "name", "start_ns", "spans", "finished")
+
+    def __init__(self, name):
+        self.trace_id = os.urandom(16).hex()
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.spans = []  # finished spans, appended from any thread
+        self.finished = False
+
+
+class Span:
+    __slots__ = ("span_id", "parent_id", "name", "attributes", "start_ns", "end_ns")
+
+    def __init__(self, name, parent_id, attributes):
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    @property
+    def duration_ms(self):
+        return (self.end_ns - self.start_ns) / 1e6
+
+
+class _SpanScope:
+    """Context manager recording one span (the root span for a new trace)."""
+
+    __slots__ = ("tracer", "name", "attributes", "root", "trace", "span", "tokens")
+
+    def __init__(self, tracer, name, attributes, root):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.root = root
+
+    def __enter__(self):
+        self.trace = _current_trace.get()
+        self.span = None
+        if self.trace is None:
+            if not self.root or self.tracer.exporter is None:
+                return self
+            self.trace = Trace(self.name)
+            trace_token = _current_trace.set(self.trace)
+        else:
+            trace_token = None
+        parent = _current_span.get()
+        self.span = Span(
+            self.name, parent.span_id if parent else None, dict(self.attributes)
+        )
+        self.tokens = (trace_token, _current_span.set(self.span))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.span is None:
+            return False
+        trace_token, span_token = self.tokens
+        span = self.span
+        span.end_ns = time.time_ns()
+        if exc_type is not None:
+            span.attributes["error"] = f"{exc_type.__name__}: {exc}"
+        _current_span.reset(span_token)
+        if not self.trace.finished:
+            self.trace.spans.append(span)
+        if trace_token is not None:
+            _current_trace.reset(trace_token)
+            self.trace.finished = True
+            self.tracer._finish(self.trace, span)
+        return False
+
+
+class Tracer:
+    """Creates spans and hands finished traces to the exporter."""
+
+    def __init__(self, exporter=None, slow_ms=1000, sample_rate=0.0):
+        self.exporter = exporter
+        self.slow_ms = slow_ms
+        self.sample_rate = sample_rate
+        self.traces = 0
+        self.exported = {"slow": 0, "error": 0, "sampled": 0}
+        self.dropped = 0
+
+    def span(self, name, root=False, **attributes):
+        """Time a block as a span of the current trace.
+
+        With ``root=True`` a new trace is started when none is running.
+        """
+        return _SpanScope(self, name, attributes, root)
+
+    @staticmethod
+    def annotate(**attributes):
+        """Add attributes to the current span (no-op when not tracing)."""
+        span = _current_span.get()
+        if span is not None:
+            span.attributes.update(attributes)
+
+    def traced(self, name=None, root=False):
+        """Decorator recording each call of a function (sync or async)."""
+
+        def decorate(func):
+            span_name = name or func.__name__
+            if inspect.iscoroutinefunction(func):
+
+                @functools.wraps(func)
+                async def wrapper(*args, **kwargs):
+                    with _SpanScope(self, span_name, {}, root):
+                        return await func(*args, **kwargs)
+
+            else:
+
+                @functools.wraps(func)
+                def wrapper(*args, **kwargs):
+                    with _SpanScope(self, span_name, {}, root):
+                        return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorate
+
+    def _finish(self, trace, root_span):
+        self.traces += 1
+        if "error" in root_span.attributes or any(
+            "error" in span.attributes for span in trace.spans
+        ):
+            reason = "error"
+        elif root_span.duration_ms >= self.slow_ms:
+            reason = "slow"
+        elif self.sample_rate and random.random() < self.sample_rate:
+            reason = "sampled"
+        else:
+            self.dropped += 1
+            return
+        self.exported[reason] += 1
+        self.exporter.export(trace, root_span, reason)
+
+    def snapshot(self):
+        return {
+            "exporter": type(self.exporter).__name__ if self.exporter else None,
+            "slow_ms": self.slow_ms,
+            "sample_rate": self.sample_rate,
+            "traces": self.traces,
+            "exported": dict(self.exported),
+            "dropped": self.dropped,
+            **(self.exporter.snapshot() if self.exporter else {}),
+        }
+
+
+class _BackgroundExporter(abc.ABC):
+    """Queue of finished traces drained by a daemon thread in batches."""
+
+    batch_size = 50
+    max_queued = 1000
+
+    def __init__(self):
+        self._queue = queue.Queue(self.max_queued)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.queue_full = 0
+        self.errors = 0
+
+    def export(self, trace, root_span, reason):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name="trace-exporter", daemon=True
+                    )
+                    self._thread.start()
+        try:
+            self._queue.put_nowait((trace, root_span, reason))
+        except queue.Full:
+            self.queue_full += 1
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.write(batch)
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"Could not export {len(batch)} traces: {e}")
+
+    @abc.abstractmethod
+    def write(self, batch):
+        """Export a batch of (trace, root span, sampling reason) tuples."""
+
+    def snapshot(self):
+        return {
+            "queued": self._queue.qsize(),
+            "queue_full": self.queue_full,
+            "export_errors": self.errors,
+        }
+
+
+class JsonLinesExporter(_BackgroundExporter):
+    """Appends one JSON object per trace (with its spans) to ``path``."""
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+
+    def write(self, batch):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            for trace, root_span, reason in batch:
+                record = {
+                    "trace_id": trace.trace_id,
+                    "name": trace.name,
+                    "start": trace.start_ns / 1e9,
+                    "duration_ms": round(root_span.duration_ms, 3),
+                    "reason": reason,
+                    "spans": [
+                        {
+                            "span_id": span.span_id,
+                            "parent_id": span.parent_id,
+                            "name": span.name,
+                            "offset_ms": round(
+                                (span.start_ns - trace.start_ns) / 1e6, 3
+                            ),
+                            "duration_ms": round(span.duration_ms, 3),
+                            **(
+                                {"attributes": span.attributes}
+                                if span.attributes
+                                else {}
+                            ),
+                        }
+                        for span in sorted(trace.spans, key=lambda span: span.start_ns)
+                    ],
+                }
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class OtlpExporter(_BackgroundExporter):
+    """Posts spans as OTLP/HTTP JSON to a collector's ``/v1/traces``."""
+
+    def __init__(self, endpoint, service_name, timeout=5):
+        super().__init__()
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.timeout = timeout
+
+    def _span(self, trace, span):
+        otlp_span = {
+            "traceId": trace.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": 1,  # internal
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns),
+            "attributes": [
+                {"key": key, "value": _otlp_value(value)}
+                for key, value in span.attributes.items()
+            ],
+            "status": {"code": 2 if "error" in span.attributes else 1},
+        }
+        if span.parent_id:
+            otlp_span["parentSpanId"] = span.parent_id
+        return otlp_span
+
+    def write(self, batch):
+        import urllib.request
+
+        body = {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [
+                            {
+                                "key": "service.name",
+                                "value": {"stringValue": self.service_name},
+                            }
+                        ]
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": __name__},
+                            "spans": [
+                                self._span(trace, span)
+                                for trace, _, _ in batch
+                                for span in trace.spans
+                            ],
+                        }
+                    ],
+                }
+            ]
+        }
+        request = urllib.request.Request(
+            self.endpoint,
+            data=json.dumps(body, default=str).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
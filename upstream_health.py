@@ -0,0 +1,131 @@
+"""Health tracking of the university website.
+
+- :class:`CircuitBreaker` opens after ``threshold`` consecutive failed
+  requests. While open, lookups fail fast instead of queueing for a site
+  that is down; after ``cooldown`` seconds one probe request is let through
+  and its outcome closes or re-opens the breaker.
+- :class:`RequestLog` keeps the fetches currently running and the most
+  recent finished ones, so the slowest can be inspected.
+
+Both are used from the event loop thread and only read from elsewhere.
+"""
+
+import itertools
+import time
+from collections import deque
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker with a single half-open probe."""
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0  # consecutive
+        self.opened_at = None
+        self.opened_total = 0
+        self.rejected = 0
+        self._probe_started = None
+
+    def allow(self):
+        """Whether a request may be sent now (counts a rejection if not)."""
+        if self.state == "closed":
+            return True
+        now = time.monotonic()
+        if self.state == "open" and now - self.opened_at >= self.cooldown:
+            self.state = "half_open"
+            self._probe_started = None
+        if self.state == "half_open":
+            # One probe at a time; a probe that never reported is replaced
+            if self._probe_started is None or (
+                now - self._probe_started >= self.cooldown
+            ):
+                self._probe_started = now
+                return True
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self._probe_started = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or (
+            self.state == "closed" and self.failures >= self.threshold
+        ):
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self.opened_total += 1
+            self._probe_started = None
+
+    def snapshot(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "open_for": (
+                round(time.monotonic() - self.opened_at, 1)
+                if self.state != "closed"
+                else None
+            ),
+            "opened_total": self.opened_total,
+            "rejected": self.rejected,
+        }
+
+
+def mask_student_number(student_number):
+    """Keep only the last 4 digits of a student number for display."""
+    student_number = str(student_number)
+    return "*" * max(0, len(student_number) - 4) + student_number[-4:]
+
+
+class RequestLog:
+    """Running and recently finished upstream fetches."""
+
+    def __init__(self, max_recent=1000):
+        self._ids = itertools.count()
+        self._running = {}  # id -> (started, description)
+        self._recent = deque(maxlen=max_recent)  # (duration, finished, ...)
+
+    def begin(self, student_number, year, department_id, priority):
+        request_id = next(self._ids)
+        self._running[request_id] = (
+            time.monotonic(),
+            {
+                "student": mask_student_number(student_number),
+                "year": year,
+                "department": department_id,
+                "priority": priority,
+            },
+        )
+        return request_id
+
+    def end(self, request_id, outcome):
+        started, description = self._running.pop(request_id)
+        self._recent.append(
+            (time.monotonic() - started, time.time(), description, outcome)
+        )
+
+    def running(self):
+        """Running fetches, oldest first, with their age in seconds."""
+        now = time.monotonic()
+        entries = sorted(list(self._running.values()), key=lambda entry: entry[0])
+        return [
+            {**description, "age": round(now - started, 3)}
+            for started, description in entries
+        ]
+
+    def slowest(self, count=10):
+        """The ``count`` slowest of the recently finished fetches."""
+        entries = sorted(list(self._recent), key=lambda entry: entry[0], reverse=True)
+        return [
+            {
+                **description,
+                "duration": round(duration, 3),
+                "finished_at": finished,
+                "outcome": outcome,
+            }
+            for duration, finished, description, outcome in entries[:count]
+        ]
@@ -0,0 +1,360 @@
+"""Connection pooling for requests to the university website.
+
+Builds the HTTP session used by ``fetch_student_marks`` with explicit pool
+sizing, blocking checkout (so a burst waits for a warm connection instead of
+opening and discarding extra TLS connections), TCP keep-alive, a small DNS
+cache and optional HTTP/2. Pool statistics (connection reuse ratio and time
+spent waiting for a free connection) are collected for the metrics endpoint.
+"""
+
+import contextlib
+import logging
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+
+class PoolStats:
+    """Thread-safe counters describing how well connections are reused."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.dns_lookups = 0
+        self.dns_cache_hits = 0
+
+    def record_checkout(self, wait_time):
+        with self._lock:
+            self.requests += 1
+            self.wait_time_total += wait_time
+            self.wait_time_max = max(self.wait_time_max, wait_time)
+
+    def record_new_connection(self):
+        with self._lock:
+            self.new_connections += 1
+
+    def record_dns(self, cache_hit):
+        with self._lock:
+            if cache_hit:
+                self.dns_cache_hits += 1
+            else:
+                self.dns_lookups += 1
+
+    def snapshot(self):
+        with self._lock:
+            reused = max(self.requests - self.new_connections, 0)
+            return {
+                "requests": self.requests,
+                "new_connections": self.new_connections,
+                "reused_connections": reused,
+                "reuse_ratio": reused / self.requests if self.requests else None,
+                "wait_time_avg": (
+                    self.wait_time_total / self.requests if self.requests else None
+                ),
+                "wait_time_max": self.wait_time_max,
+                "dns_lookups": self.dns_lookups,
+                "dns_cache_hits": self.dns_cache_hits,
+            }
+
+
+class DNSCache:
+    """Caches ``getaddrinfo`` answers for a fixed set of hosts for ``ttl`` seconds."""
+
+    def __init__(self, hosts, ttl, stats):
+        self.hosts = set(hosts)
+        self.ttl = ttl
+        self.stats = stats
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def getaddrinfo(self, host, port, *args, **kwargs):
+        if host not in self.hosts:
+            return socket.getaddrinfo(host, port, *args, **kwargs)
+
+        key = (host, port, args, tuple(sorted(kwargs.items())))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and now - entry[0] < self.ttl:
+            self.stats.record_dns(cache_hit=True)
+            return entry[1]
+
+        result = socket.getaddrinfo(host, port, *args, **kwargs)
+        self.stats.record_dns(cache_hit=False)
+        with self._lock:
+            self._entries[key] = (now, result)
+        return result
+
+
+class _CachingSocketModule:
+    """Stand-in for the ``socket`` module inside urllib3 with cached DNS.
+
+    Only urllib3's connection helper sees it, so other HTTP clients in the
+    process (e.g. the Telegram transport) keep their normal resolution.
+    """
+
+    def __init__(self, dns_cache):
+        self._dns_cache = dns_cache
+
+    def getaddrinfo(self, *args, **kwargs):
+        return self._dns_cache.getaddrinfo(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(socket, name)
+
+
+def install_dns_cache(dns_cache):
+    """Route urllib3's name resolution through ``dns_cache``."""
+    from urllib3.util import connection
+
+    connection.socket = _CachingSocketModule(dns_cache)
+
+
+def _instrumented_pool_class(base, stats):
+    """Subclass a urllib3 pool class to report checkouts and new connections."""
+
+    local = threading.local()
+
+    class InstrumentedPool(base):
+        def _get_conn(self, timeout=None):
+            local.new_conn_time = 0.0
+            started = time.perf_counter()
+            conn = super()._get_conn(timeout)
+            # Only time spent waiting for a free slot counts, not connection setup
+            wait_time = time.perf_counter() - started - local.new_conn_time
+            stats.record_checkout(max(wait_time, 0.0))
+            return conn
+
+        def _new_conn(self):
+            started = time.perf_counter()
+            stats.record_new_connection()
+            conn = super()._new_conn()
+            local.new_conn_time = getattr(local, "new_conn_time", 0.0) + (
+                time.perf_counter() - started
+            )
+            return conn
+
+    InstrumentedPool.__name__ = f"Instrumented{base.__name__}"
+    return InstrumentedPool
+
+
+def build_requests_session(config, stats, headers, max_retries):
+    """Build a requests session with a tuned, instrumented connection pool."""
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.connection import HTTPConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+    socket_options = list(HTTPConnection.default_socket_options)
+    if config["keepalive"]:
+        socket_options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+
+    class PooledAdapter(HTTPAdapter):
+        def init_poolmanager(self, *args, **kwargs):
+            kwargs["socket_options"] = socket_options
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = {
+                "http": _instrumented_pool_class(HTTPConnectionPool, stats),
+                "https": _instrumented_pool_class(HTTPSConnectionPool, stats),
+            }
+
+    adapter = PooledAdapter(
+        pool_connections=config["pool_connections"],
+        pool_maxsize=config["pool_maxsize"],
+        pool_block=config["pool_block"],
+        max_retries=max_retries,
+    )
+    session = requests.Session()
+    session.headers.update(headers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+@contextlib.contextmanager
+def _requests_errors(httpx):
+    """Raise httpx transport errors as their ``requests`` equivalents."""
+    import requests
+
+    try:
+        yield
+    except httpx.TimeoutException as e:
+        raise requests.exceptions.Timeout(str(e)) from e
+    except httpx.TransportError as e:
+        raise requests.exceptions.ConnectionError(str(e)) from e
+
+
+class _Http2Response:
+    """The subset of ``requests.Response`` that the fetch pipeline uses.
+
+    The body is only read when asked for: ``iter_content`` streams it, so
+    parsing can stop early as it does over HTTP/1.1.
+    """
+
+    def __init__(self, response, httpx):
+        self._response = response
+        self._httpx = httpx
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.encoding = response.encoding
+
+    @property
+    def content(self):
+        return self.read()
+
+    def read(self):
+        """Read (once) and return the whole body."""
+        with _requests_errors(self._httpx):
+            return self._response.read()
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        with _requests_errors(self._httpx):
+            yield from self._response.iter_bytes(chunk_size)
+
+    def close(self):
+        self._response.close()
+
+
+class Http2Session:
+    """httpx-backed session speaking HTTP/2, with a requests-like ``post``.
+
+    httpx exceptions are translated to their ``requests`` equivalents so the
+    retry handling in ``fetch_student_marks`` works unchanged, and
+    ``max_retries`` (a urllib3 ``Retry`` or a count) is applied to requests
+    that failed to connect, as the HTTP/1.1 adapter does for a POST.
+    """
+
+    def __init__(self, config, stats, headers, max_retries=0):
+        import httpx
+        from urllib3.util.retry import Retry
+
+        self._stats = stats
+        self._httpx = httpx
+        self._retries = Retry.from_int(max_retries)
+        self.headers = dict(headers)
+        self._client = httpx.Client(
+            http2=True,
+            verify=False,  # Matches the verify=False used for the university site
+            headers=self.headers,
+            limits=httpx.Limits(
+                max_connections=config["pool_maxsize"],
+                max_keepalive_connections=config["pool_maxsize"],
+                keepalive_expiry=config["keepalive_expiry"],
+            ),
+        )
+
+    def _trace(self, event_name, info):
+        if event_name == "connection.connect_tcp.started":
+            self._stats.record_new_connection()
+
+    def _send(self, request):
+        """Send with the retry policy; the response body isn't read yet."""
+        from urllib3.exceptions import ConnectTimeoutError, MaxRetryError
+
+        retries = self._retries
+        while True:
+            try:
+                return self._client.send(request, stream=True)
+            except (self._httpx.ConnectError, self._httpx.ConnectTimeout) as e:
+                # Nothing reached the site, so the request is safe to resend
+                try:
+                    retries = retries.increment(
+                        request.method, str(request.url), error=ConnectTimeoutError(e)
+                    )
+                except MaxRetryError:
+                    raise e from None
+                retries.sleep()
+
+    def post(
+        self,
+        url,
+        data=None,
+        headers=None,
+        timeout=None,
+        verify=None,
+        stream=False,
+        **kwargs,
+    ):
+        started = time.perf_counter()
+        request = self._client.build_request(
+            "POST",
+            url,
+            data=data,
+            headers=headers,
+            timeout=timeout,
+            extensions={"trace": self._trace},
+        )
+        try:
+            with _requests_errors(self._httpx):
+                response = _Http2Response(self._send(request), self._httpx)
+            if not stream:
+                try:
+                    response.read()
+                except Exception:
+                    response.close()
+                    raise
+        finally:
+            # httpx doesn't expose pool wait separately; record the checkout
+            # with no wait so request/reuse counts stay comparable
+            self._stats.record_checkout(0.0)
+        logger.debug(f"HTTP/2 POST {url} took {time.perf_counter() - started:.3f}s")
+        return response
+
+    def close(self):
+        self._client.close()
+
+
+class UpstreamPool:
+    """Owns the session for one upstream host and its connection statistics."""
+
+    def __init__(self, base_url, config):
+        self.host = urlsplit(base_url).hostname
+        self.config = config
+        self.stats = PoolStats()
+        self.http2 = False
+        self.dns_cache = None
+        if config["dns_ttl"] > 0 and self.host:
+            self.dns_cache = DNSCache([self.host], config["dns_ttl"], self.stats)
+
+    def build_session(self, headers, max_retries):
+        """Create the session; falls back to HTTP/1.1 if HTTP/2 is unavailable."""
+        if self.dns_cache is not None:
+            install_dns_cache(self.dns_cache)
+
+        if self.config["http2"]:
+            try:
+                import h2  # noqa: F401
+
+                session = Http2Session(self.config, self.stats, headers, max_retries)
+                self.http2 = True
+                logger.info(f"Upstream pool for {self.host}: HTTP/2 enabled")
+                return session
+            except ImportError:
+                logger.warning(
+                    "UPSTREAM_HTTP2 is set but the 'h2' package is missing "
+                    "(pip install 'httpx[http2]'); using HTTP/1.1"
+                )
+
+        logger.info(
+            f"Upstream pool for {self.host}: maxsize={self.config['pool_maxsize']}, "
+            f"block={self.config['pool_block']}, dns_ttl={self.config['dns_ttl']}s"
+        )
+        return build_requests_session(self.config, self.stats, headers, max_retries)
+
+    def snapshot(self):
+        stats = self.stats.snapshot()
+        stats.update(
+            {
+                "host": self.host,
+                "http2": self.http2,
+                "pool_maxsize": self.config["pool_maxsize"],
+                "pool_block": self.config["pool_block"],
+            }
+        )
+        return stats
@@ -0,0 +1,214 @@
+"""Record and replay of university website traffic.
+
+The fetch pipeline talks to a session object with a requests-like ``post``.
+Besides the live session there are two wrappers with the same interface:
+
+- :class:`RecordingSession` forwards to the live session and saves every
+  exchange (request form, status, headers, body and timing) as a fixture.
+  Student numbers and names are replaced with pseudonyms before saving.
+- :class:`ReplaySession` answers from saved fixtures without any network
+  access, sleeping for the recorded time (optionally scaled).
+
+A fixture is ``<key>.json`` (metadata) plus ``<key>.body`` (raw page).
+"""
+
+import hashlib
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+
+from marks_parser import MarksPageParser, response_charset
+
+logger = logging.getLogger(__name__)
+
+
+class FixtureResponse:
+    """The subset of ``requests.Response`` that the fetch pipeline uses.
+
+    ``body_time`` is spread over ``iter_content`` so streamed parsing sees
+    the body arrive at the recorded pace.
+    """
+
+    def __init__(self, status_code, headers, content, body_time=0.0):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self._body_time = body_time
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        chunks = max(1, -(-len(self.content) // chunk_size))
+        delay = self._body_time / chunks
+        for start in range(0, len(self.content), chunk_size):
+            if delay > 0:
+                time.sleep(delay)
+            yield self.content[start : start + chunk_size]
+
+    def close(self):
+        pass
+
+
+def fixture_key(payload):
+    """Stable file name for a (pseudonymized) request form."""
+    fields = "&".join(f"{name}={payload[name]}" for name in sorted(payload))
+    return hashlib.sha256(fields.encode("utf-8")).hexdigest()[:20]
+
+
+class RecordingSession:
+    """Wraps the live session and saves anonymized fixtures of each POST.
+
+    Pseudonyms are derived from ``salt``; without one, a random salt is used
+    for this run and never written to disk, so fixtures can't be mapped
+    back to real student numbers.
+    """
+
+    def __init__(self, session, fixtures_dir, salt=None):
+        self.session = session
+        self.fixtures_dir = fixtures_dir
+        self._salt = salt or secrets.token_hex(16)
+        self._lock = threading.Lock()
+        self.recorded = 0
+        os.makedirs(fixtures_dir, exist_ok=True)
+
+    def pseudonym(self, student_number):
+        digest = hashlib.sha256(f"{self._salt}:{student_number}".encode()).digest()
+        return f"{int.from_bytes(digest[:8], 'big') % 10**10:010d}"
+
+    def post(self, url, data=None, stream=False, **kwargs):
+        started = time.perf_counter()
+        response = self.session.post(url, data=data, stream=True, **kwargs)
+        headers_time = time.perf_counter() - started
+        try:
+            content = response.content
+            body_time = time.perf_counter() - started - headers_time
+            status_code = response.status_code
+            headers = {"Content-Type": response.headers.get("Content-Type", "")}
+        finally:
+            response.close()
+
+        try:
+            self._save(
+                data or {}, status_code, headers, content, headers_time, body_time
+            )
+        except OSError as e:
+            logger.warning(f"Could not save upstream fixture: {e}")
+        return FixtureResponse(status_code, headers, content)
+
+    def _anonymize(self, payload, headers, content):
+        student_number = payload.get("num", "")
+        pseudonym = self.pseudonym(student_number) if student_number else ""
+        payload = dict(payload, num=pseudonym) if student_number else dict(payload)
+        if not student_number or not content:
+            return payload, content
+
+        charset = response_charset(headers.get("Content-Type"))
+        text = content.decode(charset, errors="replace")
+        parser = MarksPageParser()
+        parser.feed(text)
+        parser.close()
+        if parser.student_name:
+            text = text.replace(parser.student_name, f"طالب {pseudonym[-4:]}")
+        text = text.replace(student_number, pseudonym)
+        return payload, text.encode(charset, errors="xmlcharrefreplace")
+
+    def _save(self, payload, status_code, headers, content, headers_time, body_time):
+        payload, content = self._anonymize(payload, headers, content)
+        key = fixture_key(payload)
+        path = os.path.join(self.fixtures_dir, key)
+        with self._lock:
+            with open(path + ".body", "wb") as f:
+                f.write(content)
+            with open(path + ".json", "w", encoding="utf-8") as f:
+                json.dump(
+                    {
+                        "request": payload,
+                        "status_code": status_code,
+                        "headers": headers,
+                        "headers_time": headers_time,
+                        "body_time": body_time,
+                        "recorded_at": time.time(),
+                    },
+                    f,
+                    ensure_ascii=False,
+                    indent=1,
+                )
+            self.recorded += 1
+        logger.info(f"Recorded upstream fixture {key} (status {status_code})")
+
+    def snapshot(self):
+        return {"fixtures_dir": self.fixtures_dir, "recorded": self.recorded}
+
+
+class ReplaySession:
+    """Serves recorded fixtures with their original timing, no network.
+
+    A request matches the fixture with the same form fields (student
+    numbers in fixtures are pseudonyms, so replay those numbers). Any other
+    student number is mapped onto one of the recorded students of the same
+    department and year/season, chosen by hashing the number, so load
+    tests can use arbitrary numbers. ``time_scale`` multiplies the recorded
+    delays (0 = answer instantly).
+    """
+
+    def __init__(self, fixtures_dir, time_scale=1.0):
+        self.fixtures_dir = fixtures_dir
+        self.time_scale = time_scale
+        self.replayed = 0
+        self._fixtures = {}  # key -> metadata
+        self._groups = {}  # form without "num" -> [keys]
+        for file_name in sorted(os.listdir(fixtures_dir)):
+            if not file_name.endswith(".json"):
+                continue
+            with open(os.path.join(fixtures_dir, file_name), encoding="utf-8") as f:
+                fixture = json.load(f)
+            key = file_name[: -len(".json")]
+            self._fixtures[key] = fixture
+            self._groups.setdefault(self._group(fixture["request"]), []).append(key)
+        if not self._fixtures:
+            raise ValueError(f"No upstream fixtures found in {fixtures_dir}")
+        logger.info(f"Replaying {len(self._fixtures)} upstream fixtures")
+
+    @staticmethod
+    def _group(payload):
+        return fixture_key({k: v for k, v in payload.items() if k != "num"})
+
+    def _match(self, payload):
+        key = fixture_key(payload)
+        if key in self._fixtures:
+            return key
+        keys = self._groups.get(self._group(payload))
+        if not keys:
+            return None
+        digest = hashlib.sha256(str(payload.get("num", "")).encode()).digest()
+        return keys[int.from_bytes(digest[:4], "big") % len(keys)]
+
+    def post(self, url, data=None, **kwargs):
+        import requests
+
+        key = self._match(data or {})
+        if key is None:
+            raise requests.exceptions.ConnectionError(
+                f"No recorded fixture for request {data}"
+            )
+        fixture = self._fixtures[key]
+        with open(os.path.join(self.fixtures_dir, key + ".body"), "rb") as f:
+            content = f.read()
+        if self.time_scale > 0:
+            time.sleep(fixture["headers_time"] * self.time_scale)
+        self.replayed += 1
+        return FixtureResponse(
+            fixture["status_code"],
+            fixture["headers"],
+            content,
+            body_time=fixture["body_time"] * self.time_scale,
+        )
+
+    def snapshot(self):
+        return {
+            "fixtures_dir": self.fixtures_dir,
+            "fixtures": len(self._fixtures),
+            "replayed": self.replayed,
+            "time_scale": self.time_scale,
+        }
@@ -0,0 +1,305 @@
+"""Result-change notifications ("watches").
+
+A chat can watch one student number. The registry keeps, per watched
+student, the chats watching it and the snapshot of the result they were
+last told about (``<dir>/<department>/<student>.snap``, encoded with the
+result snapshot codec). The engine re-fetches each watched student once
+per ``interval``, with at most ``concurrency`` fetches at a time, diffs the
+new result against the stored snapshot and notifies the chats only of
+new or changed marks. Several chats watching the same student share one
+fetch.
+
+Subscriptions are saved to ``<dir>/watches.json``; everything here runs on
+the bot's event loop.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+
+from result_snapshot import SnapshotError
+
+logger = logging.getLogger(__name__)
+
+# Columns of a mark row: subject, year, semester, practical, theory, final
+# mark, result. A row is identified by its subject, year and semester.
+KEY_COLUMNS = 3
+FINAL_MARK = 5
+
+
+def _row_keys(rows):
+    """Map each row to its (subject, year, semester, occurrence) key."""
+    keyed = {}
+    seen = {}
+    for row in rows:
+        base = tuple(row[:KEY_COLUMNS])
+        occurrence = seen.get(base, 0)
+        seen[base] = occurrence + 1
+        keyed[base + (occurrence,)] = row
+    return keyed
+
+
+def _has_mark(row):
+    return len(row) > FINAL_MARK and bool(row[FINAL_MARK].strip())
+
+
+def diff_marks(old, new):
+    """Rows of ``new`` with a mark that is new or differs from ``old``.
+
+    Returns a list of ``(old row or None, new row)`` in the new result's
+    order; the old row is None when it had no mark yet. Rows without a
+    final mark and rows that disappeared are not reported.
+    """
+    old_rows = _row_keys(old.get("data") or [])
+    changes = []
+    for key, row in _row_keys(new.get("data") or []).items():
+        if not _has_mark(row):
+            continue
+        previous = old_rows.get(key)
+        if previous != row:
+            changes.append(
+                (previous if previous and _has_mark(previous) else None, row)
+            )
+    return changes
+
+
+class Watch:
+    __slots__ = ("student_number", "department_id", "chats", "next_check")
+
+    def __init__(self, student_number, department_id, chats=(), next_check=0.0):
+        self.student_number = student_number
+        self.department_id = department_id
+        self.chats = set(chats)
+        self.next_check = next_check
+
+
+class WatchRegistry:
+    """Watched students, their subscribers and last notified snapshots."""
+
+    def __init__(self, directory, codec, max_watches):
+        self.directory = directory
+        self.codec = codec
+        self.max_watches = max_watches
+        self._watches = {}  # (department, student) -> Watch
+        self._by_chat = {}  # chat id -> (department, student)
+        self._load()
+
+    def __len__(self):
+        return len(self._watches)
+
+    @property
+    def _index_path(self):
+        return os.path.join(self.directory, "watches.json")
+
+    def _snapshot_path(self, watch):
+        return os.path.join(
+            self.directory, watch.department_id, f"{watch.student_number}.snap"
+        )
+
+    def _load(self):
+        try:
+            with open(self._index_path, encoding="utf-8") as f:
+                stored = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not load watches from {self._index_path}: {e}")
+            return
+        for item in stored.get("watches", []):
+            watch = Watch(
+                item["student"], item["department"], item["chats"], item["next_check"]
+            )
+            key = (watch.department_id, watch.student_number)
+            self._watches[key] = watch
+            for chat_id in watch.chats:
+                self._by_chat[chat_id] = key
+        logger.info(f"Loaded {len(self._watches)} watches")
+
+    def save(self):
+        watches = [
+            {
+                "student": watch.student_number,
+                "department": watch.department_id,
+                "chats": sorted(watch.chats),
+                "next_check": watch.next_check,
+            }
+            for watch in self._watches.values()
+        ]
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self._index_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"watches": watches}, f)
+            os.replace(self._index_path + ".tmp", self._index_path)
+        except OSError as e:
+            logger.warning(f"Could not save watches: {e}")
+
+    def watch_of(self, chat_id):
+        key = self._by_chat.get(chat_id)
+        return self._watches.get(key) if key else None
+
+    def subscribe(self, chat_id, student_number, department_id, result, next_check):
+        """Watch a student for a chat, with ``result`` as the baseline.
+
+        Replaces the chat's previous watch. Returns False if the registry is
+        full (and the student isn't watched already).
+        """
+        key = (department_id, student_number)
+        watch = self._watches.get(key)
+        if watch is None:
+            if len(self._watches) >= self.max_watches:
+                return False
+            watch = self._watches[key] = Watch(
+                student_number, department_id, next_check=next_check
+            )
+            self.store_snapshot(watch, result)
+        if self._by_chat.get(chat_id) not in (None, key):
+            self.unsubscribe(chat_id)
+        watch.chats.add(chat_id)
+        self._by_chat[chat_id] = key
+        self.save()
+        return True
+
+    def unsubscribe(self, chat_id):
+        """Stop the chat's watch; return it, or None if it had none."""
+        key = self._by_chat.pop(chat_id, None)
+        watch = self._watches.get(key) if key else None
+        if watch is None:
+            return None
+        watch.chats.discard(chat_id)
+        if not watch.chats:
+            del self._watches[key]
+            try:
+                os.remove(self._snapshot_path(watch))
+            except OSError:
+                pass
+        self.save()
+        return watch
+
+    def due(self, now):
+        return [watch for watch in self._watches.values() if watch.next_check <= now]
+
+    def load_snapshot(self, watch):
+        try:
+            with open(self._snapshot_path(watch), "rb") as f:
+                return self.codec.decode(f.read())
+        except (OSError, SnapshotError):
+            return None
+
+    def store_snapshot(self, watch, result):
+        path = self._snapshot_path(watch)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + ".tmp", "wb") as f:
+                f.write(self.codec.encode(result))
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            logger.warning(f"Could not save watch snapshot for {path}: {e}")
+
+
+class WatchEngine:
+    """Periodically re-fetches watched students and pushes changes.
+
+    ``fetch(student, department)`` returns a parsed result or None;
+    ``notify(chat_id, watch, changes)`` sends the changes and returns False
+    if the chat can't be reached any more (it is then unsubscribed).
+    """
+
+    def __init__(self, registry, fetch, interval, concurrency, tick=30):
+        self.registry = registry
+        self.fetch = fetch
+        self.interval = interval
+        self.concurrency = concurrency
+        self.tick = tick
+        self.notify = None
+        self._task = None
+        self.checks = 0
+        self.failed = 0
+        self.notifications = 0
+        self.changes = 0
+        self.last_round = None  # (finished at, watches checked, seconds)
+
+    def next_check(self, now):
+        """When a new or just-checked watch is due (spread over 10%)."""
+        return now + self.interval * random.uniform(0.9, 1.0)
+
+    def start(self, notify):
+        """Run the engine on the current loop (no-op if already running)."""
+        self.notify = notify
+        loop = asyncio.get_running_loop()
+        if self._task is not None and not self._task.done():
+            if self._task.get_loop() is loop:
+                return
+        self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            due = self.registry.due(time.time())
+            if due:
+                started = time.monotonic()
+                await self.check_all(due)
+                self.registry.save()
+                self.last_round = (time.time(), len(due), time.monotonic() - started)
+            await asyncio.sleep(self.tick)
+
+    async def check_all(self, watches):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def check_one(watch):
+            async with semaphore:
+                try:
+                    await self.check(watch)
+                except Exception as e:
+                    self.failed += 1
+                    logger.error(f"Watch check failed for {watch.student_number}: {e}")
+
+        await asyncio.gather(*(check_one(watch) for watch in watches))
+
+    async def check(self, watch):
+        """Re-fetch one watched student and notify its chats of changes."""
+        self.checks += 1
+        watch.next_check = self.next_check(time.time())
+        result = await self.fetch(watch.student_number, watch.department_id)
+        if result is None:
+            self.failed += 1
+            return
+        if not watch.chats:
+            return  # Unsubscribed while fetching
+
+        previous = self.registry.load_snapshot(watch)
+        changes = diff_marks(previous, result) if previous is not None else []
+        if previous is None or changes:
+            self.registry.store_snapshot(watch, result)
+        if not changes:
+            return
+
+        self.changes += len(changes)
+        for chat_id in list(watch.chats):
+            if await self.notify(chat_id, watch, changes) is False:
+                logger.info(f"Chat {chat_id} unreachable, removing its watch")
+                self.registry.unsubscribe(chat_id)
+            else:
+                self.notifications += 1
+
+    def snapshot(self):
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "watches": len(self.registry),
+            "interval": self.interval,
+            "concurrency": self.concurrency,
+            "checks": self.checks,
+            "failed": self.failed,
+            "changes": self.changes,
+            "notifications": self.notifications,
+            "last_round": (
+                {
+                    "finished_at": self.last_round[0],
+                    "checked": self.last_round[1],
+                    "seconds": round(self.last_round[2], 3),
+                }
+                if self.last_round
+                else None
+            ),
+        }